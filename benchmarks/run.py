@@ -0,0 +1,217 @@
+"""Benchmark the munge, annotate and liftover hot paths on synthetic data.
+
+Each stage runs in a forked process, which loads its inputs and then runs the
+stage once, so that the wall time, CPU time and peak RSS of a stage are not
+polluted by other stages. Results are written as JSON, so that runs of
+different versions can be compared.
+
+Usage:
+
+    python benchmarks/run.py --rows 1000000 --rows 10000000 --rows 50000000
+"""
+
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import typer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import synthetic  # noqa: E402
+
+import smunger  # noqa: E402
+from smunger.io import check_tool  # noqa: E402
+
+logger = logging.getLogger('benchmark')
+
+STAGES = [
+    'load_sumstats',
+    'munge',
+    'make_SNPID_unique',
+    'harmonize',
+    'save_sumstats',
+    'annotate_rsid_file',
+    'liftover_file',
+]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process, in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def prepare_data(n_rows: int, workdir: str, seed: int) -> Dict[str, str]:
+    """Generate, or reuse, the synthetic inputs of a given size."""
+    prefix = os.path.join(workdir, f'sumstats_{n_rows}_{seed}')
+    files = {
+        'raw': f'{prefix}.txt.gz',
+        'colmap': f'{prefix}.colmap.json',
+        'munged': f'{prefix}.munged.txt',
+        'munged_pkl': f'{prefix}.munged.pkl',
+        'dbsnp_dir': f'{prefix}_dbsnp',
+    }
+    if not os.path.exists(files['raw']):
+        logger.info(f'Generating {n_rows} rows of synthetic sumstats.')
+        raw = synthetic.make_sumstats(n_rows, seed=seed)
+        synthetic.write_sumstats(raw, files['raw'], files['colmap'])
+    if not os.path.exists(files['munged_pkl']):
+        raw = smunger.load_sumstats(files['raw'])
+        munged = smunger.munge(smunger.extract_cols(raw, files['colmap']))
+        munged.to_pickle(files['munged_pkl'])
+        munged.to_csv(files['munged'], sep='\t', index=False, float_format='%g')
+    return files
+
+
+def stage_runner(stage: str, files: Dict[str, str], tmpdir: str) -> Optional[Callable[[], int]]:
+    """
+    Load the inputs of a stage and return a callable that runs it.
+
+    The callable returns the number of output rows. None is returned if the
+    stage can not run in this environment.
+    """
+    if stage == 'load_sumstats':
+        return lambda: len(smunger.load_sumstats(files['raw']))
+    if stage == 'munge':
+        raw = smunger.extract_cols(smunger.load_sumstats(files['raw']), files['colmap'])
+        return lambda: len(smunger.munge(raw))
+    munged = pd.read_pickle(files['munged_pkl'])
+    if stage == 'make_SNPID_unique':
+        return lambda: len(smunger.make_SNPID_unique(munged))
+    if stage == 'harmonize':
+        other = munged.sample(frac=0.5, random_state=0)
+        return lambda: len(smunger.harmonize(munged, other))
+    if stage == 'save_sumstats':
+        bgzipped = all(check_tool_quiet(tool) for tool in ['bgzip', 'tabix'])
+        outfile = os.path.join(tmpdir, 'saved.txt.gz')
+        return lambda: smunger.save_sumstats(munged, outfile, build_index=bgzipped, bgzipped=bgzipped) or len(munged)
+    if stage == 'annotate_rsid_file':
+        if not all(check_tool_quiet(tool) for tool in ['bgzip', 'tabix']):
+            return None
+        if not os.path.exists(os.path.join(files['dbsnp_dir'], 'pos2snp.txt.gz')):
+            raw = smunger.load_sumstats(files['raw'])
+            synthetic.make_dbsnp(raw, files['dbsnp_dir'])
+        database = os.path.join(files['dbsnp_dir'], 'pos2snp.txt.gz')
+        outfile = os.path.join(tmpdir, 'annotated.txt')
+        return lambda: smunger.annotate_rsid_file(files['munged'], outfile, database) or count_rows(outfile)
+    if stage == 'liftover_file':
+        try:
+            from liftover import get_lifter
+
+            get_lifter('hg19', 'hg38')
+        except Exception:
+            return None
+        outfile = os.path.join(tmpdir, 'lifted.txt')
+        return lambda: smunger.liftover_file(files['munged'], outfile, 'hg19', 'hg38') or count_rows(outfile)
+    raise ValueError(f'Unknown stage {stage}.')
+
+
+def check_tool_quiet(tool: str) -> bool:
+    """Check if a tool is installed, without logging errors."""
+    try:
+        check_tool(tool)
+        return True
+    except ValueError:
+        return False
+
+
+def count_rows(filename: str) -> int:
+    """Count rows of a text file with header."""
+    with open(filename, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def run_stage(stage: str, files: Dict[str, str], tmpdir: str, queue: mp.Queue) -> None:
+    """Run a stage in the current process and put its measurements in the queue."""
+    logging.disable(logging.CRITICAL)
+    run = stage_runner(stage, files, tmpdir)
+    if run is None:
+        queue.put({'stage': stage, 'skipped': True})
+        return
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    out_rows = run()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    queue.put(
+        {
+            'stage': stage,
+            'wall_s': round(wall, 4),
+            'cpu_s': round(cpu, 4),
+            'out_rows': out_rows,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_rss_delta_mb': round(peak_rss_mb() - rss_before, 1),
+        }
+    )
+
+
+def measure(stage: str, files: Dict[str, str], tmpdir: str) -> dict:
+    """Run a stage in a forked process."""
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_stage, args=(stage, files, tmpdir, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        return {'stage': stage, 'error': f'exit code {proc.exitcode}'}
+    return queue.get()
+
+
+def git_commit() -> str:
+    """Get the git commit of the working tree, if any."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return ''
+
+
+def main(
+    rows: List[int] = typer.Option([1000000, 10000000, 50000000], "--rows", "-n", help="Number of rows."),
+    stages: List[str] = typer.Option(STAGES, "--stage", "-s", help="Stages to run."),
+    workdir: str = typer.Option("benchmarks/data", "--workdir", "-w", help="Directory of synthetic data."),
+    outdir: str = typer.Option("benchmarks/results", "--outdir", "-o", help="Directory of JSON results."),
+    seed: int = typer.Option(42, "--seed", help="Random seed."),
+):
+    """Benchmark smunger on synthetic summary statistics."""
+    logging.getLogger().setLevel(logging.INFO)
+    os.makedirs(workdir, exist_ok=True)
+    os.makedirs(outdir, exist_ok=True)
+    report = {
+        'version': smunger.__version__,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'results': [],
+    }
+    for n_rows in rows:
+        files = prepare_data(n_rows, workdir, seed)
+        for stage in stages:
+            logger.info(f'Running {stage} on {n_rows} rows.')
+            result = {'rows': n_rows, **measure(stage, files, workdir)}
+            if 'wall_s' in result:
+                result['rows_per_s'] = round(n_rows / result['wall_s'])
+            logger.info(json.dumps(result))
+            report['results'].append(result)
+    outfile = os.path.join(outdir, f"{report['version']}_{report['commit'] or 'nogit'}_{int(time.time())}.json")
+    with open(outfile, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f'Results saved to {outfile}')
+
+
+if __name__ == "__main__":
+    typer.run(main)
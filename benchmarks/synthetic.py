@@ -0,0 +1,185 @@
+"""Generate synthetic summary statistics and a mini dbSNP for benchmarks."""
+
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from smunger.constant import chrom_len
+from smunger.io import compress, index
+
+# raw column names of the synthetic sumstats, mapped to smunger column names
+COLMAP = {
+    'chromosome': 'CHR',
+    'base_pair_location': 'BP',
+    'variant_id': 'rsID',
+    'effect_allele': 'EA',
+    'other_allele': 'NEA',
+    'effect_allele_frequency': 'EAF',
+    'beta': 'BETA',
+    'standard_error': 'SE',
+    'p_value': 'P',
+}
+BASES = np.array(list('ACGT'))
+
+
+def random_indels(rng: np.random.Generator, n: int, max_len: int = 10) -> np.ndarray:
+    """Generate random indel alleles."""
+    lengths = rng.integers(2, max_len + 1, n)
+    letters = BASES[rng.integers(0, 4, lengths.sum())]
+    ends = np.cumsum(lengths)
+    joined = ''.join(letters)
+    return np.array([joined[e - ln : e] for e, ln in zip(ends, lengths)], dtype=object)
+
+
+def make_sumstats(
+    n_rows: int,
+    n_chrom: int = 22,
+    indel_frac: float = 0.1,
+    missing_frac: float = 0.01,
+    dirty_frac: float = 0.01,
+    dup_frac: float = 0.005,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Generate synthetic raw summary statistics.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows.
+    n_chrom : int, optional
+        Number of chromosomes, rows are distributed by chromosome length, by default 22.
+    indel_frac : float, optional
+        Fraction of indels, by default 0.1.
+    missing_frac : float, optional
+        Fraction of missing values in each statistic column, by default 0.01.
+    dirty_frac : float, optional
+        Fraction of rows with invalid or unnormalized values, by default 0.01.
+    dup_frac : float, optional
+        Fraction of duplicated variants, by default 0.005.
+    seed : int, optional
+        Random seed, by default 42.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics, with raw column names, see `COLMAP`.
+    """
+    rng = np.random.default_rng(seed)
+    chroms = np.arange(1, n_chrom + 1)
+    lengths = np.array([chrom_len[c] for c in chroms], dtype=np.float64)
+    chrom = np.sort(rng.choice(chroms, n_rows, p=lengths / lengths.sum()))
+    bp = (rng.random(n_rows) * lengths[chrom - 1]).astype(np.int64) + 1
+    order = np.lexsort((bp, chrom))
+    chrom, bp = chrom[order], bp[order]
+
+    ea = BASES[rng.integers(0, 4, n_rows)].astype(object)
+    nea = BASES[(np.searchsorted(BASES, ea.astype(str)) + rng.integers(1, 4, n_rows)) % 4].astype(object)
+    is_indel = rng.random(n_rows) < indel_frac
+    ea[is_indel] = random_indels(rng, is_indel.sum())
+
+    eaf = rng.beta(0.5, 0.5, n_rows).round(4)
+    beta = rng.normal(0, 0.05, n_rows).round(5)
+    se = rng.uniform(0.005, 0.1, n_rows).round(5)
+    pval = np.clip(rng.random(n_rows) ** 3, 1e-300, 1)
+    df = pd.DataFrame(
+        {
+            'chromosome': chrom.astype(object),
+            'base_pair_location': bp.astype(object),
+            'variant_id': pd.Series(rng.permutation(n_rows) + 1).map('rs{}'.format).values,
+            'effect_allele': ea,
+            'other_allele': nea,
+            'effect_allele_frequency': eaf,
+            'beta': beta,
+            'standard_error': se,
+            'p_value': pval,
+        }
+    )
+    for col in ['effect_allele_frequency', 'beta', 'standard_error', 'p_value', 'variant_id']:
+        df.loc[rng.random(n_rows) < missing_frac, col] = np.nan
+
+    # dirty values, each dirty row gets one kind
+    dirty = np.flatnonzero(rng.random(n_rows) < dirty_frac)
+    kinds = rng.integers(0, 6, len(dirty))
+    df.loc[dirty[kinds == 0], 'chromosome'] = 'chr' + df.loc[dirty[kinds == 0], 'chromosome'].astype(str)
+    df.loc[dirty[kinds == 1], 'effect_allele'] = df.loc[dirty[kinds == 1], 'effect_allele'].str.lower()
+    df.loc[dirty[kinds == 2], 'other_allele'] = 'N'
+    df.loc[dirty[kinds == 3], 'p_value'] = 1.5
+    df.loc[dirty[kinds == 4], 'base_pair_location'] = -1
+    df.loc[dirty[kinds == 5], 'chromosome'] = 'MT'
+
+    n_dup = int(n_rows * dup_frac)
+    if n_dup > 0:
+        dup = df.iloc[rng.integers(0, n_rows, n_dup)].copy()
+        dup['p_value'] = rng.random(n_dup)
+        df = pd.concat([df, dup], ignore_index=True)
+    return df
+
+
+def write_sumstats(df: pd.DataFrame, filename: str, colmap_file: Optional[str] = None) -> None:
+    """Write synthetic sumstats as gzipped tsv, and the column map as json."""
+    df.to_csv(filename, sep='\t', index=False, compression='gzip' if filename.endswith('.gz') else None)
+    if colmap_file:
+        with open(colmap_file, 'w') as f:
+            json.dump(COLMAP, f, indent=4)
+
+
+def make_dbsnp(sumstats: pd.DataFrame, outdir: str, known_frac: float = 0.8, seed: int = 42) -> Dict[str, str]:
+    """
+    Write a mini dbSNP in the `pos2snp` and `snp2pos` formats of `build_dbsnp_tabix.py`.
+
+    A fraction of the variants in the sumstats is included, so that annotation has both hits and misses.
+    The files are bgzipped and tabix indexed, which requires bgzip and tabix.
+
+    Parameters
+    ----------
+    sumstats : pd.DataFrame
+        The synthetic summary statistics.
+    outdir : str
+        Output directory.
+    known_frac : float, optional
+        Fraction of variants found in dbSNP, by default 0.8.
+    seed : int, optional
+        Random seed, by default 42.
+
+    Returns
+    -------
+    Dict[str, str]
+        Paths of the `pos2snp` and `snp2pos` files.
+    """
+    rng = np.random.default_rng(seed)
+    df = sumstats[rng.random(len(sumstats)) < known_frac]
+    df = df[pd.to_numeric(df['chromosome'], errors='coerce').notnull()]
+    df = df[df['base_pair_location'].astype(np.int64) > 0]
+    rsid = np.arange(1, len(df) + 1).astype(str)
+    pos2snp = pd.DataFrame(
+        {
+            'chrom': df['chromosome'].astype(int).values,
+            'pos': df['base_pair_location'].astype(np.int64).values,
+            'rsid': np.char.add('rs', rsid),
+            'ref': df['other_allele'].str.upper().values,
+            'alt': df['effect_allele'].str.upper().values,
+        }
+    ).sort_values(['chrom', 'pos'], kind='mergesort')
+    snp2pos = pd.DataFrame(
+        {
+            'rsid_1st': [r[0] for r in rsid],
+            'rsid': rsid.astype(np.int64),
+            'chrom': pos2snp['chrom'].values,
+            'pos': pos2snp['pos'].values,
+            'ref': pos2snp['ref'].values,
+            'alt': pos2snp['alt'].values,
+        }
+    ).sort_values(['rsid_1st', 'rsid'], kind='mergesort')
+    os.makedirs(outdir, exist_ok=True)
+    files = {}
+    for name, table in [('pos2snp', pos2snp), ('snp2pos', snp2pos)]:
+        filename = os.path.join(outdir, f'{name}.txt')
+        table.to_csv(filename, sep='\t', index=False, header=False)
+        compress(filename)
+        index(filename + '.gz', skip=0)
+        files[name] = filename + '.gz'
+    return files
@@ -25,11 +25,16 @@ from .smunger import (
     harmonize,
 )
 from .liftover import liftover, liftover_file
+from .store import SumstatStore
+from .variants import VariantCatalog
+from .loci import define_loci, loci_file
 from .annotate import (
     annotate_rsid,
     annotate_rsid_file,
     annotate_pos_alleles_from_rsid,
     annotate_pos_alleles_from_rsid_file,
+    update_rsid,
+    update_rsid_file,
 )
 from .plots import qqplot, get_qq_df, manhattan, get_manh_df, qqman
 
@@ -42,5 +47,5 @@ logging.basicConfig(
     level=logging.WARNING,
     format="%(name)s - %(message)s",
     datefmt="[%X]",
-    handlers=[RichHandler(rich_tracebacks=True, show_path=False)],
+    handlers=[RichHandler(console=console, rich_tracebacks=True, show_path=False)],
 )
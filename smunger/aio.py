@@ -0,0 +1,143 @@
+"""Asyncio API of annotation, liftover and harmonization.
+
+Concurrent calls with the same parameters are coalesced into one vectorized
+call by a `Batcher`, which runs in its own thread, so the event loop is never
+blocked by decompression, parsing or lookups. The number of pending calls per
+event loop is bounded, further calls wait, which gives backpressure to
+producers issuing many small queries. A batcher and its thread live until
+`close_batchers`, which is also called at exit.
+
+Example::
+
+    results = await asyncio.gather(*[annotate_rsid_async(df, database) for df in loci])
+"""
+
+import asyncio
+import atexit
+import functools
+import threading
+import weakref
+from typing import Dict
+
+import pandas as pd
+
+from smunger.annotate import annotate_rsid_frame
+from smunger.batch import Batcher
+from smunger.liftover import liftover
+from smunger.smunger import harmonize
+
+MAX_PENDING = 64
+MAX_WAIT = 0.005
+
+_batchers: Dict[tuple, Batcher] = {}
+_batchers_lock = threading.Lock()
+_limits: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = weakref.WeakKeyDictionary()
+
+
+def set_max_pending(max_pending: int) -> None:
+    """Set the maximum number of pending calls per event loop, for loops without pending calls yet."""
+    global MAX_PENDING
+    MAX_PENDING = max_pending
+    _limits.clear()
+
+
+def _limit() -> asyncio.Semaphore:
+    """Get the semaphore bounding the pending calls of the running loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _limits:
+        _limits[loop] = asyncio.Semaphore(MAX_PENDING)
+    return _limits[loop]
+
+
+def _batcher(key: tuple, func) -> Batcher:
+    """Get the batcher shared by the calls with the same parameters."""
+    with _batchers_lock:
+        # a batcher whose thread died, e.g. on KeyboardInterrupt, is replaced
+        if key not in _batchers or not _batchers[key].alive:
+            _batchers[key] = Batcher(func, max_wait=MAX_WAIT)
+        return _batchers[key]
+
+
+def close_batchers() -> None:
+    """Stop the batching threads of the calls made so far, after their pending requests."""
+    with _batchers_lock:
+        for batcher in _batchers.values():
+            batcher.close()
+        _batchers.clear()
+
+
+async def _submit(key: tuple, func, df: pd.DataFrame) -> pd.DataFrame:
+    async with _limit():
+        return await asyncio.wrap_future(_batcher(key, func).submit(df))
+
+
+async def annotate_rsid_async(df: pd.DataFrame, database: str, chunksize: int = 2000000) -> pd.DataFrame:
+    """
+    Annotate variants with rsids, batched with concurrent calls.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Variants, with CHR, BP, EA and NEA columns.
+    database : str
+        dbSNP database, in the pos2snp format.
+    chunksize : int, optional
+        Size of the queried windows, in bp, by default 2000000.
+
+    Returns
+    -------
+    pd.DataFrame
+        The variants with rsids, in the input order.
+    """
+    func = functools.partial(annotate_rsid_frame, database=database, chunksize=chunksize)
+    return await _submit(('annotate_rsid', database, chunksize), func, df)
+
+
+async def liftover_async(df: pd.DataFrame, inbuild: str, outbuild: str) -> pd.DataFrame:
+    """
+    Liftover variants, batched with concurrent calls.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Variants, with CHR and BP columns.
+    inbuild : str
+        Input genome build.
+    outbuild : str
+        Output genome build.
+
+    Returns
+    -------
+    pd.DataFrame
+        The lifted variants, variants failing liftover are removed.
+    """
+    func = functools.partial(liftover, inbuild=inbuild, outbuild=outbuild)
+    return await _submit(('liftover', inbuild, outbuild), func, df)
+
+
+async def harmonize_async(sumstat1: pd.DataFrame, sumstat2: pd.DataFrame, strand_flip: bool = False) -> pd.DataFrame:
+    """
+    Harmonize two summary statistics in the default executor.
+
+    Pairs of summary statistics can not be batched, but the call does not block the event loop.
+
+    Parameters
+    ----------
+    sumstat1 : pd.DataFrame
+        The first summary statistics.
+    sumstat2 : pd.DataFrame
+        The second summary statistics.
+    strand_flip : bool, optional
+        Match variants by position and allow alleles on the opposite strand, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged summary statistics, with suffixes `_1` and `_2`.
+    """
+    async with _limit():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(harmonize, sumstat1, sumstat2, strand_flip))
+
+
+atexit.register(close_batchers)
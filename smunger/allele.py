@@ -0,0 +1,144 @@
+"""Vectorized allele encoding, validation and strand handling.
+
+Alleles are encoded into integer codes against a shared vocabulary of unique
+alleles. Validation, complement and comparison are computed once per unique
+allele and broadcast to the rows through lookup tables indexed by the codes.
+Missing alleles are encoded as -1, every lookup table has an extra trailing
+entry so that code -1 maps to a sentinel value.
+"""
+
+import re
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+VALID_ALLELE = re.compile(r"^[ACGT]+$")
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+class AlleleMatch:
+    """Define how the alleles of a variant match the alleles of another."""
+
+    MISMATCH = -1
+    MATCH = 0  # EA1 == EA2, NEA1 == NEA2
+    SWAP = 1  # EA1 == NEA2, NEA1 == EA2
+    FLIP = 2  # alleles on the opposite strand
+    FLIP_SWAP = 3  # alleles on the opposite strand and swapped
+
+
+def _allele_series(alleles) -> pd.Series:
+    """Get alleles as a Series, string columns are kept as is, other columns are converted to objects."""
+    if isinstance(alleles, pd.Series) and isinstance(alleles.dtype, (pd.StringDtype, pd.ArrowDtype)):
+        return alleles.reset_index(drop=True)
+    return pd.Series(np.asarray(alleles, dtype=object))
+
+
+def encode_alleles(*alleles, upper: bool = True, sort: bool = False) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Encode allele columns into integer codes against a shared vocabulary.
+
+    Parameters
+    ----------
+    *alleles : array-like
+        Allele columns of the same or different lengths.
+    upper : bool, optional
+        Convert alleles to upper case before encoding, by default True.
+    sort : bool, optional
+        Sort the vocabulary, so that the order of codes is the order of alleles, by default False.
+
+    Returns
+    -------
+    Tuple[List[np.ndarray], np.ndarray]
+        The codes of each column, -1 for missing values, and the vocabulary.
+    """
+    sizes = [len(a) for a in alleles]
+    stacked = pd.concat([_allele_series(a) for a in alleles], ignore_index=True)
+    codes, uniques = pd.factorize(stacked, sort=sort and not upper)
+    uniques = np.asarray(uniques, dtype=object)
+    if upper:
+        uniques = np.array([str(u).upper() for u in uniques], dtype=object)
+        vocab_codes, vocab = pd.factorize(uniques, sort=sort)
+        codes = np.where(codes >= 0, vocab_codes[codes], -1)
+        uniques = np.asarray(vocab, dtype=object)
+    splits = np.cumsum(sizes)[:-1]
+    return list(np.split(codes, splits)), uniques
+
+
+def lookup(table: np.ndarray, codes: np.ndarray, missing) -> np.ndarray:
+    """Look up values of codes in a per-allele table, code -1 maps to `missing`."""
+    return np.append(table, np.array([missing], dtype=table.dtype))[codes]
+
+
+def valid_alleles(vocab: np.ndarray) -> np.ndarray:
+    """Whether each allele in the vocabulary only contains one or more ACGT characters."""
+    return np.array([VALID_ALLELE.match(str(a)) is not None for a in vocab], dtype=bool)
+
+
+def complement_codes(vocab: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Map each allele to the code of its reverse complement.
+
+    Complements missing in the vocabulary are appended to it.
+
+    Parameters
+    ----------
+    vocab : np.ndarray
+        The vocabulary.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The complement code of each allele in the vocabulary, -1 for invalid alleles,
+        and the extended vocabulary.
+    """
+    valid = valid_alleles(vocab)
+    index = {a: i for i, a in enumerate(vocab)}
+    extended = list(vocab)
+    comp = np.full(len(vocab), -1, dtype=np.int64)
+    for i in np.flatnonzero(valid):
+        c = str(vocab[i]).translate(COMPLEMENT)[::-1]
+        if c not in index:
+            index[c] = len(extended)
+            extended.append(c)
+        comp[i] = index[c]
+    return comp, np.array(extended, dtype=object)
+
+
+def palindromic(ea: np.ndarray, nea: np.ndarray, vocab: np.ndarray) -> np.ndarray:
+    """Whether the allele pairs are palindromic (A/T, C/G), i.e. strand ambiguous."""
+    comp, _ = complement_codes(vocab)
+    return (ea >= 0) & (nea >= 0) & (lookup(comp, ea, -1) == nea)
+
+
+def match_alleles(ea1, nea1, ea2, nea2) -> np.ndarray:
+    """
+    Compare two sets of alleles, allowing swaps and strand flips.
+
+    Palindromic variants are reported as MATCH or SWAP, they can not be
+    distinguished from FLIP_SWAP or FLIP.
+
+    Parameters
+    ----------
+    ea1, nea1, ea2, nea2 : array-like
+        Allele columns of the same length.
+
+    Returns
+    -------
+    np.ndarray
+        The AlleleMatch status of each row.
+    """
+    (e1, n1, e2, n2), vocab = encode_alleles(ea1, nea1, ea2, nea2)
+    comp, _ = complement_codes(vocab)
+    c1, d1 = lookup(comp, e1, -1), lookup(comp, n1, -1)
+    known = (e1 >= 0) & (n1 >= 0) & (e2 >= 0) & (n2 >= 0)
+    status = np.full(len(e1), AlleleMatch.MISMATCH, dtype=np.int8)
+    conditions = [
+        (AlleleMatch.FLIP_SWAP, (c1 == n2) & (d1 == e2) & (c1 >= 0)),
+        (AlleleMatch.FLIP, (c1 == e2) & (d1 == n2) & (c1 >= 0)),
+        (AlleleMatch.SWAP, (e1 == n2) & (n1 == e2)),
+        (AlleleMatch.MATCH, (e1 == e2) & (n1 == n2)),
+    ]
+    for value, cond in conditions:
+        status[known & cond] = value
+    return status
@@ -1,16 +1,29 @@
 """Module for annotating a file with the results of a Smunger run."""
 
+import functools
 import logging
-import tabix
+from typing import Tuple
+
+import numpy as np
 import pandas as pd
 from subprocess import check_output
 from io import StringIO
+from smunger.checkpoint import job_journal, sync_file, truncate_output
 from smunger.constant import ColName
+from smunger.frames import arrow_io
+from smunger.io import open_output, read_chunks
+from smunger.profiler import profiled
+from smunger.region import cache_stats, get_reader
 from smunger.smunger import make_SNPID_unique
 
 logger = logging.getLogger("annotate")
 
+# digits of the longest rsid number parsed, which fits in int64
+MAX_RSID_DIGITS = 18
+
 
+@arrow_io
+@profiled()
 def annotate_rsid(
     indf: pd.DataFrame,
     database: str,
@@ -21,7 +34,11 @@ def annotate_rsid(
     nea_col: str = ColName.NEA,
 ) -> pd.DataFrame:
     """Annotate a dataframe with rsids."""
-    tb = tabix.open(database)
+    tb = get_reader(
+        database,
+        names=[ColName.CHR, ColName.BP, "rsid", "ref", "alt"],
+        dtype={"rsid": str, "ref": str, "alt": str},
+    )
     chunk_df = make_SNPID_unique(indf, chrom_col, pos_col, ea_col, nea_col)
     # chunk_df = chunk_df.drop_duplicates(subset=[ColName.SNPID])
     if len(chunk_df) == 0:
@@ -29,10 +46,7 @@ def annotate_rsid(
     chrom = chunk_df[chrom_col].iloc[0]
     start = chunk_df[pos_col].min()
     end = chunk_df[pos_col].max()
-    rsid_map = pd.DataFrame(
-        columns=[ColName.CHR, ColName.BP, "rsid", "ref", "alt"],
-        data=tb.query(str(chrom), start - 1, end),
-    )
+    rsid_map = tb.query(str(chrom), start - 1, end)
     rsid_map = make_SNPID_unique(rsid_map, ColName.CHR, ColName.BP, "ref", "alt")
     rsid_map = rsid_map.drop_duplicates(subset=[ColName.SNPID])
     rsid_map = pd.Series(data=rsid_map["rsid"].values, index=rsid_map[ColName.SNPID].values)  # type: ignore
@@ -41,6 +55,46 @@ def annotate_rsid(
     return chunk_df
 
 
+def annotate_rsid_frame(
+    indf: pd.DataFrame,
+    database: str,
+    chunksize: int = 2000000,
+    rsid_col: str = ColName.RSID,
+    chrom_col: str = ColName.CHR,
+    pos_col: str = ColName.BP,
+    ea_col: str = ColName.EA,
+    nea_col: str = ColName.NEA,
+) -> pd.DataFrame:
+    """
+    Annotate a dataframe of any chromosomes with rsids.
+
+    Variants are queried by chromosome, in windows of `chunksize` bp.
+
+    Parameters
+    ----------
+    indf : pd.DataFrame
+        Input variants.
+    database : str
+        dbSNP database, in the pos2snp format.
+    chunksize : int, optional
+        Size of the queried windows, in bp, by default 2000000.
+
+    Returns
+    -------
+    pd.DataFrame
+        The variants with rsids, in the input order. Variants without chromosome or position get no rsid.
+    """
+    df = indf.reset_index(drop=True)
+    valid = df[chrom_col].notnull() & df[pos_col].notnull()
+    # keep an empty part with the rsid column, so that an empty input gets it too
+    parts = [] if len(df) > 0 and valid.all() else [df[~valid].assign(**{rsid_col: None})]
+    for _, chr_df in df[valid].groupby(chrom_col, sort=False):
+        chr_df = chr_df.astype({pos_col: "int64"})
+        for _, chunk_df in chr_df.groupby(chr_df[pos_col] // chunksize):
+            parts.append(annotate_rsid(chunk_df, database, rsid_col, chrom_col, pos_col, ea_col, nea_col))
+    return pd.concat(parts).sort_index()
+
+
 def annotate_rsid_file(
     infile: str,
     outfile: str,
@@ -51,41 +105,224 @@ def annotate_rsid_file(
     pos_col: str = ColName.BP,
     ea_col: str = ColName.EA,
     nea_col: str = ColName.NEA,
+    checkpoint: bool = False,
+    resume: bool = False,
 ) -> None:
-    """Annotate a file with rsids."""
+    """
+    Annotate a file with rsids.
+
+    With `checkpoint`, chunks are committed to a journal, `{outfile}.journal`, so that a job that died is resumed
+    from its last committed chunk with `resume`, see `smunger.checkpoint`. `-` reads stdin or writes stdout, as
+    the chunks are annotated.
+    """
+    params = {
+        "job": "annotate_rsid",
+        "database": database,
+        "chunksize": chunksize,
+        "columns": [rsid_col, chrom_col, pos_col, ea_col, nea_col],
+    }
+    journal = job_journal(infile, outfile, params, checkpoint=checkpoint, resume=resume)
+    committed = 0
+    if journal is not None:
+        truncate_output(outfile, journal)
+        committed = journal.committed
     ith = 0
-    for df in pd.read_csv(infile, sep="\t", chunksize=100000):
-        for chrom, chr_df in df.groupby(chrom_col):
-            chr_df = chr_df.sort_values(pos_col)
-            for i in range(chr_df[pos_col].min(), chr_df[pos_col].max() + 1, chunksize):
-                chunk_df = chr_df[(chr_df[pos_col] >= i) & (chr_df[pos_col] < i + chunksize)].copy()
-                chunk_df = annotate_rsid(
-                    chunk_df, database, rsid_col, chrom_col, pos_col, ea_col, nea_col
-                )
-                logger.info(
-                    f"Processing {chrom}:{i}-{i + chunksize}, chunk No.{ith}, {len(chunk_df)} rows."
-                )
-                ith += 1
-                if ith == 1:
-                    chunk_df.to_csv(outfile, sep="\t", index=False, mode="w")
-                else:
-                    chunk_df.to_csv(outfile, sep="\t", index=False, mode="a", header=False)
+    with open_output(outfile, "w" if journal is None else "a") as f:
+        for df in read_chunks(infile, 100000):
+            for chrom, chr_df in df.groupby(chrom_col):
+                chr_df = chr_df.sort_values(pos_col)
+                for i in range(chr_df[pos_col].min(), chr_df[pos_col].max() + 1, chunksize):
+                    if ith < committed:
+                        ith += 1
+                        continue
+                    chunk_df = chr_df[(chr_df[pos_col] >= i) & (chr_df[pos_col] < i + chunksize)].copy()
+                    chunk_df = annotate_rsid(
+                        chunk_df, database, rsid_col, chrom_col, pos_col, ea_col, nea_col
+                    )
+                    logger.info(
+                        f"Processing {chrom}:{i}-{i + chunksize}, chunk No.{ith}, {len(chunk_df)} rows."
+                    )
+                    chunk_df.to_csv(f, sep="\t", index=False, header=ith == 0)
+                    if journal is None:
+                        # the next stage of a pipe starts on the chunk
+                        f.flush()
+                    else:
+                        journal.commit(chunk=ith, rows=len(chunk_df), offset=sync_file(f))
+                    ith += 1
+    if journal is not None:
+        journal.remove()
+    logger.info(f"Reference cache: {cache_stats()}")
 
 
-def update_rsid(
-    indf: pd.DataFrame,
+@functools.lru_cache(maxsize=4)
+def load_merge_map(database: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the rsid merge history of dbSNP, once per process.
+
+    Chains of merges are resolved in advance, every retired rsid maps to its current rsid.
+
+    Parameters
+    ----------
+    database : str
+        Merge history, the binary `merged_b156.npz` of `smunger.reference.build_merged`, or a text file
+        with the first digit, the retired and the current rsid number per line.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The retired rsid numbers, sorted, and their current rsid numbers, as int64.
+    """
+    if database.endswith(".npz"):
+        with np.load(database) as data:
+            merged = pd.DataFrame({"retired": data["retired"], "current": data["current"]})
+    else:
+        merged = pd.read_csv(
+            database, sep="\t", header=None, usecols=[1, 2], names=["retired", "current"], dtype="int64"
+        )
+    merged = merged.drop_duplicates(subset="retired", keep="first")
+    retired = merged["retired"].to_numpy()
+    current = merged["current"].to_numpy()
+    order = np.argsort(retired, kind="stable")
+    retired, current = retired[order], current[order]
+    # each pass follows the chains by as many merges as the previous passes, so chains resolve in log2(length) passes
+    for _ in range(64 if len(retired) > 0 else 0):
+        idx = np.minimum(np.searchsorted(retired, current), len(retired) - 1)
+        resolved = np.where(retired[idx] == current, current[idx], current)
+        if np.array_equal(resolved, current):
+            break
+        current = resolved
+    # rsids merged into themselves through a cycle are not updated
+    changed = retired != current
+    if len(retired) > 0:
+        # chains into a cycle of more than two rsids never resolve, following them once more still changes them
+        idx = np.minimum(np.searchsorted(retired, current), len(retired) - 1)
+        cyclic = (retired[idx] == current) & (current[idx] != current)
+        if cyclic.any():
+            logger.warning(f"{database} has {int(cyclic.sum())} rsids merged through cycles, they are not updated.")
+            changed &= ~cyclic
+    retired, current = retired[changed], current[changed]
+    logger.info(f"Loaded {len(retired)} merged rsids from {database}.")
+    return retired, current
+
+
+def parse_rsids(rsids: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse rsids like rs123 into their numbers.
+
+    The rsids are parsed as an array of fixed-width code points, without a Python call per rsid. The width is
+    bounded by the longest rsid number that fits in int64, longer values are truncated and are not rsids, so a
+    malformed long value does not widen the array of every row.
+
+    Parameters
+    ----------
+    rsids : pd.Series
+        The rsids.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Whether each value is an rsid, and the rsid numbers, 0 for other values.
+    """
+    # "rs" and the digits, one more code point marks the truncated values
+    chars = rsids.to_numpy(dtype=f"<U{MAX_RSID_DIGITS + 3}")
+    codes = chars.view(np.uint32).reshape(len(chars), MAX_RSID_DIGITS + 3)
+    digits = codes[:, 2:-1].astype(np.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    # shorter values are padded with zero code points
+    is_rs = (
+        (codes[:, 0] == ord("r"))
+        & (codes[:, 1] == ord("s"))
+        & is_digit[:, 0]
+        & (is_digit | (codes[:, 2:-1] == 0)).all(axis=1)
+        & (codes[:, -1] == 0)
+    )
+    numbers = np.zeros(len(chars), dtype=np.int64)
+    for j in range(digits.shape[1]):
+        numbers = np.where(is_digit[:, j], numbers * 10 + digits[:, j], numbers)
+    return is_rs, np.where(is_rs, numbers, 0)
+
+
+@profiled()
+def update_rsid(indf: pd.DataFrame, database: str, rsid_col: str = ColName.RSID) -> pd.DataFrame:
+    """
+    Update retired rsids to their current rsids.
+
+    Parameters
+    ----------
+    indf : pd.DataFrame
+        Input variants, with rsids like rs123.
+    database : str
+        dbSNP merge history, see `load_merge_map`.
+    rsid_col : str, optional
+        rsid column, by default rsID.
+
+    Returns
+    -------
+    pd.DataFrame
+        The variants with updated rsids, the number of updated rsids is saved in `attrs['n_updated']`.
+    """
+    retired, current = load_merge_map(database)
+    df = indf.copy()
+    is_rs, numbers = parse_rsids(df[rsid_col])
+    rows, numbers = np.flatnonzero(is_rs), numbers[is_rs]
+    n_updated = 0
+    if len(retired) > 0 and len(numbers) > 0:
+        # searching sorted queries walks the merge map once, instead of a cache miss per query
+        order = np.argsort(numbers)
+        idx = np.empty_like(order)
+        idx[order] = np.minimum(np.searchsorted(retired, numbers[order]), len(retired) - 1)
+        found = retired[idx] == numbers
+        n_updated = int(found.sum())
+        if n_updated > 0:
+            updated = df[rsid_col].astype(object).to_numpy().copy()
+            updated[rows[found]] = np.char.add("rs", current[idx[found]].astype(str)).astype(object)
+            df[rsid_col] = updated
+    df.attrs["n_updated"] = n_updated
+    logger.debug(f"Updated {n_updated} of {len(df)} rsids.")
+    return df
+
+
+def update_rsid_file(
+    infile: str,
+    outfile: str,
     database: str,
     rsid_col: str = ColName.RSID,
-    chrom_col: str = ColName.CHR,
-    pos_col: str = ColName.BP,
-    ea_col: str = ColName.EA,
-    nea_col: str = ColName.NEA,
-) -> pd.DataFrame:
-    """Update rsids in a dataframe."""
-    # tb = tabix.open(database)
-    pass
+    chunksize: int = 1000000,
+) -> int:
+    """
+    Update the retired rsids of a file, in chunks of rows.
+
+    Parameters
+    ----------
+    infile : str
+        Input file, tab-separated, or `-` for stdin.
+    outfile : str
+        Output file, or `-` for stdout.
+    database : str
+        dbSNP merge history, see `load_merge_map`.
+    rsid_col : str, optional
+        rsid column, by default rsID.
+    chunksize : int, optional
+        Number of rows of a chunk, by default 1000000.
 
+    Returns
+    -------
+    int
+        Number of updated rsids.
+    """
+    n_updated = n_rows = 0
+    with open_output(outfile) as f:
+        for ith, df in enumerate(read_chunks(infile, chunksize, dtype={rsid_col: str})):
+            df = update_rsid(df, database, rsid_col)
+            n_updated += df.attrs["n_updated"]
+            n_rows += len(df)
+            df.to_csv(f, sep="\t", index=False, header=ith == 0)
+            f.flush()
+    logger.info(f"Updated {n_updated} of {n_rows} rsids.")
+    return n_updated
 
+
+@profiled()
 def annotate_alleles_from_rsid_pos(
     indf: pd.DataFrame,
     database: str,
@@ -97,7 +334,11 @@ def annotate_alleles_from_rsid_pos(
 ) -> pd.DataFrame:
     """Annotate a dataframe with rsids."""
     chunk_df = indf.copy()
-    tb = tabix.open(database)
+    tb = get_reader(
+        database,
+        names=["chr_dbsnp", "bp_dbsnp", "rsid_dbsnp", "ref_dbsnp", "alt_dbsnp"],
+        dtype={"rsid_dbsnp": str, "ref_dbsnp": str, "alt_dbsnp": str},
+    )
     chunk_df = chunk_df[
         (chunk_df[rsid_col].notnull())
         & (chunk_df[chrom_col].notnull())
@@ -111,10 +352,7 @@ def annotate_alleles_from_rsid_pos(
     chrom = chunk_df[chrom_col].iloc[0]
     start = chunk_df[pos_col].min()
     end = chunk_df[pos_col].max()
-    query_res = pd.DataFrame(
-        columns=["chr_dbsnp", "bp_dbsnp", "rsid_dbsnp", "ref_dbsnp", "alt_dbsnp"],
-        data=tb.query(str(chrom), start - 1, end),
-    )
+    query_res = tb.query(str(chrom), start - 1, end)
     query_res = query_res.astype(
         {"chr_dbsnp": str, "bp_dbsnp": int, "rsid_dbsnp": str, "ref_dbsnp": str, "alt_dbsnp": str}
     )
@@ -183,7 +421,7 @@ def annotate_alleles_from_rsid_pos_file(
     """Annotate a file with rsids."""
     logger.warning("Annotate alleles from rsID and coordinates is not recommended!!!")
     ith = 0
-    for df in pd.read_csv(infile, sep="\t", chunksize=100000):
+    for df in read_chunks(infile, 100000):
         for chrom, chr_df in df.groupby(chrom_col):
             chr_df = chr_df.sort_values(pos_col)
             start = chr_df[pos_col].min()
@@ -205,6 +443,7 @@ def annotate_alleles_from_rsid_pos_file(
                 end = start + chunksize
 
 
+@profiled()
 def annotate_pos_alleles_from_rsid(
     indf: pd.DataFrame,
     database: str,
@@ -219,7 +458,11 @@ def annotate_pos_alleles_from_rsid(
 ) -> pd.DataFrame:
     """Annotate a dataframe with rsids."""
     chunk_df = indf.copy()
-    tb = tabix.open(database)
+    tb = get_reader(
+        database,
+        names=["rsid_fake_chr", "rsid_fake_pos", "rsid_dbsnp", "chr_dbsnp", "bp_dbsnp", "ref_dbsnp", "alt_dbsnp"],
+        dtype={"rsid_dbsnp": str, "chr_dbsnp": str, "ref_dbsnp": str, "alt_dbsnp": str},
+    )
     chunk_df[rsid_col] = chunk_df[rsid_col].astype(str)
     chunk_df = chunk_df[
         (chunk_df[rsid_col].str.startswith("rs")) & (chunk_df[rsid_col].str.len() >= 3)
@@ -268,18 +511,7 @@ def annotate_pos_alleles_from_rsid(
             #         "alt_dbsnp",
             #     ],
             # )
-            query_res = pd.DataFrame(
-                columns=[
-                    "rsid_fake_chr",
-                    "rsid_fake_pos",
-                    "rsid_dbsnp",
-                    "chr_dbsnp",
-                    "bp_dbsnp",
-                    "ref_dbsnp",
-                    "alt_dbsnp",
-                ],
-                data=tb.query(str(chrom), start - 1, end),
-            )
+            query_res = tb.query(str(chrom), start - 1, end)
             query_res = query_res.astype(
                 {
                     "rsid_fake_chr": int,
@@ -0,0 +1,141 @@
+"""Coalesce concurrent small requests into larger vectorized calls.
+
+Callers submit DataFrames from any thread and get futures. A background thread
+collects the requests arriving within a short window, runs the function once
+on their concatenation, and splits the result back per request.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+import pandas as pd
+
+BATCH_COL = '_smunger_request'
+
+
+class Batcher:
+    """Coalesce concurrent requests into one call of a function on the concatenated DataFrames."""
+
+    def __init__(self, func: Callable[[pd.DataFrame], pd.DataFrame], max_wait: float = 0.005, max_rows: int = 1000000):
+        """
+        Start the batching thread.
+
+        Parameters
+        ----------
+        func : Callable[[pd.DataFrame], pd.DataFrame]
+            The batched function, must keep the columns of its input.
+        max_wait : float, optional
+            Seconds to wait for more requests after the first one, by default 0.005.
+        max_rows : int, optional
+            Maximum number of rows in a batch, by default 1000000.
+        """
+        self.func = func
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self.n_requests = 0
+        self.n_batches = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self) -> bool:
+        """Whether the batching thread is running."""
+        return self._thread.is_alive()
+
+    def submit(self, df: pd.DataFrame) -> Future:
+        """Submit a request, the future gives its result."""
+        if not self.alive:
+            raise RuntimeError('The batching thread has stopped.')
+        future: Future = Future()
+        self._queue.put((df, future))
+        return future
+
+    def close(self) -> None:
+        """Stop the batching thread after the pending requests."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            self._loop()
+        finally:
+            # the requests still queued when the thread dies are failed, not left waiting
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[1].set_exception(RuntimeError('The batching thread has stopped.'))
+
+    def _loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            n_rows = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while n_rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+            self._process(batch)
+
+    def _process(self, batch: List[Tuple[pd.DataFrame, Future]]) -> None:
+        self.n_requests += len(batch)
+        self.n_batches += 1
+        error: BaseException = RuntimeError('The batch did not complete.')
+        try:
+            self._resolve(batch)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # a BaseException, e.g. KeyboardInterrupt, must not leave the callers waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _resolve(self, batch: List[Tuple[pd.DataFrame, Future]]) -> None:
+        """Set the results of a batch, or the exceptions of its bad requests."""
+        try:
+            results = self._call(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # a bad request fails its batch, the requests are retried one by one so only the bad ones fail
+            for item in batch:
+                try:
+                    results = self._call([item])
+                except Exception as e:
+                    item[1].set_exception(e)
+                else:
+                    item[1].set_result(results[0])
+            return
+        for (_, future), out in zip(batch, results):
+            future.set_result(out)
+
+    def _call(self, batch: List[Tuple[pd.DataFrame, Future]]) -> List[pd.DataFrame]:
+        """Run the function once on the concatenated requests and split the result per request."""
+        frames = [df.assign(**{BATCH_COL: i}) for i, (df, _) in enumerate(batch)]
+        result = self.func(pd.concat(frames, ignore_index=True))
+        in_cols = set().union(*[df.columns for df, _ in batch])
+        new_cols = [col for col in result.columns if col not in in_cols and col != BATCH_COL]
+        groups = dict(list(result.groupby(BATCH_COL, sort=False)))
+        return [
+            groups.get(i, result.iloc[:0])[list(df.columns) + new_cols].reset_index(drop=True)
+            for i, (df, _) in enumerate(batch)
+        ]
@@ -0,0 +1,328 @@
+"""Read BGZF and gzip files with parallel or pipelined decompression.
+
+BGZF files, written by bgzip, are a series of independent gzip blocks of at
+most 64 KB, so the blocks can be inflated in parallel on a thread pool (zlib
+releases the GIL). Plain gzip files are inflated in a background thread, so
+that decompression overlaps with parsing. In both cases the decompressed bytes
+are exposed as a stream, which can be passed to `pd.read_csv`.
+"""
+
+import io
+import os
+from abc import abstractmethod
+import queue
+import struct
+import sys
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+BLOCKS_PER_TASK = 8
+READ_SIZE = 1 << 20
+
+
+def default_threads() -> int:
+    """Get the default number of decompression threads."""
+    return min(os.cpu_count() or 1, 8)
+
+
+def is_bgzf(header: bytes) -> bool:
+    """Whether the first bytes of a file are a BGZF block header."""
+    return len(header) >= 16 and header[:4] == BGZF_MAGIC and header[12:14] == b'BC'
+
+
+def read_block(f: BinaryIO) -> Optional[bytes]:
+    """
+    Read a raw BGZF block.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The opened file, positioned at the start of a block.
+
+    Returns
+    -------
+    Optional[bytes]
+        The compressed block, including its header, None at the end of the file.
+    """
+    header = f.read(12)
+    if len(header) == 0:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise ValueError('Invalid BGZF block header.')
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = f.read(xlen)
+    bsize = None
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[i + 2 : i + 4])[0]
+        if extra[i : i + 2] == b'BC':
+            bsize = struct.unpack('<H', extra[i + 4 : i + 6])[0]
+        i += 4 + slen
+    if bsize is None:
+        raise ValueError('Invalid BGZF block, missing block size.')
+    rest = f.read(bsize + 1 - 12 - xlen)
+    if len(rest) != bsize + 1 - 12 - xlen:
+        raise EOFError('Truncated BGZF block.')
+    return header + extra + rest
+
+
+def inflate_block(block: bytes) -> bytes:
+    """Decompress a raw BGZF block."""
+    xlen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12 + xlen : -8], -15)
+    if len(data) != struct.unpack('<I', block[-4:])[0]:
+        raise ValueError('Corrupted BGZF block, size mismatch.')
+    return data
+
+
+def inflate_blocks(blocks: List[bytes]) -> bytes:
+    """Decompress several raw BGZF blocks."""
+    return b''.join(inflate_block(block) for block in blocks)
+
+
+class _PrefetchReader(io.RawIOBase):
+    """Raw reader of decompressed chunks produced by a background thread."""
+
+    def __init__(self, fileobj: BinaryIO, max_pending: int):
+        self._fileobj = fileobj
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._chunk = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @abstractmethod
+    def _produce(self) -> Iterator[Union[bytes, Future]]:
+        """Yield the decompressed chunks, or futures of them, in order."""
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            for item in self._produce():
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._put(e)
+        self._put(None)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._chunk) == 0:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+                return 0
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if isinstance(item, Future):
+                item = item.result()
+            self._chunk = memoryview(item)
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    item = self._queue.get(timeout=0.1)
+                    if isinstance(item, Future):
+                        item.cancel()
+                except queue.Empty:
+                    pass
+            self._fileobj.close()
+        super().close()
+
+
+class BgzfReader(_PrefetchReader):
+    """Read a BGZF file, decompressing blocks in parallel."""
+
+    def __init__(self, fileobj: BinaryIO, threads: Optional[int] = None):
+        self._threads = threads or default_threads()
+        super().__init__(fileobj, max_pending=self._threads * 4)
+
+    def _produce(self) -> Iterator[Union[bytes, Future]]:
+        with ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix='bgzf') as executor:
+            blocks: List[bytes] = []
+            while not self._stop.is_set():
+                block = read_block(self._fileobj)
+                if block is not None:
+                    blocks.append(block)
+                if len(blocks) == BLOCKS_PER_TASK or (block is None and blocks):
+                    yield executor.submit(inflate_blocks, blocks)
+                    blocks = []
+                if block is None:
+                    break
+
+
+class GzipReader(_PrefetchReader):
+    """Read a gzip file, decompressing in a background thread."""
+
+    def __init__(self, fileobj: BinaryIO):
+        super().__init__(fileobj, max_pending=16)
+
+    def _produce(self) -> Iterator[Union[bytes, Future]]:
+        decomp = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        member_open = False
+        data = b''
+        while not self._stop.is_set():
+            chunk = self._fileobj.read(READ_SIZE)
+            data += chunk
+            if not member_open:
+                # zero padding after a member is skipped, as gzip does
+                data = data.lstrip(b'\0')
+                if len(data) < len(GZIP_MAGIC) and chunk:
+                    # at most a magic split across reads is kept
+                    continue
+                if not data.startswith(GZIP_MAGIC):
+                    # trailing garbage is ignored, and not read
+                    break
+            while data:
+                member_open = True
+                out = decomp.decompress(data)
+                if out:
+                    yield out
+                data = b''
+                if decomp.eof:
+                    # concatenated gzip members, the rest is kept for the next read
+                    member_open = False
+                    data = decomp.unused_data.lstrip(b'\0')
+                    decomp = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    if not data.startswith(GZIP_MAGIC):
+                        break
+            if not chunk:
+                break
+        if member_open and not self._stop.is_set():
+            raise EOFError('Compressed file ended before the end-of-stream marker was reached.')
+
+
+class ReplayReader(io.RawIOBase):
+    """Raw stream of bytes read ahead of a stream, followed by the rest of the stream."""
+
+    def __init__(self, head: bytes, fileobj: io.BufferedReader):
+        """Replay `head`, then read `fileobj`, which is closed with this stream."""
+        self._head = head
+        self._pos = 0
+        self._fileobj = fileobj
+
+    def readable(self) -> bool:
+        """Return True, the stream is readable."""
+        return True
+
+    def readinto(self, b) -> int:  # type: ignore[override]
+        """Read the replayed bytes, then from the stream."""
+        if self._pos == len(self._head):
+            data = self._fileobj.read1(len(b))
+        else:
+            data = self._head[self._pos: self._pos + len(b)]
+            self._pos += len(data)
+        b[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        """Close the stream."""
+        if not self.closed:
+            self._fileobj.close()
+        super().close()
+
+
+def peek_ahead(
+    fileobj: io.BufferedReader, size: int = 1, until: Optional[bytes] = None
+) -> Tuple[bytes, io.BufferedReader]:
+    """
+    Peek at the first bytes of a stream, until at least `size` bytes, and `until` if given, or the end.
+
+    A peek at a pipe or stdin only gives the bytes written so far, which are often fewer. The bytes are then
+    read ahead, and replayed before the rest of the stream.
+
+    Parameters
+    ----------
+    fileobj : io.BufferedReader
+        The opened stream.
+    size : int, optional
+        Minimum number of bytes, by default 1.
+    until : Optional[bytes], optional
+        Peek until these bytes are seen, e.g. the end of the first line, by default None.
+
+    Returns
+    -------
+    Tuple[bytes, io.BufferedReader]
+        The bytes, and the stream to read from, `fileobj` itself if it was not read ahead.
+    """
+
+    def enough(data) -> bool:
+        return len(data) >= size and (until is None or until in data)
+
+    head = fileobj.peek(size)
+    if enough(head):
+        return head, fileobj
+    data = bytearray()
+    while not enough(data):
+        chunk = fileobj.read1(READ_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data), io.BufferedReader(ReplayReader(bytes(data), fileobj), buffer_size=READ_SIZE)
+
+
+def open_decompressed(
+    fileobj: BinaryIO, gzipped: Optional[bool] = None, threads: Optional[int] = None
+) -> io.BufferedReader:
+    """
+    Wrap an opened binary file with a decompressing reader.
+
+    Parameters
+    ----------
+    fileobj : BinaryIO
+        The opened file, must support `peek`.
+    gzipped : Optional[bool], optional
+        Whether the file is gzipped, by default detected from the magic bytes.
+    threads : Optional[int], optional
+        Number of threads to decompress BGZF blocks, by default min(cpu_count, 8).
+
+    Returns
+    -------
+    io.BufferedReader
+        The decompressed stream.
+    """
+    header, fileobj = peek_ahead(fileobj, 18)  # type: ignore
+    header = header[:18]
+    if gzipped is None:
+        gzipped = header.startswith(GZIP_MAGIC)
+    if not gzipped:
+        return fileobj  # type: ignore
+    raw: io.RawIOBase
+    if is_bgzf(header):
+        raw = BgzfReader(fileobj, threads)
+    else:
+        raw = GzipReader(fileobj)
+    return io.BufferedReader(raw, buffer_size=READ_SIZE)
+
+
+def open_file(filename: str, gzipped: Optional[bool] = None, threads: Optional[int] = None) -> io.BufferedReader:
+    """Open a plain, gzip or BGZF file for reading decompressed bytes, `-` is stdin."""
+    if filename == '-':
+        # a buffer of the size of the reads, so the separator can be detected from a peek at stdin
+        return open_decompressed(open(sys.stdin.fileno(), 'rb', buffering=READ_SIZE, closefd=False), gzipped, threads)
+    return open_decompressed(open(filename, 'rb', buffering=READ_SIZE), gzipped, threads)
@@ -0,0 +1,248 @@
+"""Content-addressed cache of the outputs of pipeline stages.
+
+An output is keyed by the name and version of its stage, the stage parameters
+and the digests of its inputs, i.e. input files, DataFrames or the keys of
+upstream stages. Rerunning a pipeline after a change recomputes only the
+stages whose inputs, parameters or version changed. Outputs are pickled
+DataFrames, the least recently used ones are evicted when the cache exceeds
+its size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from smunger.parallel import map_row_blocks, row_blocks
+
+logger = logging.getLogger('cache')
+
+READ_SIZE = 1 << 20
+
+_file_digests: Dict[Tuple[str, int, int], str] = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(filename: str) -> str:
+    """
+    Get the digest of the content of a file.
+
+    Digests are memoized per path, size and modification time.
+
+    Parameters
+    ----------
+    filename : str
+        The file.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    with _file_digests_lock:
+        if key in _file_digests:
+            return _file_digests[key]
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            h.update(data)
+    digest = h.hexdigest()
+    with _file_digests_lock:
+        _file_digests[key] = digest
+    return digest
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Get the digest of the columns, types, index and values of a DataFrame."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class StageCache:
+    """Size-bounded, content-addressed cache of stage outputs in a directory."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 20 * 1024**3):
+        """
+        Open a cache directory.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Cache directory, created if missing. It can be shared by processes.
+        max_bytes : int, optional
+            Maximum size of the cached outputs, by default 20 GB.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(stage: str, version: int, params: Optional[dict] = None, *inputs: str) -> str:
+        """
+        Get the key of a stage output.
+
+        Parameters
+        ----------
+        stage : str
+            Stage name.
+        version : int
+            Stage version, bumped when the logic of the stage changes.
+        params : Optional[dict], optional
+            Stage parameters, must be json serializable.
+        *inputs : str
+            Digests of the inputs, or keys of upstream stages.
+
+        Returns
+        -------
+        str
+            The key.
+        """
+        # pickles are read by the pandas version that wrote them
+        payload = json.dumps([stage, version, params or {}, list(inputs), pd.__version__], sort_keys=True, default=str)
+        return f'{stage}-{hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()}'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Get a cached output, None if missing."""
+        path = self._path(key)
+        try:
+            df = pd.read_pickle(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            # a truncated entry, or one pickled by other versions, is recomputed
+            logger.warning(f'Removing unreadable cache entry {key}: {e!r}')
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.misses += 1
+            return None
+        # the modification time tracks the last use, for eviction
+        os.utime(path)
+        self.hits += 1
+        logger.debug(f'Cache hit {key}.')
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Cache an output, evicting the least recently used ones if needed."""
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_pickle(tmp)
+            os.replace(tmp, self._path(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+
+    def get_or_compute(self, key: str, func: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """Get a cached output, or compute and cache it."""
+        df = self.get(key)
+        if df is None:
+            df = func()
+            self.put(key, df)
+        return df
+
+    def map_chunks(
+        self,
+        stage: str,
+        version: int,
+        params: Optional[dict],
+        df: pd.DataFrame,
+        func: Callable[[pd.DataFrame], pd.DataFrame],
+        chunksize: int = 1000000,
+        workers: int = 1,
+    ) -> pd.DataFrame:
+        """
+        Apply a row-wise stage to chunks of rows, reusing the cached outputs of unchanged chunks.
+
+        Parameters
+        ----------
+        stage : str
+            Stage name.
+        version : int
+            Stage version.
+        params : Optional[dict]
+            Stage parameters.
+        df : pd.DataFrame
+            Input.
+        func : Callable[[pd.DataFrame], pd.DataFrame]
+            The stage, its output for a chunk must only depend on the rows of the chunk.
+        chunksize : int, optional
+            Number of rows of a chunk, by default 1000000.
+        workers : int, optional
+            Number of processes computing the missing chunks, see `map_row_blocks`, by default 1.
+
+        Returns
+        -------
+        pd.DataFrame
+            The concatenated outputs of the chunks.
+        """
+        bounds = row_blocks(len(df), chunksize)
+        keys = [self.key(stage, version, params, frame_digest(df.iloc[start:stop])) for start, stop in bounds]
+        parts: List[Optional[pd.DataFrame]] = [self.get(key) for key in keys]
+        missing = [i for i, part in enumerate(parts) if part is None]
+        computed = map_row_blocks(df, func, [bounds[i] for i in missing], workers)
+        for i, part in zip(missing, computed):
+            self.put(keys[i], part)
+            parts[i] = part
+        return parts[0] if len(parts) == 1 else pd.concat(parts)  # type: ignore
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def evict(self) -> None:
+        """Remove the least recently used outputs until the cache fits its size."""
+        entries = sorted(self._entries())
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+            logger.debug(f'Evicted {path}.')
+
+    def clear(self) -> None:
+        """Remove all cached outputs."""
+        for _, _, path in self._entries():
+            os.remove(path)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the counters and the size of the cache."""
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'nbytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,154 @@
+"""Checkpoint journals of long-running chunked jobs.
+
+A journal is a JSON lines file next to the output of a job. Its first line
+holds the parameters of the job, including the size and modification time of
+the input, and each following line records a committed chunk, e.g. its number
+of rows and the byte offset of the output after it. A chunk is committed by
+syncing its output to disk before appending its line to the journal, so the
+journal never records more than the output holds, and a line torn by a crash
+is ignored.
+
+A job resumed with the same parameters skips the committed chunks and
+truncates the output to the offset of the last one, dropping any half-written
+chunk. The journal is removed when the job completes. Only jobs run with
+checkpoints, or resumed, are journaled, which syncs each chunk to disk. Jobs
+reading stdin or writing stdout are not journaled.
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from smunger.io import STDIO
+
+logger = logging.getLogger('checkpoint')
+
+JOURNAL_FORMAT = 'smunger-journal'
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = '.journal'
+
+
+def input_id(filename: str) -> Dict:
+    """Identify an input file by its path, size and modification time."""
+    st = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def sync_file(f) -> int:
+    """Flush an opened file to disk, return its size."""
+    f.flush()
+    os.fsync(f.fileno())
+    return f.tell()
+
+
+class Journal:
+    """Append-only journal of the committed chunks of a job."""
+
+    def __init__(self, path: str, params: Dict, resume: bool = False):
+        """
+        Open a journal.
+
+        Parameters
+        ----------
+        path : str
+            The journal file.
+        params : Dict
+            The parameters of the job, JSON serializable.
+        resume : bool, optional
+            Keep the committed chunks of a journal with the same parameters, by default False, i.e. start over.
+        """
+        self.path = path
+        self.params = json.loads(json.dumps(params))
+        self.entries: List[Dict] = []
+        if resume and os.path.exists(path):
+            self._load()
+        elif resume:
+            logger.info(f'No journal at {path}, starting from the first chunk.')
+        if len(self.entries) == 0:
+            with open(path, 'w') as f:
+                f.write(json.dumps({'format': JOURNAL_FORMAT, 'version': JOURNAL_VERSION, 'params': self.params}))
+                f.write('\n')
+                sync_file(f)
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            lines = f.read().split('\n')
+        header = json.loads(lines[0])
+        if header.get('format') != JOURNAL_FORMAT or header.get('version') != JOURNAL_VERSION:
+            raise ValueError(f'{self.path} is not a smunger journal.')
+        if header['params'] != self.params:
+            raise ValueError(f'{self.path} was written by a job with other parameters or input, run without resume.')
+        for line in lines[1:]:
+            try:
+                self.entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line is torn if the job died while committing, its chunk is not committed
+                break
+        # rewrite the committed lines, dropping a torn one
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines[: len(self.entries) + 1]) + '\n')
+            sync_file(f)
+        logger.info(f'Resuming after {len(self.entries)} committed chunks of {self.path}.')
+
+    @property
+    def committed(self) -> int:
+        """Number of committed chunks."""
+        return len(self.entries)
+
+    def commit(self, **entry) -> None:
+        """Record a chunk whose output is on disk."""
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            sync_file(f)
+        self.entries.append(entry)
+
+    def remove(self) -> None:
+        """Remove the journal of a completed job."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def truncate_output(filename: str, journal: Journal) -> None:
+    """Truncate an output to the offset of the last committed chunk, create it if nothing was committed."""
+    if journal.committed == 0:
+        open(filename, 'w').close()
+        return
+    offset = journal.entries[-1]['offset']
+    if not os.path.exists(filename) or os.path.getsize(filename) < offset:
+        raise ValueError(f'{filename} is shorter than its journal {journal.path}, run without resume.')
+    with open(filename, 'r+b') as f:
+        f.truncate(offset)
+
+
+def job_journal(
+    infile: str, outfile: str, params: Dict, checkpoint: bool = False, resume: bool = False
+) -> Optional[Journal]:
+    """
+    Open the journal of a job.
+
+    Parameters
+    ----------
+    infile : str
+        The input of the job.
+    outfile : str
+        The output of the job, the journal is `{outfile}.journal`.
+    params : Dict
+        The parameters of the job, JSON serializable.
+    checkpoint : bool, optional
+        Journal the job, so it can be resumed if it dies, by default False.
+    resume : bool, optional
+        Resume a journaled job, implies `checkpoint`, by default False.
+
+    Returns
+    -------
+    Optional[Journal]
+        The journal, None without checkpoints, or if the job reads stdin or writes stdout, which cannot be resumed.
+    """
+    if STDIO in (infile, outfile):
+        if resume or checkpoint:
+            raise ValueError('A job reading stdin or writing stdout cannot be checkpointed or resumed.')
+        return None
+    if not (checkpoint or resume):
+        return None
+    return Journal(outfile + JOURNAL_SUFFIX, {**params, 'infile': input_id(infile)}, resume=resume)
@@ -3,6 +3,7 @@
 import logging
 from pathlib import Path
 from enum import Enum
+from typing import List
 import typer
 
 from smunger import __version__, console
@@ -13,8 +14,12 @@ app = typer.Typer(context_settings=CONTEXT_SETTINGS, add_completion=False)
 
 @app.callback(invoke_without_command=True, no_args_is_help=True)
 def main(
+    ctx: typer.Context,
     version: bool = typer.Option(False, "--version", "-V", help="Show version."),
     verbose: bool = typer.Option(False, "--verbose", "-v", help="Show verbose info."),
+    profile: str = typer.Option(
+        None, "--profile", help="Save per-stage time and memory to a json file, in Chrome trace format."
+    ),
 ):
     """smunger: munger for GWAS summary statistics."""
     console.rule("[bold blue]smunger[/bold blue]")
@@ -29,6 +34,11 @@ def main(
         logging.info("Verbose mode is on.")
     else:
         logging.getLogger().setLevel(logging.INFO)
+    if profile:
+        from smunger.profiler import enable_profiling, write_trace
+
+        enable_profiling()
+        ctx.call_on_close(lambda: write_trace(profile))
 
 
 @app.command()
@@ -60,8 +70,8 @@ def mapheader(
 
 @app.command()
 def munge(
-    infile: str = typer.Argument(..., help="Input summary statistics."),
-    outfile: str = typer.Argument(..., help="Output munged summary statistics."),
+    infile: str = typer.Argument(..., help="Input summary statistics, - for stdin."),
+    outfile: str = typer.Argument(..., help="Output summary statistics, - for stdout."),
     colmap: str = typer.Argument(..., help="Column map file, json."),
     sep: str = typer.Option(None, "--sep", "-s", help="Separator of the input file."),
     skiprows: int = typer.Option(0, "--skiprows", "-k", help="Number of rows to skip."),
@@ -79,19 +89,114 @@ def munge(
         5e-8, "--sigsnps-pval", "-P", help="p-value threshold for significant SNPs."
     ),
     report: str = typer.Option(None, "--report", "-R", help="save report to file."),
+    compact: bool = typer.Option(
+        True, "--compact/--no-compact", help="Munge into memory-compact column types, see compact_dtypes."
+    ),
+    float32: bool = typer.Option(
+        False, "--float32", "-f", help="Store float columns as float32 where precision allows."
+    ),
+    cache_dir: str = typer.Option(
+        None, "--cache-dir", "-d", help="Reuse the outputs of unchanged stages cached in this directory."
+    ),
+    cache_size: float = typer.Option(20, "--cache-size", help="Maximum size of the cache, in GB."),
+    layout: str = typer.Option(
+        "text",
+        "--layout",
+        "-l",
+        help="Output layout, text, store, a directory of memory-mapped columns, or shards, a directory of "
+        "bgzipped files per chromosome.",
+    ),
+    shard_mb: int = typer.Option(None, "--shard-mb", help="Split the shards of chromosomes into spans of N Mb."),
+    dedup: str = typer.Option(
+        "min_p", "--dedup", "-D", help="Duplicate to keep, min_p, max_n, max_info, or drop for none."
+    ),
+    dup_report: str = typer.Option(None, "--dup-report", help="save clusters of duplicated SNPs to file."),
+    workers: int = typer.Option(1, "--workers", "-j", help="Number of processes validating rows, 0 for all CPUs."),
+    backend: str = typer.Option(
+        "pandas", "--backend", help="Munge with pandas, or polars, without cache or dup report."
+    ),
+    catalog: str = typer.Option(
+        None, "--catalog", help="Add the VARID of each variant in this variant catalog, which is created or grown."
+    ),
 ):
     """Munge summary statistics."""
+    import json
+
     import smunger
     from smunger.io import load_sumstats, save_sumstats
 
-    df = load_sumstats(
-        infile, sep=sep, skiprows=skiprows, comment=comment, gzipped=gzipped
-    )
-    pre_nrow = len(df)
-    df = smunger.extract_cols(df, colname_map=colmap)
-    df = smunger.munge(df)
+    def extract():
+        df = load_sumstats(
+            infile, sep=sep, skiprows=skiprows, comment=comment, gzipped=gzipped
+        )
+        return smunger.extract_cols(df, colname_map=colmap, backend=backend)
+
+    if cache_dir is None:
+        df = extract()
+        pre_nrow = len(df)
+        df = smunger.munge(
+            df,
+            compact=compact,
+            float32=float32,
+            dedup=dedup,
+            dup_report=dup_report,
+            workers=workers,
+            backend=backend,
+        )
+    else:
+        if backend != "pandas":
+            raise ValueError("The stage cache requires the pandas backend.")
+        if infile == "-":
+            raise ValueError("The stage cache requires an input file.")
+        from smunger.cache import StageCache, file_digest
+        from smunger.smunger import STAGE_VERSION
+
+        cache = StageCache(cache_dir, max_bytes=int(cache_size * 1024**3))
+        with open(colmap) as f:
+            read_params = {
+                "sep": sep, "skiprows": skiprows, "comment": comment, "gzipped": gzipped, "colmap": json.load(f)
+            }
+        extract_key = cache.key("extract", STAGE_VERSION["extract"], read_params, file_digest(infile))
+        df = cache.get_or_compute(extract_key, extract)
+        pre_nrow = len(df)
+        munge_key = cache.key(
+            "munge",
+            STAGE_VERSION["finalize"],
+            {"compact": compact, "float32": float32, "dedup": dedup, "validate": STAGE_VERSION["validate"]},
+            extract_key,
+        )
+        if dup_report:
+            # the report is written by the dedup stage, so only validated chunks are reused
+            df = smunger.munge(
+                df,
+                compact=compact,
+                float32=float32,
+                cache=cache,
+                dedup=dedup,
+                dup_report=dup_report,
+                workers=workers,
+            )
+        else:
+            df = cache.get_or_compute(
+                munge_key,
+                lambda: smunger.munge(
+                    df, compact=compact, float32=float32, cache=cache, dedup=dedup, workers=workers
+                ),
+            )
+        logging.info(f"Stage cache: {cache.stats()}")
+    if catalog:
+        # after the cache, so the catalog grows even when the munged sumstats are reused
+        from smunger.variants import add_variant_ids
+
+        df = add_variant_ids(df, catalog)
     after_nrow = len(df)
-    save_sumstats(df, outfile, build_index=build_index)
+    save_sumstats(
+        df,
+        outfile,
+        build_index=build_index,
+        layout=layout,
+        shard_span=shard_mb * 1000000 if shard_mb else None,
+    )
     from smunger.smunger import get_sigdf
 
     df_sig = get_sigdf(df, pval=sigsnps_pval)
@@ -108,8 +213,6 @@ def munge(
         "non_null_cols": non_null_cols,
     }
     if report:
-        import json
-
         with open(report, "w") as f:
             json.dump(report_json, f, indent=4)
 
@@ -127,11 +230,23 @@ def extract(
     no_bgzip: bool = typer.Option(
         True, "--no-bgzip", "-z", help="Do not bgzip output file."
     ),
+    pval: float = typer.Option(
+        None, "--pval", "-p", help="Extract SNPs with P below this threshold, using the P index."
+    ),
+    top_k: int = typer.Option(
+        None, "--top-k", "-k", help="Extract the k SNPs with the smallest P, using the P index."
+    ),
 ):
     """Extract columns."""
-    from smunger.io import export_sumstats
+    from smunger.io import export_sumstats, save_sumstats
     import json
 
+    if pval is not None or top_k is not None:
+        from smunger.pindex import read_sigsnps
+
+        df_sig = read_sigsnps(infile, pval=pval, top_k=top_k)
+        save_sumstats(df_sig, outfile, build_index=False, bgzipped=no_bgzip)
+        return
     if rename_headers:
         headers_map = json.loads(rename_headers)
     else:
@@ -147,6 +262,35 @@ def extract(
     )
 
 
+@app.command()
+def loci(
+    infile: str = typer.Argument(..., help="Input munged summary statistics."),
+    outprefix: str = typer.Argument(..., help="Output prefix, of the BED file and the directory of extracts."),
+    pval: float = typer.Option(5e-8, "--pval", "-p", help="p-value threshold for significant SNPs."),
+    window: int = typer.Option(500000, "--window", "-w", help="Window on each side of a significant SNP, in bp."),
+    threads: int = typer.Option(1, "--threads", "-t", help="Number of chromosomes processed in parallel."),
+    no_extract: bool = typer.Option(False, "--no-extract", "-n", help="Only save the BED file of loci."),
+):
+    """Define loci around significant SNPs and extract their variants."""
+    from smunger.loci import loci_file
+
+    df_loci = loci_file(infile, outprefix, pval=pval, window=window, threads=threads, extract=not no_extract)
+    if len(df_loci) == 0:
+        console.print("[bold red]No significant SNPs found.[/bold red]")
+
+
+@app.command()
+def stitch(
+    indir: str = typer.Argument(..., help="Shard directory, saved with --layout shards."),
+    outfile: str = typer.Argument(..., help="Output bgzipped summary statistics."),
+    build_index: bool = typer.Option(True, "--build-index", "-b", help="Build tabix index."),
+):
+    """Stitch shards into one file, without sorting."""
+    from smunger.shards import stitch_shards
+
+    stitch_shards(indir, outfile, build_index=build_index)
+
+
 class Build(str, Enum):
     """Genome Builds."""
 
@@ -158,23 +302,46 @@ class Build(str, Enum):
 
 @app.command()
 def liftover(
-    infile: str = typer.Argument(..., help="Input summary statistics."),
-    outfile: str = typer.Argument(..., help="Output munged summary statistics."),
+    infile: str = typer.Argument(..., help="Input summary statistics, - for stdin."),
+    outfile: str = typer.Argument(..., help="Output summary statistics, - for stdout."),
     inbuild: Build = typer.Option(..., "--inbuild", "-i", help="Input build."),
     outbuild: Build = typer.Option(..., "--outbuild", "-o", help="Output build."),
     chromcol: str = typer.Option("CHR", "--chromcol", "-C", help="chromosome column."),
     poscol: str = typer.Option("BP", "--poscol", "-p", help="position column."),
+    chunksize: int = typer.Option(100000, "--chunksize", "-c", help="Chunk size."),
+    bgzipped: bool = typer.Option(False, "--bgzip", "-z", help="bgzip output file."),
+    build_index: bool = typer.Option(
+        False, "--build-index", "-b", help="Build tabix index, requires --bgzip."
+    ),
+    tmpdir: str = typer.Option(None, "--tmpdir", "-t", help="Directory for sorted runs."),
+    checkpoint: bool = typer.Option(
+        False, "--checkpoint", help="Journal the committed chunks, so a failed job can be resumed."
+    ),
+    resume: bool = typer.Option(False, "--resume", help="Resume from the last committed chunk of a failed job."),
 ):
-    """Liftover summary statistics."""
+    """Liftover summary statistics, output is sorted by chromosome and position."""
     from smunger.liftover import liftover_file
 
-    liftover_file(infile, outfile, inbuild, outbuild, chromcol, poscol)
+    liftover_file(
+        infile,
+        outfile,
+        inbuild,
+        outbuild,
+        chromcol,
+        poscol,
+        chunksize=chunksize,
+        bgzipped=bgzipped,
+        build_index=build_index,
+        tmpdir=tmpdir,
+        checkpoint=checkpoint,
+        resume=resume,
+    )
 
 
 @app.command()
 def annorsid(
-    infile: str = typer.Argument(..., help="Input summary statistics."),
-    outfile: str = typer.Argument(..., help="Output munged summary statistics."),
+    infile: str = typer.Argument(..., help="Input summary statistics, - for stdin."),
+    outfile: str = typer.Argument(..., help="Output summary statistics, - for stdout."),
     database: str = typer.Option(..., "--database", "-d", help="Database."),
     chunksize: int = typer.Option(2000000, "--chunksize", "-c", help="Chunk size."),
     rsidcol: str = typer.Option("rsID", "--rsidcol", "-r", help="rsid column."),
@@ -184,15 +351,44 @@ def annorsid(
     neacol: str = typer.Option(
         "NEA", "--neacol", "-n", help="non-effect allele column."
     ),
+    checkpoint: bool = typer.Option(
+        False, "--checkpoint", help="Journal the committed chunks, so a failed job can be resumed."
+    ),
+    resume: bool = typer.Option(False, "--resume", help="Resume from the last committed chunk of a failed job."),
 ):
     """Annotate rsid."""
     from smunger.annotate import annotate_rsid_file
 
     annotate_rsid_file(
-        infile, outfile, database, chunksize, rsidcol, chromcol, poscol, eacol, neacol
+        infile,
+        outfile,
+        database,
+        chunksize,
+        rsidcol,
+        chromcol,
+        poscol,
+        eacol,
+        neacol,
+        checkpoint=checkpoint,
+        resume=resume,
     )
 
 
+@app.command()
+def updatersid(
+    infile: str = typer.Argument(..., help="Input summary statistics, - for stdin."),
+    outfile: str = typer.Argument(..., help="Output summary statistics, - for stdout."),
+    database: str = typer.Option(..., "--database", "-d", help="dbSNP merge history, e.g. merged_b156.npz."),
+    rsidcol: str = typer.Option("rsID", "--rsidcol", "-r", help="rsid column."),
+    chunksize: int = typer.Option(1000000, "--chunksize", "-c", help="Number of rows per chunk."),
+):
+    """Update retired rsids to their current rsids."""
+    from smunger.annotate import update_rsid_file
+
+    n_updated = update_rsid_file(infile, outfile, database, rsidcol, chunksize)
+    console.print(f"Updated {n_updated} rsids.")
+
+
 @app.command()
 def annoallele(
     infile: str = typer.Argument(..., help="Input summary statistics."),
@@ -223,5 +419,41 @@ def annoallele(
     )
 
 
+@app.command("build-ref")
+def build_ref(
+    vcf: str = typer.Argument(..., help="bgzipped and indexed dbSNP VCF, e.g. GCF_000001405.25.gz."),
+    outdir: str = typer.Argument(".", help="Output directory."),
+    version: str = typer.Option("b156", "--dbsnp", "-v", help="dbSNP version, in the names of the outputs."),
+    merged: str = typer.Option(None, "--merged", "-m", help="refsnp-merged.json.bz2, to build the merge history."),
+    threads: int = typer.Option(1, "--threads", "-t", help="Number of contigs processed in parallel."),
+    chunksize: int = typer.Option(1000000, "--chunksize", "-c", help="Number of records per chunk."),
+    tmpdir: str = typer.Option(None, "--tmpdir", help="Directory for the sorted runs."),
+):
+    """Build the pos2snp and snp2pos references of rsid annotation from dbSNP."""
+    from smunger.reference import build_merged, build_reference
+
+    for output in build_reference(vcf, outdir, version, threads, chunksize, tmpdir):
+        console.print(f"Built {output}.")
+    if merged:
+        console.print(f"Built {build_merged(merged, outdir, version, threads)}.")
+
+
+@app.command()
+def serve(
+    database: str = typer.Option(None, "--database", "-d", help="Database for rsid annotation."),
+    builds: List[str] = typer.Option(
+        [], "--liftover", "-l", help="Liftover to load at start, e.g. hg19:hg38, can be repeated."
+    ),
+    host: str = typer.Option("127.0.0.1", "--host", "-H", help="Host."),
+    port: int = typer.Option(8765, "--port", "-P", help="Port."),
+    socket_path: str = typer.Option(None, "--socket", "-s", help="Serve on a Unix socket instead of HTTP."),
+    max_wait: float = typer.Option(5, "--max-wait", "-w", help="Milliseconds to wait for batching requests."),
+):
+    """Serve annotation and liftover requests with warm reference data."""
+    from smunger.server import serve as run_server
+
+    run_server(database, builds, host, port, socket_path, max_wait / 1000)
+
+
 if __name__ == "__main__":
     app()
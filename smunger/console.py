@@ -3,4 +3,5 @@
 from rich.console import Console
 
 
-console = Console()
+# stdout is left to data, so that commands can write to pipes
+console = Console(stderr=True)
@@ -10,6 +10,7 @@ class ColName:
     BP = "BP"
     RSID = "rsID"
     SNPID = 'SNPID'  # unique snpid, chr-bp-sorted(EA,NEA)
+    VARID = 'VARID'  # integer id of the SNPID in a variant catalog, see smunger.variants
     EA = "EA"
     NEA = "NEA"
     P = "P"
@@ -73,6 +74,18 @@ class ColType:
     INFO = float
 
 
+class CompactColType:
+    """Define memory-compact column types of munged summary statistics."""
+
+    CHR = np.int8
+    BP = np.int32
+    RSID = "category"
+    EA = "category"
+    NEA = "category"
+    # float columns that can be stored as float32, P is kept as float64 to keep tiny p-values
+    FLOAT32 = ["BETA", "SE", "EAF", "MAF", "Z"]
+
+
 class ColAllowNA:
     """Define whether a column allows missing values."""
 
@@ -0,0 +1,118 @@
+"""External merge sort for tab-separated text files."""
+
+import heapq
+import logging
+import os
+import tempfile
+from contextlib import ExitStack
+from typing import IO, Any, Callable, Iterable, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger('extsort')
+
+MAX_OPEN_RUNS = 256
+
+
+def int_column_key(col: int) -> Callable[[str], int]:
+    """
+    Make a sort key that reads an integer from a column of a tab-separated line.
+
+    Parameters
+    ----------
+    col : int
+        The 0-based column index.
+
+    Returns
+    -------
+    Callable[[str], int]
+        The key function.
+    """
+
+    def key(line: str) -> int:
+        return int(line.split('\t', col + 1)[col])
+
+    return key
+
+
+def write_run(df: pd.DataFrame, filename: str, sync: bool = False) -> str:
+    """
+    Write a sorted run to disk, without header.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The run, already sorted.
+    filename : str
+        The output file.
+    sync : bool, optional
+        Flush the run to disk before returning, by default False.
+
+    Returns
+    -------
+    str
+        The output file.
+    """
+    with open(filename, 'w') as f:
+        df.to_csv(f, sep='\t', index=False, header=False)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    return filename
+
+
+def _merge_to(runs: List[str], out: IO[str], key: Callable[[str], Any]) -> None:
+    """Merge runs into an opened file."""
+    with ExitStack() as stack:
+        handles = [stack.enter_context(open(run, 'r')) for run in runs]
+        out.writelines(heapq.merge(*handles, key=key))
+
+
+def merge_runs(
+    runs: Iterable[str],
+    out: IO[str],
+    key: Callable[[str], Any],
+    max_open: int = MAX_OPEN_RUNS,
+    tmpdir: Optional[str] = None,
+) -> None:
+    """
+    Merge sorted runs into one sorted stream.
+
+    Runs are merged in rounds of at most `max_open` files, so the number of
+    open file handles and the memory usage are bounded.
+
+    Parameters
+    ----------
+    runs : Iterable[str]
+        Sorted run files, without header.
+    out : TextIO
+        The opened output file.
+    key : Callable[[str], Any]
+        Sort key of a line.
+    max_open : int, optional
+        Maximum number of runs merged at once, by default 256.
+    tmpdir : Optional[str], optional
+        Directory for intermediate runs, by default the directory of the first run.
+    """
+    runs = list(runs)
+    if len(runs) == 0:
+        return
+    tmpdir = tmpdir or os.path.dirname(runs[0])
+    n_round = 0
+    while len(runs) > max_open:
+        merged = []
+        for i in range(0, len(runs), max_open):
+            fd, merged_run = tempfile.mkstemp(prefix=f'merge{n_round}_', suffix='.txt', dir=tmpdir)
+            with os.fdopen(fd, 'w') as f:
+                _merge_to(runs[i : i + max_open], f, key)
+            merged.append(merged_run)
+        logger.debug(f'Merged {len(runs)} runs into {len(merged)} runs.')
+        if n_round > 0:
+            for run in runs:
+                os.remove(run)
+        runs = merged
+        n_round += 1
+    _merge_to(runs, out, key)
+    if n_round > 0:
+        for run in runs:
+            os.remove(run)
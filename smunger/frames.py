@@ -0,0 +1,98 @@
+"""Accept and return Arrow tables and Polars frames in the public functions.
+
+Functions wrapped by `arrow_io` take pyarrow Tables and Polars DataFrames in
+place of pandas DataFrames and return the type of their first frame argument.
+Inputs are converted to pandas through Arrow: string columns become
+Arrow-backed pandas strings and dictionary columns become categoricals, so no
+object arrays are built, and numeric columns without nulls share the Arrow
+buffers. Outputs are converted back from the pandas types of the result, so
+the Arrow types follow `CompactColType`, e.g. int8 CHR and dictionary alleles.
+
+pyarrow and polars are optional, Polars frames are converted through Arrow, so
+they also require pyarrow.
+"""
+
+import functools
+import logging
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('frames')
+
+
+def frame_kind(obj) -> Optional[str]:
+    """Get the kind of a frame, 'pandas', 'arrow' or 'polars', None if it is not a frame."""
+    if isinstance(obj, pd.DataFrame):
+        return 'pandas'
+    module, name = type(obj).__module__.split('.')[0], type(obj).__name__
+    if module == 'pyarrow' and name == 'Table':
+        return 'arrow'
+    if module == 'polars' and name == 'DataFrame':
+        return 'polars'
+    return None
+
+
+def _string_dtype():
+    """Get the Arrow-backed pandas string dtype, with NaN as missing value where supported, as in pandas 3."""
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype('pyarrow')
+
+
+def arrow_to_pandas(table) -> pd.DataFrame:
+    """Convert a pyarrow Table to pandas, without object arrays."""
+    import pyarrow as pa
+
+    string_dtype = _string_dtype()
+    mapping = {pa.string(): string_dtype, pa.large_string(): string_dtype}
+    return table.to_pandas(types_mapper=mapping.get, split_blocks=True)
+
+
+def _require_pyarrow(kind: str):
+    """Import pyarrow, required to convert Arrow tables and Polars frames."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError(f'{kind} frames require pyarrow, install it with `pip install smunger[arrow]`.')
+    return pa
+
+
+def to_pandas_frame(obj) -> pd.DataFrame:
+    """Convert a pyarrow Table or a Polars DataFrame to pandas, a pandas DataFrame is returned as is."""
+    kind = frame_kind(obj)
+    if kind in ('arrow', 'polars'):
+        _require_pyarrow(kind)
+        return arrow_to_pandas(obj.to_arrow() if kind == 'polars' else obj)
+    return obj
+
+
+def from_pandas_frame(df: pd.DataFrame, kind: str):
+    """Convert a pandas DataFrame to a pyarrow Table or a Polars DataFrame."""
+    if kind == 'pandas':
+        return df
+    pa = _require_pyarrow(kind)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if kind == 'polars':
+        import polars as pl
+
+        return pl.from_arrow(table)
+    return table
+
+
+def arrow_io(func: Callable) -> Callable:
+    """Let a function on pandas DataFrames take and return pyarrow Tables and Polars DataFrames."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        kinds = [frame_kind(arg) for arg in list(args) + list(kwargs.values())]
+        kind = next((k for k in kinds if k is not None), 'pandas')
+        if all(k in (None, 'pandas') for k in kinds):
+            return func(*args, **kwargs)
+        args = tuple(to_pandas_frame(arg) for arg in args)
+        kwargs = {key: to_pandas_frame(value) for key, value in kwargs.items()}
+        return from_pandas_frame(func(*args, **kwargs), kind)
+
+    return wrapper
@@ -1,21 +1,41 @@
 """Read and write data from/to files."""
 
-import gzip
 import logging
-import shutil
 import os
+import shutil
+import sys
+from contextlib import contextmanager
 from pathlib import Path
 from subprocess import PIPE, run
-from typing import Optional
+from typing import IO, Iterator, Optional
 
 import pandas as pd
-import tabix
+from .bgzf import BgzfReader, GzipReader, open_file, peek_ahead
 from .constant import ColName
-from .smunger import munge
+from .pindex import build_pindex
+from .profiler import profiled, stage
+from .region import TabixReader
+from .smunger import munge, sort_sumstats
+from .store import write_store
 
 logger = logging.getLogger('io')
 
+# the file name of stdin and stdout
+STDIO = '-'
+
+
+@contextmanager
+def open_output(filename: str, mode: str = 'w') -> Iterator[IO[str]]:
+    """Open a text output, `-` is stdout, which is flushed but not closed."""
+    if filename == STDIO:
+        yield sys.stdout
+        sys.stdout.flush()
+    else:
+        with open(filename, mode) as f:
+            yield f
+
 
+@profiled('read')
 def load_sumstats(
     filename: str,
     sep: Optional[str] = None,
@@ -23,39 +43,93 @@ def load_sumstats(
     skiprows: int = 0,
     comment: Optional[str] = None,
     gzipped: Optional[bool] = None,
+    threads: Optional[int] = None,
 ) -> pd.DataFrame:
-    """Load summary statistics from a file."""
-    # determine whether the file is gzipped
-    if gzipped is None:
-        gzipped = filename.endswith('gz')
-
-    # read the first line of the file to determine the separator
-    if sep is None:
-        if gzipped:
-            with gzip.open(filename, 'rt') as f:
-                line = f.readline()
-        else:
-            with open(filename, 'rt') as f:
-                line = f.readline()
-        if '\t' in line:
-            sep = '\t'
-        elif ',' in line:
-            sep = ','
-        else:
-            sep = ' '
-    logger.info(f'File {filename} is gzipped: {gzipped}')
-    logger.info(f'Separator is {sep}')
-    logger.info(f'loading data from {filename}')
-    # determine the separator, automatically if not specified
-    return pd.read_csv(
-        filename, sep=sep, nrows=nrows, skiprows=skiprows, comment=comment, compression='gzip' if gzipped else None
-    )
+    """
+    Load summary statistics from a file.
+
+    The file is opened once, gzip and BGZF files are decompressed in background
+    threads while the data is parsed, see `smunger.bgzf`.
+
+    Parameters
+    ----------
+    filename : str
+        Input file, plain text, gzip or bgzip compressed, a shard directory, see `smunger.shards`, or `-` for stdin.
+    sep : Optional[str], optional
+        Separator, by default detected from the first line.
+    nrows : Optional[int], optional
+        Number of rows to read, by default all.
+    skiprows : int, optional
+        Number of rows to skip, by default 0.
+    comment : Optional[str], optional
+        Comment character, by default None.
+    gzipped : Optional[bool], optional
+        Whether the file is gzipped, by default detected from the magic bytes.
+    threads : Optional[int], optional
+        Number of threads to decompress BGZF files, by default min(cpu_count, 8).
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics.
+    """
+    if os.path.isdir(filename):
+        # shards read their files with this function
+        from .shards import is_sharded, load_shards
+
+        if is_sharded(filename):
+            return load_shards(filename, nrows=nrows)
+    with open_file(filename, gzipped=gzipped, threads=threads) as opened:
+        logger.info(f'File {filename} is gzipped: {isinstance(opened.raw, (BgzfReader, GzipReader))}')
+        f = opened
+        # read the first line of the file to determine the separator, the whole line even from a pipe
+        if sep is None:
+            head, f = peek_ahead(opened, until=b'\n')
+            line = head.split(b'\n', 1)[0]
+            if b'\t' in line:
+                sep = '\t'
+            elif b',' in line:
+                sep = ','
+            else:
+                sep = ' '
+        logger.info(f'Separator is {sep}')
+        logger.info(f'loading data from {filename}')
+        return pd.read_csv(f, sep=sep, nrows=nrows, skiprows=skiprows, comment=comment)
+
+
+def read_chunks(filename: str, chunksize: int, **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Read a tab-separated file, or the shards of a directory, in chunks of rows.
+
+    Parameters
+    ----------
+    filename : str
+        Input file, plain text, gzip or bgzip compressed, a shard directory, or `-` for stdin.
+    chunksize : int
+        Number of rows of a chunk.
+    **kwargs
+        Passed to `pd.read_csv`.
+
+    Yields
+    ------
+    pd.DataFrame
+        The chunks.
+    """
+    if os.path.isdir(filename):
+        from .shards import is_sharded, read_manifest
+
+        if is_sharded(filename):
+            for shard in read_manifest(filename)['shards']:
+                yield from pd.read_csv(os.path.join(filename, shard['file']), sep='\t', chunksize=chunksize, **kwargs)
+            return
+    with open_file(filename) as f:
+        yield from pd.read_csv(f, sep='\t', chunksize=chunksize, **kwargs)
 
 
 def check_header(filename) -> bool:
-    """Check if the header of a file contains the required columns."""
+    """Check if the header of a file contains the required columns, and optionally VARID, see `smunger.variants`."""
     header = load_sumstats(filename, nrows=5)
-    if list(header.columns) != list(ColName.OUTCOLS):
+    if list(header.columns) not in [list(ColName.OUTCOLS), list(ColName.OUTCOLS) + [ColName.VARID]]:
         logger.error(f'Header of {filename} does not contain the required columns.')
         raise ValueError(f'Header of {filename} does not contain the required columns.')
     else:
@@ -84,8 +158,56 @@ def check_tool(tool: str) -> str:
         raise ValueError(f"{tool} is not installed. Please install it first and make sure it is in your PATH.")
 
 
-def save_sumstats(sumstats: pd.DataFrame, filename: str, build_index: bool = True, bgzipped: bool = True):
-    """Save summary statistics to a file."""
+def save_sumstats(
+    sumstats: pd.DataFrame,
+    filename: str,
+    build_index: bool = True,
+    bgzipped: bool = True,
+    layout: str = 'text',
+    p_index: bool = True,
+    shard_span: Optional[int] = None,
+):
+    """
+    Save summary statistics to a file.
+
+    Parameters
+    ----------
+    sumstats : pd.DataFrame
+        The summary statistics.
+    filename : str
+        Output file, directory of a store or of shards, or `-` to write uncompressed text to stdout.
+    build_index : bool, optional
+        Index the bgzipped text with tabix, by default True.
+    bgzipped : bool, optional
+        Compress the text with bgzip, by default True.
+    layout : str, optional
+        'text' for a tab-separated file, 'store' for a memory-mapped store read by `SumstatStore`,
+        'shards' for a directory of bgzipped files per chromosome, see `smunger.shards`, by default 'text'.
+    p_index : bool, optional
+        Save the P-sorted index of the bgzipped text, read by `read_sigsnps`, by default True.
+    shard_span : Optional[int], optional
+        Span of the shards, in bp, by default one shard per chromosome.
+    """
+    if filename == STDIO and layout != 'text':
+        raise ValueError(f'The {layout} layout cannot be written to stdout.')
+    if layout == 'store':
+        with stage('write', rows_in=len(sumstats)):
+            write_store(sumstats, filename)
+        return
+    if layout == 'shards':
+        from .shards import write_shards
+
+        write_shards(sumstats, filename, span=shard_span, build_index=build_index, p_index=p_index)
+        return
+    if layout != 'text':
+        raise ValueError(f'Unknown layout {layout}, must be text, store or shards.')
+    if filename == STDIO:
+        with stage('sort', rows_in=len(sumstats)):
+            sumstats = sort_sumstats(sumstats)
+        with stage('write', rows_in=len(sumstats)):
+            sumstats.to_csv(sys.stdout, sep='\t', index=False, header=True, float_format='%g')
+        sys.stdout.flush()
+        return
     # save the summary statistics to a file
     filename_path = Path(filename)
     if filename_path.exists():
@@ -93,9 +215,11 @@ def save_sumstats(sumstats: pd.DataFrame, filename: str, build_index: bool = Tru
 
     if filename_path.suffix == '.gz':
         filename_path = filename_path.with_suffix('')
-    sumstats = sumstats.sort_values(by=[ColName.CHR, ColName.BP])
+    with stage('sort', rows_in=len(sumstats)):
+        sumstats = sort_sumstats(sumstats)
     logger.info(f'Saving summary statistics to {filename_path}')
-    sumstats.to_csv(filename_path, sep='\t', index=False, header=True, float_format='%g')
+    with stage('write', rows_in=len(sumstats)):
+        sumstats.to_csv(filename_path, sep='\t', index=False, header=True, float_format='%g')
 
     # compress the file
     if bgzipped:
@@ -103,27 +227,42 @@ def save_sumstats(sumstats: pd.DataFrame, filename: str, build_index: bool = Tru
     # index the file
     if build_index and bgzipped:
         index(str(filename_path) + '.gz')
+    if p_index and bgzipped and ColName.P in sumstats.columns:
+        build_pindex(str(filename_path) + '.gz')
 
 
-def compress(filename: str):
-    """Compress a file with bgzip."""
+@profiled('compress')
+def compress(filename: str, threads: int = 1):
+    """Compress a file with bgzip, on `threads` threads."""
     bgzip = check_tool('bgzip')
     logger.info(f'Compressing {filename} with bgzip')
-    run([bgzip, '-f', str(filename)], stdout=PIPE, stderr=PIPE, check=True)
+    command = [bgzip, '-f', str(filename)] if threads <= 1 else [bgzip, '-f', '-@', str(threads), str(filename)]
+    run(command, stdout=PIPE, stderr=PIPE, check=True)
 
 
-def index(filename: str, start: int = 1, end: int = 2, skip: int = 1):
-    """Index a file with tabix."""
+@profiled('index')
+def index(filename: str, start: int = 1, end: int = 2, skip: int = 1, csi: bool = False):
+    """Index a file with tabix, with a CSI index for positions beyond 2^29."""
     tabix = check_tool('tabix')
     logger.info(f'Indexing {filename} with tabix')
     run(
-        [tabix, '-f', '-S', str(skip), '-s', str(start), '-b', str(end), '-e', str(end), filename],
+        [tabix, '-f'] + (['-C'] if csi else []) + ['-S', str(skip), '-s', str(start), '-b', str(end), '-e', str(end)]
+        + [filename],
         stdout=PIPE,
         stderr=PIPE,
         check=True,
     )
 
 
+def _munge_region(df: pd.DataFrame) -> pd.DataFrame:
+    """Munge the rows of a region, keeping their VARIDs, see `smunger.variants`."""
+    outdf = munge(df)
+    if ColName.VARID in df.columns:
+        outdf[ColName.VARID] = df.loc[outdf.index, ColName.VARID].to_numpy()
+    return outdf
+
+
+@profiled()
 def export_sumstats(
     filename: str,
     chrom: Optional[int] = None,
@@ -134,14 +273,18 @@ def export_sumstats(
     bgzipped: bool = True,
 ) -> pd.DataFrame:
     """Export summary statistics to a file."""
-    if chrom and start and end:
+    if chrom and start and end and os.path.isdir(filename):
+        from .shards import load_shards
+
+        logger.info(f'Loading summary statistics from shards {filename} for {chrom}:{start}-{end}')
+        indf = _munge_region(load_shards(filename, chrom, start + 1, end))
+    elif chrom and start and end:
         logger.info(f'Loading summary statistics from {filename} for {chrom}:{start}-{end}')
-        if not os.path.exists(filename + '.tbi'):
-            raise FileNotFoundError(f'Index file {filename}tbi does not exist. Please index the file first.')
-        else:
-            tb = tabix.open(filename)
-            indf = pd.DataFrame(columns=ColName.OUTCOLS, data=tb.query(str(chrom), start, end))
-            indf = munge(indf)
+        # files saved with a variant catalog have a trailing VARID column
+        names = list(load_sumstats(filename, nrows=0).columns)
+        with TabixReader(filename, names=names) as reader:
+            indf = reader.query(chrom, start, end)
+        indf = _munge_region(indf)
     else:
         logger.info(f'Loading summary statistics from {filename}')
         indf = load_sumstats(filename)
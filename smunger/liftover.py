@@ -1,21 +1,36 @@
 """Liftover summary statistics from one genome build to another."""
 
+import functools
 import logging
-from typing import Tuple
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 import requests  # type: ignore
 from liftover import get_lifter
 
+from smunger.checkpoint import Journal, job_journal
 from smunger.constant import ColName
+from smunger.extsort import int_column_key, merge_runs, write_run
+from smunger.io import STDIO, compress, index, open_output, read_chunks
+from smunger.profiler import profiled, stage
 from smunger.smunger import munge_bp, munge_chr
 
 logger = logging.getLogger('liftover')
 
 
+@functools.lru_cache(maxsize=None)
+def load_lifter(inbuild: str, outbuild: str):
+    """Load the chain file of two genome builds, once per process."""
+    return get_lifter(inbuild, outbuild)
+
+
 def liftover_singlesnp(inbuild: str, outbuild: str, chrom: int, pos: int) -> Tuple[int, int]:
     """Liftover a single SNP from one genome build to another."""
-    lo = get_lifter(inbuild, outbuild)
+    lo = load_lifter(inbuild, outbuild)
     out = lo.query(chrom, pos)
     if len(out) > 0:
         return int(out[0][0][3:]), out[0][1]
@@ -72,6 +87,7 @@ def guess_genome_build(df: pd.DataFrame) -> str:
     return build_guess
 
 
+@profiled()
 def liftover(
     df: pd.DataFrame,
     inbuild: str,
@@ -80,13 +96,13 @@ def liftover(
     pos_col: str = ColName.BP,
 ) -> pd.DataFrame:
     """Liftover summary statistics from one genome build to another."""
-    lo = get_lifter(inbuild, outbuild)
+    lo = load_lifter(inbuild, outbuild)
     df = df.rename(columns={chrom_col: ColName.CHR, pos_col: ColName.BP})
     df = munge_chr(df)
     df = munge_bp(df)
     df[ColName.CHR] = 'chr' + df[ColName.CHR].astype(str)
     df[ColName.CHR] = df[ColName.CHR].str.replace('chr23', 'chrX')
-    df[outbuild] = df.loc[:, [ColName.CHR, ColName.BP]].apply(lambda x: lo.query(x[0], x[1]), axis=1)
+    df[outbuild] = df.loc[:, [ColName.CHR, ColName.BP]].apply(lambda x: lo.query(x.iloc[0], x.iloc[1]), axis=1)
     df[ColName.CHR] = df[outbuild].apply(lambda x: x[0][0] if len(x) > 0 else 0)
     df[ColName.BP] = df[outbuild].apply(lambda x: x[0][1] if len(x) > 0 else 0)
     df.drop(outbuild, axis=1, inplace=True)
@@ -96,6 +112,42 @@ def liftover(
     return df
 
 
+def _lift_runs(
+    infile: str,
+    inbuild: str,
+    outbuild: str,
+    chrom_col: str,
+    pos_col: str,
+    chunksize: int,
+    run_dir: str,
+    journal: Optional[Journal],
+) -> Tuple[Optional[List[str]], Dict[int, List[str]]]:
+    """Lift a file in chunks into sorted runs per chromosome, reusing the runs committed to the journal."""
+    entries = journal.entries if journal is not None else []
+    header = entries[0]['header'] if len(entries) > 0 else None
+    runs: Dict[int, List[str]] = {}
+    for entry in entries:
+        for chrom, run in entry['runs'].items():
+            runs.setdefault(int(chrom), []).append(os.path.join(run_dir, run))
+    for ith, df in enumerate(read_chunks(infile, chunksize)):
+        if ith < len(entries):
+            continue
+        logger.info(f'processing chunk {ith}...')
+        df = liftover(df, inbuild, outbuild, chrom_col, pos_col)
+        if header is None:
+            header = list(df.columns)
+        chunk_runs = {}
+        for chrom, chr_df in df.groupby(chrom_col):
+            chr_df = chr_df.sort_values(pos_col, kind='mergesort')
+            run = write_run(chr_df, os.path.join(run_dir, f'chr{chrom}_{ith}.txt'), sync=journal is not None)
+            chunk_runs[int(chrom)] = os.path.basename(run)  # type: ignore
+        if journal is not None:
+            journal.commit(chunk=ith, rows=len(df), header=header, runs=chunk_runs)
+        for chrom, run in chunk_runs.items():
+            runs.setdefault(chrom, []).append(os.path.join(run_dir, run))
+    return header, runs
+
+
 def liftover_file(
     infile: str,
     outfile: str,
@@ -103,16 +155,102 @@ def liftover_file(
     outbuild: str,
     chrom_col: str = ColName.CHR,
     pos_col: str = ColName.BP,
+    chunksize: int = 100000,
+    bgzipped: bool = False,
+    build_index: bool = False,
+    tmpdir: Optional[str] = None,
+    checkpoint: bool = False,
+    resume: bool = False,
 ) -> None:
-    """Liftover summary statistics from one genome build to another."""
-    chunksize = 100000
+    """
+    Liftover summary statistics from one genome build to another.
+
+    The input is lifted chunk by chunk. Each chunk is split by chromosome, sorted by
+    position and spilled to disk as a sorted run. The runs of each chromosome are then
+    merged, so the output is sorted by chromosome and position while only one chunk
+    is held in memory. With `checkpoint`, the runs of each chunk are committed to a
+    journal, see `smunger.checkpoint`, so a job that died is resumed from its last
+    committed chunk.
+
+    Parameters
+    ----------
+    infile : str
+        Input summary statistics, tab-separated, or `-` for stdin.
+    outfile : str
+        Output file, or `-` for stdout. If bgzipped, the `.gz` suffix is added when missing, otherwise the
+        output is written to `outfile` as is.
+    inbuild : str
+        Input genome build.
+    outbuild : str
+        Output genome build.
+    chrom_col : str, optional
+        Chromosome column, by default ColName.CHR.
+    pos_col : str, optional
+        Position column, by default ColName.BP.
+    chunksize : int, optional
+        Number of rows lifted at once, by default 100000.
+    bgzipped : bool, optional
+        Compress the output with bgzip, by default False.
+    build_index : bool, optional
+        Index the bgzipped output with tabix, by default False.
+    tmpdir : Optional[str], optional
+        Directory for the sorted runs, by default a temporary directory, or with checkpoints the directory of
+        the output.
+    checkpoint : bool, optional
+        Commit the sorted runs of each chunk to `{outfile}.journal`, kept in `{outfile}.runs`, so a job that
+        died can be resumed, by default False.
+    resume : bool, optional
+        Resume a job run with checkpoints that died, reusing the sorted runs of the chunks committed to
+        `{outfile}.journal`, by default False.
+    """
     logger.info(f'liftover {infile}...')
-    ith = 0
-    for df in pd.read_csv(infile, sep='\t', chunksize=chunksize):
-        logger.info(f'processing chunk {ith}...')
-        df = liftover(df, inbuild, outbuild, chrom_col, pos_col)
-        ith += 1
-        if ith == 1:
-            df.to_csv(outfile, sep='\t', index=False)
-        else:
-            df.to_csv(outfile, sep='\t', index=False, mode='a', header=False)
+    out_path = Path(outfile)
+    if bgzipped and out_path.suffix == '.gz':
+        # bgzip adds the suffix back
+        out_path = out_path.with_suffix('')
+    if bgzipped and outfile == STDIO:
+        raise ValueError('Output to stdout is not bgzipped, pipe it to bgzip.')
+    params = {
+        'job': 'liftover',
+        'inbuild': inbuild,
+        'outbuild': outbuild,
+        'columns': [chrom_col, pos_col],
+        'chunksize': chunksize,
+    }
+    journal = job_journal(infile, str(out_path), params, checkpoint=checkpoint, resume=resume)
+    if journal is None:
+        run_dir = tempfile.mkdtemp(prefix='smunger_liftover_', dir=tmpdir)
+    else:
+        # the sorted runs outlive a failed job, they are the committed output of its chunks
+        run_dir = os.path.join(tmpdir or str(out_path.parent), f'{out_path.name}.runs')
+        if journal.committed == 0 and os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir, exist_ok=True)
+    try:
+        header, runs = _lift_runs(infile, inbuild, outbuild, chrom_col, pos_col, chunksize, run_dir, journal)
+        if header is None:
+            raise ValueError(f'No rows found in {infile}.')
+        key = int_column_key(header.index(pos_col))
+        with open_output(str(out_path)) as f:
+            f.write('\t'.join(header) + '\n')
+            for chrom in sorted(runs):
+                logger.info(f'merging {len(runs[chrom])} runs of chromosome {chrom}...')
+                with stage('merge', chrom=chrom, runs=len(runs[chrom])):
+                    merge_runs(runs[chrom], f, key, tmpdir=run_dir)
+    except BaseException:
+        # without a journal, the runs of a failed job cannot be reused
+        if journal is None:
+            shutil.rmtree(run_dir)
+        raise
+    shutil.rmtree(run_dir)
+    if journal is not None:
+        journal.remove()
+
+    if bgzipped:
+        compress(str(out_path))
+        if build_index:
+            index(
+                str(out_path) + '.gz',
+                start=header.index(chrom_col) + 1,
+                end=header.index(pos_col) + 1,
+            )
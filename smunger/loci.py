@@ -0,0 +1,208 @@
+"""Define loci around significant SNPs of munged summary statistics.
+
+Each significant SNP is extended by a window on both sides, overlapping windows
+are merged into loci, and the SNP with the smallest P of a locus is its lead
+SNP. Per chromosome, the SNPs are sorted by position once and the windows are
+merged in one sweep, so defining the loci is O(n log n). Chromosomes are
+processed in parallel.
+
+The loci are saved as a BED file, the variants of each locus are extracted
+from the bgzipped summary statistics by tabix queries, or from one pass over
+the loaded summary statistics if the file is not indexed.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.io import load_sumstats, save_sumstats
+from smunger.pindex import PINDEX_SUFFIX, read_sigsnps
+from smunger.profiler import profiled
+from smunger.region import TabixReader
+from smunger.smunger import get_sigdf
+
+logger = logging.getLogger('loci')
+
+LOCUS_COLS = ['CHR', 'START', 'END', 'LEAD_BP', 'LEAD_EA', 'LEAD_NEA', 'LEAD_P', 'NSIG']
+
+
+def _chrom_loci(chrom: int, bp: np.ndarray, pval: np.ndarray, window: int) -> pd.DataFrame:
+    """Merge the windows of the significant SNPs of a chromosome, return the loci and the row of their lead SNPs."""
+    order = np.argsort(bp, kind='stable')
+    bp, pval = bp[order], pval[order]
+    starts = np.maximum(bp - window, 1)
+    ends = bp + window
+    # a window starting after the furthest end so far opens a new locus
+    prev_end = np.maximum.accumulate(ends)[:-1]
+    locus = np.concatenate([[0], np.cumsum(starts[1:] > prev_end)])
+    first = np.flatnonzero(np.diff(np.concatenate([[-1], locus])))
+    last = np.concatenate([first[1:], [len(bp)]]) - 1
+    # lead SNP, the first SNP with the smallest P of the locus
+    by_p = np.lexsort((np.arange(len(bp)), pval, locus))
+    lead = by_p[np.flatnonzero(np.diff(np.concatenate([[-1], locus[by_p]])))]
+    return pd.DataFrame(
+        {
+            ColName.CHR: chrom,
+            'START': starts[first],
+            'END': np.maximum.reduceat(ends, first),
+            'NSIG': last - first + 1,
+            'row': order[lead],
+        }
+    )
+
+
+@profiled()
+def define_loci(sigdf: pd.DataFrame, window: int = 500000, threads: int = 1) -> pd.DataFrame:
+    """
+    Define loci by merging the windows around significant SNPs.
+
+    Parameters
+    ----------
+    sigdf : pd.DataFrame
+        Significant SNPs, see `get_sigdf`.
+    window : int, optional
+        Window on each side of a significant SNP, in bp, by default 500000.
+    threads : int, optional
+        Number of chromosomes processed in parallel, by default 1.
+
+    Returns
+    -------
+    pd.DataFrame
+        The loci, with 1-based inclusive START and END, the lead SNP and the number of significant SNPs,
+        sorted by chromosome and position.
+    """
+    for col in [ColName.CHR, ColName.BP, ColName.P]:
+        if col not in sigdf.columns:
+            raise ValueError(f"Missing {col} column.")
+    if len(sigdf) == 0:
+        return pd.DataFrame(columns=LOCUS_COLS)
+    chrom = sigdf[ColName.CHR].to_numpy(dtype=np.int64)
+    bp = sigdf[ColName.BP].to_numpy(dtype=np.int64)
+    pval = sigdf[ColName.P].to_numpy(dtype=np.float64)
+    rows = {int(c): np.flatnonzero(chrom == c) for c in np.unique(chrom)}
+
+    def run(c: int) -> pd.DataFrame:
+        loci = _chrom_loci(c, bp[rows[c]], pval[rows[c]], window)
+        loci['row'] = rows[c][loci['row'].to_numpy()]
+        return loci
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix='loci') as executor:
+        loci = pd.concat(list(executor.map(run, sorted(rows))), ignore_index=True)
+    lead = sigdf.iloc[loci['row'].to_numpy()]
+    loci['LEAD_BP'] = lead[ColName.BP].to_numpy()
+    loci['LEAD_EA'] = lead[ColName.EA].to_numpy() if ColName.EA in lead.columns else None
+    loci['LEAD_NEA'] = lead[ColName.NEA].to_numpy() if ColName.NEA in lead.columns else None
+    loci['LEAD_P'] = lead[ColName.P].to_numpy()
+    logger.info(f'Defined {len(loci)} loci from {len(sigdf)} significant SNPs.')
+    return loci[LOCUS_COLS]
+
+
+def locus_name(locus) -> str:
+    """Name of a locus, chr{CHR}_{START}_{END}."""
+    return f'chr{locus[ColName.CHR]}_{locus["START"]}_{locus["END"]}'
+
+
+def save_bed(loci: pd.DataFrame, filename: str) -> None:
+    """Save loci as a BED file, with 0-based START, and the lead SNPs as extra columns."""
+    bed = loci.copy()
+    bed['START'] = bed['START'] - 1
+    bed.insert(3, 'NAME', [locus_name(locus) for _, locus in loci.iterrows()])
+    bed = bed.rename(columns={ColName.CHR: f'#{ColName.CHR}'})
+    bed.to_csv(filename, sep='\t', index=False, header=True, float_format='%g')
+
+
+def _extract_indexed(filename: str, loci: pd.DataFrame, threads: int) -> Dict[str, pd.DataFrame]:
+    """Extract the variants of the loci by tabix queries, one reader per chromosome."""
+    names = pd.read_csv(filename, sep='\t', nrows=0).columns.tolist()
+
+    def run(chr_loci: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        with TabixReader(filename, names=names) as reader:
+            return {
+                locus_name(locus): reader.query(locus[ColName.CHR], locus['START'] - 1, locus['END'])
+                for _, locus in chr_loci.iterrows()
+            }
+
+    extracts: Dict[str, pd.DataFrame] = {}
+    with ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix='loci') as executor:
+        for part in executor.map(run, [chr_loci for _, chr_loci in loci.groupby(ColName.CHR, sort=True)]):
+            extracts.update(part)
+    return extracts
+
+
+def _extract_loaded(sumstats: pd.DataFrame, loci: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Extract the variants of the loci in one pass over the summary statistics."""
+    extracts: Dict[str, pd.DataFrame] = {}
+    for chrom, chr_loci in loci.groupby(ColName.CHR, sort=True):
+        chr_df = sumstats[sumstats[ColName.CHR] == chrom]
+        bp = chr_df[ColName.BP].to_numpy()
+        order = np.argsort(bp, kind='stable')
+        # loci do not overlap, each is a contiguous slice of the sorted positions
+        lo = np.searchsorted(bp[order], chr_loci['START'].to_numpy(), side='left')
+        hi = np.searchsorted(bp[order], chr_loci['END'].to_numpy(), side='right')
+        for (_, locus), i, j in zip(chr_loci.iterrows(), lo, hi):
+            extracts[locus_name(locus)] = chr_df.iloc[order[i:j]].reset_index(drop=True)
+    return extracts
+
+
+@profiled()
+def loci_file(
+    filename: str,
+    outprefix: str,
+    pval: float = 5e-8,
+    window: int = 500000,
+    threads: int = 1,
+    extract: bool = True,
+) -> pd.DataFrame:
+    """
+    Define the loci of munged summary statistics, save them as a BED file and extract their variants.
+
+    Significant SNPs are read with the P index and loci are extracted by tabix queries if the file has them,
+    otherwise the summary statistics are loaded once.
+
+    Parameters
+    ----------
+    filename : str
+        Munged summary statistics, see `save_sumstats`.
+    outprefix : str
+        Output prefix, loci are saved to `{outprefix}.bed` and extracts to
+        `{outprefix}/chr{CHR}_{START}_{END}.txt.gz`.
+    pval : float, optional
+        P value threshold of significant SNPs, by default 5e-8.
+    window : int, optional
+        Window on each side of a significant SNP, in bp, by default 500000.
+    threads : int, optional
+        Number of chromosomes processed in parallel, by default 1.
+    extract : bool, optional
+        Extract the variants of each locus, by default True.
+
+    Returns
+    -------
+    pd.DataFrame
+        The loci.
+    """
+    indexed = os.path.exists(filename + '.tbi') or os.path.exists(filename + '.csi')
+    sumstats: Optional[pd.DataFrame] = None
+    if os.path.exists(filename + PINDEX_SUFFIX):
+        sigdf = read_sigsnps(filename, pval=pval)
+    else:
+        sumstats = load_sumstats(filename)
+        sigdf = get_sigdf(sumstats, pval=pval)
+    loci = define_loci(sigdf, window=window, threads=threads)
+    save_bed(loci, f'{outprefix}.bed')
+    if extract and len(loci) > 0:
+        if indexed:
+            extracts = _extract_indexed(filename, loci, threads)
+        else:
+            if sumstats is None:
+                sumstats = load_sumstats(filename)
+            extracts = _extract_loaded(sumstats, loci)
+        os.makedirs(outprefix, exist_ok=True)
+        for name, locus_df in extracts.items():
+            save_sumstats(locus_df, os.path.join(outprefix, f'{name}.txt.gz'), build_index=False, p_index=False)
+        logger.info(f'Extracted {len(extracts)} loci to {outprefix}.')
+    return loci
@@ -0,0 +1,94 @@
+"""Apply row-wise stages to blocks of rows on a process pool.
+
+Workers are started by a fork server, or spawned, never forked from the
+parent, which may be running decompression threads whose locks a fork would
+copy while they are held. The blocks are pickled to the workers and their
+outputs pickled back. The stages profiled in the workers are sent back with
+the outputs and merged into the profile of the parent, see `smunger.profiler`.
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import BaseContext
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import pandas as pd
+
+from smunger.profiler import add_events, disable_profiling, enable_profiling, get_events, is_profiling
+
+logger = logging.getLogger('parallel')
+
+
+def pool_context() -> BaseContext:
+    """Get the start method of worker processes, a fork server where available, else spawn."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # the server imports the package once, before it starts any thread, and forks the workers
+        context.set_forkserver_preload(['smunger'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def default_workers() -> int:
+    """Get the number of CPUs available to the process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def row_blocks(nrows: int, blocksize: int) -> List[Tuple[int, int]]:
+    """Split rows into blocks of at most `blocksize` rows, an empty frame has one empty block."""
+    return [(start, min(start + blocksize, nrows)) for start in range(0, max(nrows, 1), blocksize)]
+
+
+def _apply_profiled(
+    func: Callable[[pd.DataFrame], pd.DataFrame], block: pd.DataFrame, profiling: bool
+) -> Tuple[pd.DataFrame, List[Dict]]:
+    """Apply a stage in a worker, with the stages it profiled."""
+    # workers are reused across maps, which may differ in profiling
+    if not profiling:
+        disable_profiling()
+        return func(block), []
+    enable_profiling()
+    return func(block), get_events()
+
+
+def map_row_blocks(
+    df: pd.DataFrame,
+    func: Callable[[pd.DataFrame], pd.DataFrame],
+    bounds: Sequence[Tuple[int, int]],
+    workers: int = 1,
+) -> List[pd.DataFrame]:
+    """
+    Apply a row-wise stage to blocks of rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Input.
+    func : Callable[[pd.DataFrame], pd.DataFrame]
+        The stage, a picklable function whose output for a block only depends on the rows of the block.
+    bounds : Sequence[Tuple[int, int]]
+        Start and stop of the blocks, see `row_blocks`.
+    workers : int, optional
+        Number of processes, by default 1, i.e. the blocks are processed in this process.
+
+    Returns
+    -------
+    List[pd.DataFrame]
+        The outputs of the blocks, in order.
+    """
+    workers = min(workers, len(bounds))
+    if workers <= 1:
+        return [func(df.iloc[start:stop]) for start, stop in bounds]
+    logger.debug(f'Processing {len(bounds)} blocks on {workers} processes.')
+    profiling = is_profiling()
+    blocks = (df.iloc[start:stop] for start, stop in bounds)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        results = list(executor.map(_apply_profiled, [func] * len(bounds), blocks, [profiling] * len(bounds)))
+    for _, events in results:
+        add_events(events)
+    return [out for out, _ in results]
@@ -0,0 +1,164 @@
+r"""P-sorted index of the rows of bgzipped summary statistics.
+
+The index is a sidecar file, `<file>.pidx`, holding the P values of the rows
+sorted in ascending order and the BGZF virtual offsets of the rows in the same
+order. Both arrays are memory-mapped, so the hits under any threshold, or the
+top k hits, are found by a binary search and read by seeking to their rows,
+without scanning the summary statistics.
+
+Layout, little-endian: magic `PIDX\x01`, number of rows as uint64, P values as
+float64, virtual offsets as uint64.
+"""
+
+import io
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from smunger.bgzf import inflate_block, read_block
+from smunger.constant import ColName
+from smunger.profiler import profiled
+from smunger.region import BgzfFile
+
+logger = logging.getLogger('pindex')
+
+PINDEX_MAGIC = b'PIDX\x01'
+PINDEX_SUFFIX = '.pidx'
+HEADER_SIZE = len(PINDEX_MAGIC) + 8
+
+
+def line_offsets(filename: str) -> np.ndarray:
+    """
+    Get the virtual offsets of the starts of the lines of a BGZF file.
+
+    Parameters
+    ----------
+    filename : str
+        The bgzipped file.
+
+    Returns
+    -------
+    np.ndarray
+        The virtual offsets, as uint64, the first one is the start of the file.
+    """
+    starts_per_block = [np.zeros(1, dtype=np.uint64)]
+    coffset = 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = read_block(f)
+            if block is None:
+                break
+            data = inflate_block(block)
+            next_coffset = coffset + len(block)
+            ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')).astype(np.uint64) + 1
+            # a line after a newline at the end of a block starts in the next block
+            at_end = ends == len(data)
+            starts = (np.uint64(coffset) << np.uint64(16)) | ends
+            starts[at_end] = np.uint64(next_coffset) << np.uint64(16)
+            starts_per_block.append(starts)
+            coffset = next_coffset
+    # the start after the last newline is the end of the file, not a line
+    return np.concatenate(starts_per_block)[:-1]
+
+
+@profiled()
+def build_pindex(filename: str, pvals: Optional[np.ndarray] = None, header: bool = True) -> str:
+    """
+    Build the P-sorted index of bgzipped summary statistics.
+
+    The P values are read back from the file by default, so that the index holds
+    them as written, e.g. rounded by `%g`, and threshold queries agree with
+    filtering the file itself.
+
+    Parameters
+    ----------
+    filename : str
+        The bgzipped summary statistics.
+    pvals : Optional[np.ndarray], optional
+        P values of the rows, in the order of the file, by default read from the P column of the file.
+    header : bool, optional
+        The file has a header line, by default True.
+
+    Returns
+    -------
+    str
+        The index file.
+    """
+    if pvals is None:
+        if not header:
+            raise ValueError(f'{filename} has no header, the P values must be given.')
+        written = pd.read_csv(filename, sep='\t', usecols=[ColName.P])[ColName.P]
+        pvals = pd.to_numeric(written, errors='coerce').to_numpy()
+    offsets = line_offsets(filename)
+    if header:
+        offsets = offsets[1:]
+    pvals = np.asarray(pvals, dtype=np.float64)
+    if len(offsets) != len(pvals):
+        raise ValueError(f'{filename} has {len(offsets)} rows, but {len(pvals)} P values are given.')
+    order = np.argsort(pvals, kind='stable')
+    index_file = filename + PINDEX_SUFFIX
+    with open(index_file, 'wb') as f:
+        f.write(PINDEX_MAGIC)
+        f.write(np.uint64(len(pvals)).tobytes())
+        f.write(pvals[order].astype('<f8').tobytes())
+        f.write(offsets[order].astype('<u8').tobytes())
+    logger.info(f'Saved P index of {len(pvals)} rows to {index_file}')
+    return index_file
+
+
+def read_pindex(filename: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Memory-map the P-sorted index of bgzipped summary statistics.
+
+    Parameters
+    ----------
+    filename : str
+        The bgzipped summary statistics, or its index.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The sorted P values and the virtual offsets of their rows.
+    """
+    index_file = filename if filename.endswith(PINDEX_SUFFIX) else filename + PINDEX_SUFFIX
+    with open(index_file, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if header[: len(PINDEX_MAGIC)] != PINDEX_MAGIC:
+        raise ValueError(f'{index_file} is not a P index.')
+    n = int(np.frombuffer(header[len(PINDEX_MAGIC) :], dtype='<u8')[0])
+    pvals = np.memmap(index_file, dtype='<f8', mode='r', offset=HEADER_SIZE, shape=(n,))
+    offsets = np.memmap(index_file, dtype='<u8', mode='r', offset=HEADER_SIZE + 8 * n, shape=(n,))
+    return pvals, offsets
+
+
+@profiled()
+def read_sigsnps(filename: str, pval: Optional[float] = 5e-8, top_k: Optional[int] = None) -> pd.DataFrame:
+    """
+    Read the significant SNPs of bgzipped summary statistics, using the P index.
+
+    Parameters
+    ----------
+    filename : str
+        The bgzipped summary statistics, with a `.pidx` index.
+    pval : Optional[float], optional
+        Read the SNPs with P below this threshold, None for no threshold, by default 5e-8.
+    top_k : Optional[int], optional
+        Read at most the k SNPs with the smallest P, by default no limit.
+
+    Returns
+    -------
+    pd.DataFrame
+        The SNPs, in the order of the file.
+    """
+    pvals, offsets = read_pindex(filename)
+    n = len(pvals) if pval is None else int(np.searchsorted(pvals, pval, side='left'))
+    if top_k is not None:
+        n = min(n, top_k)
+    with BgzfFile(filename) as f:
+        lines = [f.read_line(0)]
+        # rows are read in the order of the file, for locality
+        lines.extend(f.read_line(int(voffset)) for voffset in np.sort(offsets[:n]))
+    logger.debug(f'Read {n} SNPs from {filename}.')
+    return pd.read_csv(io.BytesIO(b'\n'.join(lines) + b'\n'), sep='\t')
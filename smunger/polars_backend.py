@@ -0,0 +1,328 @@
+"""Polars backend of the munge pipeline.
+
+The pandas functions of `smunger.smunger` are the reference. This module
+expresses the same steps as Polars expressions on a LazyFrame, so that the
+whole pipeline is optimized as one query, runs on all cores and is collected
+with the streaming engine where the installed Polars has one. Polars is
+optional, it is only imported when the backend is used, e.g.
+`munge(df, backend='polars')`. `extract_cols`, `make_SNPID_unique`, `munge`
+and `harmonize` take a backend, and Polars >= 1.0 is required.
+
+Frames are exchanged with pandas column by column through numpy, so pyarrow is
+not required.
+"""
+
+import logging
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from smunger.constant import ColName, ColRange
+
+logger = logging.getLogger('polars')
+
+ROW = '_row'
+VALUE = '_value'
+
+
+def _polars():
+    """Import polars, with a hint if it is not installed."""
+    try:
+        import polars as pl
+    except ImportError:
+        raise ImportError('The polars backend requires polars, install it with `pip install polars`.')
+    return pl
+
+
+def to_polars(df: pd.DataFrame):
+    """Convert a pandas DataFrame to Polars, non-numeric columns become strings, NaN becomes null."""
+    pl = _polars()
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            if values.isna().any():
+                array = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                array = values.to_numpy()
+            columns.append(pl.Series(str(col), array, nan_to_null=True))
+        else:
+            array = np.where(values.isna().to_numpy(), None, values.astype(str).to_numpy(dtype=object))
+            columns.append(pl.Series(str(col), array, dtype=pl.Utf8))
+    return pl.DataFrame(columns)
+
+
+def to_pandas(df) -> pd.DataFrame:
+    """Convert a Polars DataFrame to pandas, through numpy."""
+    return pd.DataFrame({col: df[col].to_numpy() for col in df.columns})
+
+
+def _collect(lf):
+    """Collect a LazyFrame with the streaming engine, or the default engine of older Polars."""
+    try:
+        return lf.collect(engine='streaming')
+    except (TypeError, ValueError):
+        return lf.collect()
+
+
+def _numeric(col: str):
+    """Parse a column as float, invalid values become null, as `pd.to_numeric(errors='coerce')`."""
+    pl = _polars()
+    return pl.col(col).cast(pl.Float64, strict=False).fill_nan(None)
+
+
+def snpid_expr(
+    chrom_col: str = ColName.CHR, pos_col: str = ColName.BP, ea_col: str = ColName.EA, nea_col: str = ColName.NEA
+):
+    """Expression of the unique SNPID, chr-bp-sorted(EA,NEA), see `make_SNPID_unique`."""
+    pl = _polars()
+    ea, nea = pl.col(ea_col).cast(pl.Utf8), pl.col(nea_col).cast(pl.Utf8)
+    return pl.concat_str(
+        [
+            pl.col(chrom_col).cast(pl.Utf8),
+            pl.col(pos_col).cast(pl.Utf8),
+            pl.when(ea <= nea).then(ea).otherwise(nea),
+            pl.when(ea <= nea).then(nea).otherwise(ea),
+        ],
+        separator='-',
+    ).alias(ColName.SNPID)
+
+
+def make_SNPID_unique_lazy(
+    lf,
+    chrom_col: str = ColName.CHR,
+    pos_col: str = ColName.BP,
+    ea_col: str = ColName.EA,
+    nea_col: str = ColName.NEA,
+):
+    """Add the unique SNPID to a LazyFrame, as the first column, see `make_SNPID_unique`."""
+    pl = _polars()
+    return lf.select(
+        snpid_expr(chrom_col, pos_col, ea_col, nea_col), pl.all().exclude(ColName.SNPID)  # type: ignore
+    )
+
+
+def extract_cols_lazy(lf, colname_map: dict):
+    """Rename and select the mapped columns of a LazyFrame, see `extract_cols`."""
+    colname_map = {k: v for k, v in colname_map.items() if k in lf.collect_schema().names()}
+    return lf.rename(colname_map).select(list(colname_map.values()))
+
+
+def extract_cols_polars(df: pd.DataFrame, colname_map: dict) -> pd.DataFrame:
+    """Map column names with Polars and remove the columns that are all NA, see `extract_cols`."""
+    pdf = to_polars(df) if isinstance(df, pd.DataFrame) else df
+    return to_pandas(rm_col_allna(_collect(extract_cols_lazy(pdf.lazy(), colname_map))))
+
+
+def make_SNPID_unique_polars(
+    sumstat: pd.DataFrame,
+    chrom_col: str = ColName.CHR,
+    pos_col: str = ColName.BP,
+    ea_col: str = ColName.EA,
+    nea_col: str = ColName.NEA,
+) -> pd.DataFrame:
+    """Add the unique SNPID with Polars, see `make_SNPID_unique`."""
+    pdf = to_polars(sumstat) if isinstance(sumstat, pd.DataFrame) else sumstat
+    outdf = to_pandas(_collect(make_SNPID_unique_lazy(pdf.lazy(), chrom_col, pos_col, ea_col, nea_col)))
+    if isinstance(sumstat, pd.DataFrame):
+        outdf.index = sumstat.index
+    return outdf
+
+
+def rm_col_allna(df):
+    """Remove columns of a Polars DataFrame that are all null or empty strings, see `rm_col_allna`."""
+    pl = _polars()
+    df = df.with_columns(
+        [pl.when(pl.col(col) == '').then(None).otherwise(pl.col(col)).alias(col) for col in df.columns
+         if df[col].dtype == pl.Utf8]
+    )
+    null_counts = df.null_count().row(0)
+    keep = [col for col, n in zip(df.columns, null_counts) if n < df.height]
+    for col in set(df.columns) - set(keep):
+        logger.debug(f"Remove column {col} because it is all NA.")
+    return df.select(keep)
+
+
+def validate_lazy(lf, columns: List[str], remove_palindromic: bool = False):
+    """Validate the variants and P values of a LazyFrame, see `validate_sumstats`."""
+    pl = _polars()
+    chrom = pl.col(ColName.CHR).cast(pl.Utf8).str.replace_all('chr', '', literal=True)
+    chrom = pl.when(chrom.is_in(['X', 'x'])).then(pl.lit('23')).otherwise(chrom)
+    lf = (
+        lf.with_columns(chrom.cast(pl.Float64, strict=False).fill_nan(None).alias(ColName.CHR))
+        .filter(pl.col(ColName.CHR).is_between(ColRange.CHR_MIN, ColRange.CHR_MAX))
+        .with_columns(pl.col(ColName.CHR).cast(pl.Int64))
+    )
+    lf = (
+        lf.with_columns(_numeric(ColName.BP).alias(ColName.BP))
+        .filter((pl.col(ColName.BP) > ColRange.BP_MIN) & (pl.col(ColName.BP) < ColRange.BP_MAX))
+        .with_columns(pl.col(ColName.BP).cast(pl.Int64))
+    )
+    ea, nea = pl.col(ColName.EA), pl.col(ColName.NEA)
+    lf = lf.with_columns(
+        ea.cast(pl.Utf8).str.to_uppercase().alias(ColName.EA), nea.cast(pl.Utf8).str.to_uppercase().alias(ColName.NEA)
+    ).filter(ea.str.contains(r'^[ACGT]+$') & nea.str.contains(r'^[ACGT]+$') & (ea != nea))
+    if remove_palindromic:
+        complement = ea.str.replace_many(['A', 'C', 'G', 'T'], ['T', 'G', 'C', 'A']).str.reverse()
+        lf = lf.filter(complement != nea)
+    lf = make_SNPID_unique_lazy(lf)
+    if ColName.P in columns:
+        lf = lf.with_columns(_numeric(ColName.P).alias(ColName.P)).filter(
+            (pl.col(ColName.P) > ColRange.P_MIN) & (pl.col(ColName.P) < ColRange.P_MAX)
+        )
+    elif ColName.NEGLOGP in columns:
+        lf = (
+            lf.with_columns(_numeric(ColName.NEGLOGP).alias(ColName.NEGLOGP))
+            .filter(pl.col(ColName.NEGLOGP) > ColRange.NEGLOGP_MIN)
+            .with_columns(pl.lit(10.0).pow(-pl.col(ColName.NEGLOGP)).alias(ColName.P))
+        )
+    return lf
+
+
+def dedup_lazy(lf, columns: List[str], policy: str = 'min_p'):
+    """Remove duplicated SNPIDs of a LazyFrame with a row index, see `dedup_sumstats`."""
+    from smunger.smunger import DEDUP_POLICIES
+
+    pl = _polars()
+    if policy not in DEDUP_POLICIES:
+        raise ValueError(f'Unknown dedup policy {policy}, must be one of {", ".join(DEDUP_POLICIES)}.')
+    rule = DEDUP_POLICIES[policy]
+    if rule is None:
+        return lf.filter(pl.len().over(ColName.SNPID) == 1)
+    col, how = rule
+    if col not in columns:
+        if policy != 'min_p':
+            raise ValueError(f"Missing {col} column.")
+        return lf.unique(subset=[ColName.SNPID], keep='first', maintain_order=True)
+    # the best copy sorts first, ties and copies without a value keep the input order
+    return (
+        lf.with_columns(_numeric(col).alias(VALUE))
+        .sort([VALUE, ROW], descending=[how == 'max', False], nulls_last=True)
+        .unique(subset=[ColName.SNPID], keep='first', maintain_order=True)
+        .drop(VALUE)
+    )
+
+
+def finalize_lazy(lf, columns: List[str], dedup: str = 'min_p'):
+    """Deduplicate, sort and check the effect sizes of a validated LazyFrame, see `finalize_sumstats`."""
+    pl = _polars()
+    columns = list(columns)
+    lf = dedup_lazy(lf, columns, dedup)
+    # multi-allelic variants are sorted by P, as in `sort_sumstats(by_p=True)`
+    by = [ColName.CHR, ColName.BP] + ([ColName.P] if ColName.P in columns else []) + [ROW]
+    lf = lf.sort(by)
+
+    def valid(lf, col: str, cond=None):
+        lf = lf.with_columns(_numeric(col).alias(col))
+        return lf.filter(pl.col(col).is_not_null() if cond is None else pl.col(col).is_not_null() & cond)
+
+    if ColName.BETA in columns and ColName.SE in columns:
+        lf = valid(lf, ColName.BETA)
+        lf = valid(lf, ColName.SE, pl.col(ColName.SE) > ColRange.SE_MIN)
+    elif ColName.OR in columns and ColName.ORSE in columns:
+        lf = valid(lf, ColName.OR)
+        lf = valid(lf, ColName.ORSE, pl.col(ColName.ORSE) > ColRange.ORSE_MIN)
+        lf = lf.with_columns(
+            pl.col(ColName.OR).alias(ColName.BETA), (pl.col(ColName.ORSE) / pl.col(ColName.OR)).alias(ColName.SE)
+        )
+        lf = valid(lf, ColName.SE, pl.col(ColName.SE) > ColRange.SE_MIN).drop([ColName.OR, ColName.ORSE])
+    else:
+        logger.warning("Missing BETA or SE column.")
+    if ColName.Z in columns:
+        lf = valid(lf, ColName.Z)
+    if ColName.EAF in columns:
+        lf = valid(lf, ColName.EAF, pl.col(ColName.EAF).is_between(ColRange.EAF_MIN, ColRange.EAF_MAX))
+        lf = lf.with_columns(pl.col(ColName.EAF).alias(ColName.MAF))
+    if ColName.MAF in columns or ColName.EAF in columns:
+        lf = valid(lf, ColName.MAF)
+        maf = pl.col(ColName.MAF)
+        lf = lf.with_columns(pl.when(maf > 0.5).then(1 - maf).otherwise(maf).alias(ColName.MAF)).filter(
+            pl.col(ColName.MAF).is_between(ColRange.MAF_MIN, ColRange.MAF_MAX)
+        )
+    return lf
+
+
+def munge_polars(
+    df: pd.DataFrame,
+    remove_palindromic: bool = False,
+    compact: bool = False,
+    float32: bool = False,
+    dedup: str = 'min_p',
+) -> pd.DataFrame:
+    """
+    Munge summary statistics with Polars, see `munge`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics with mapped column names, a Polars DataFrame is used as is.
+    remove_palindromic : bool, optional
+        Remove palindromic variants, by default False.
+    compact : bool, optional
+        Use memory-compact column types, see `compact_dtypes`, by default False.
+    float32 : bool, optional
+        Store float columns as float32 where precision allows, by default False.
+    dedup : str, optional
+        The duplicate kept, see `dedup_sumstats`, by default 'min_p'.
+
+    Returns
+    -------
+    pd.DataFrame
+        The munged summary statistics, as pandas, equal to the output of the pandas backend.
+    """
+    from smunger.smunger import check_colnames
+
+    pdf = to_polars(df) if isinstance(df, pd.DataFrame) else df
+    pdf = rm_col_allna(pdf)
+    columns = pdf.columns
+    if not all(col in columns for col in [ColName.CHR, ColName.BP, ColName.EA, ColName.NEA]):
+        raise ValueError("Missing CHR, BP, EA or NEA column.")
+    lf = validate_lazy(pdf.lazy().with_row_index(ROW), columns, remove_palindromic)
+    lf = finalize_lazy(lf, columns + ([ColName.P] if ColName.NEGLOGP in columns else []), dedup)
+    outdf = to_pandas(_collect(lf).drop(ROW))
+    return check_colnames(outdf, compact=compact, float32=float32)
+
+
+def harmonize_polars(sumstat1: pd.DataFrame, sumstat2: pd.DataFrame) -> pd.DataFrame:
+    """
+    Harmonize two summary statistics by SNPID with Polars, see `harmonize`.
+
+    Parameters
+    ----------
+    sumstat1 : pd.DataFrame
+        The first summary statistics.
+    sumstat2 : pd.DataFrame
+        The second summary statistics.
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged summary statistics, with suffixes `_1` and `_2`, in the order of `harmonize`.
+    """
+    pl = _polars()
+    left = to_polars(sumstat1).with_columns(snpid_expr())
+    right = to_polars(sumstat2).with_columns(snpid_expr())
+    left = left.select([ColName.SNPID] + [col for col in left.columns if col != ColName.SNPID])
+    overlap = (set(left.columns) & set(right.columns)) - {ColName.SNPID}
+    left = left.rename({col: f'{col}_1' for col in overlap}).with_row_index('_row1')
+    right = right.rename({col: f'{col}_2' for col in overlap}).with_row_index('_row2')
+    merged = (
+        left.lazy()
+        .join(right.lazy(), on=ColName.SNPID, how='inner')
+        .sort(['_row1', '_row2'])
+        .drop(['_row1', '_row2'])
+    )
+    ea1, ea2 = pl.col(f'{ColName.EA}_1').str.to_uppercase(), pl.col(f'{ColName.EA}_2').str.to_uppercase()
+    beta2 = pl.col(f'{ColName.BETA}_2')
+    merged = merged.with_columns(pl.when(ea1.ne_missing(ea2)).then(-beta2).otherwise(beta2).alias(f'{ColName.BETA}_2'))
+    merged = merged.drop([f'{ColName.CHR}_2', f'{ColName.BP}_2', f'{ColName.EA}_2', f'{ColName.NEA}_2'])
+    merged = merged.rename(
+        {
+            f'{ColName.EA}_1': ColName.EA,
+            f'{ColName.NEA}_1': ColName.NEA,
+            f'{ColName.CHR}_1': ColName.CHR,
+            f'{ColName.BP}_1': ColName.BP,
+        }
+    )
+    return to_pandas(merged.collect())
@@ -0,0 +1,165 @@
+"""Lightweight per-stage timing and memory instrumentation.
+
+Stages are recorded only when profiling is enabled, otherwise the
+instrumentation is a no-op. Recorded stages can be saved in the Chrome trace
+event format, which is plain JSON and can be opened in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger('profiler')
+
+_enabled = False
+_events: List[Dict] = []
+_lock = threading.Lock()
+
+
+def enable_profiling() -> None:
+    """Enable profiling and clear recorded stages."""
+    global _enabled
+    _enabled = True
+    with _lock:
+        _events.clear()
+
+
+def disable_profiling() -> None:
+    """Disable profiling."""
+    global _enabled
+    _enabled = False
+
+
+def is_profiling() -> bool:
+    """Whether profiling is enabled."""
+    return _enabled
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process, in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None, **args) -> Iterator[Dict]:
+    """
+    Record a pipeline stage.
+
+    Parameters
+    ----------
+    name : str
+        Stage name.
+    rows_in : Optional[int], optional
+        Number of input rows, by default None.
+    **args
+        Extra arguments saved with the stage.
+
+    Yields
+    ------
+    Dict
+        The record of the stage, set `rows_out` in it to record the number of output rows.
+    """
+    record: Dict = {'rows_in': rows_in, 'rows_out': None, **args}
+    if not _enabled:
+        yield record
+        return
+    rss = peak_rss_mb()
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+        record.update(
+            wall_s=round(wall, 6),
+            cpu_s=round(cpu, 6),
+            peak_rss_mb=round(peak_rss_mb(), 1),
+            peak_rss_delta_mb=round(peak_rss_mb() - rss, 1),
+        )
+        event = {
+            'name': name,
+            'cat': 'smunger',
+            'ph': 'X',
+            'ts': round(start * 1e6),
+            'dur': round(wall * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': record,
+        }
+        with _lock:
+            _events.append(event)
+        logger.debug(f'{name}: {record}')
+
+
+def profiled(name: Optional[str] = None) -> Callable:
+    """
+    Record each call of a function as a stage.
+
+    Rows in and out are recorded when the first argument and the return value are DataFrames.
+
+    Parameters
+    ----------
+    name : Optional[str], optional
+        Stage name, by default the function name.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            rows_in = len(args[0]) if args and isinstance(args[0], pd.DataFrame) else None
+            with stage(stage_name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    record['rows_out'] = len(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def get_events() -> List[Dict]:
+    """Get the recorded stages as Chrome trace events."""
+    with _lock:
+        return list(_events)
+
+
+def add_events(events: List[Dict]) -> None:
+    """Add stages recorded in other processes, e.g. workers, whose events keep their pid."""
+    if _enabled:
+        with _lock:
+            _events.extend(events)
+
+
+def write_trace(filename: str) -> None:
+    """
+    Save recorded stages in the Chrome trace event format.
+
+    Parameters
+    ----------
+    filename : str
+        Output json file.
+    """
+    trace = {
+        'traceEvents': get_events(),
+        'displayTimeUnit': 'ms',
+        'otherData': {'argv': sys.argv},
+    }
+    with open(filename, 'w') as f:
+        json.dump(trace, f, indent=1)
+    logger.info(f'Saved profile of {len(trace["traceEvents"])} stages to {filename}')
@@ -0,0 +1,338 @@
+"""Build the dbSNP references of rsid annotation.
+
+From a bgzipped and tabix-indexed dbSNP VCF, e.g. `GCF_000001405.25.gz`, two
+references are built:
+
+- `pos2snp_{version}.txt.gz`, with CHR, BP, rsid, REF and ALT, sorted by
+  position and tabix-indexed, read by `annotate_rsid`;
+- `snp2pos_{version}.txt.gz`, with the first digit of the rsid, the rsid
+  number, CHR, BP, REF and ALT, sorted by rsid and CSI-indexed.
+
+Contigs are processed in parallel processes. Each one streams its contig from
+the VCF in chunks, splits multi-allelic variants, appends the chunks to its
+part of pos2snp, which is sorted by position as the VCF is, and spills the
+chunks of snp2pos as runs sorted by rsid, one per first digit. The runs of
+each first digit are then merged in parallel by `merge_runs`, so memory is
+bounded by the chunks. The parts are concatenated in order and compressed with
+multithreaded bgzip.
+
+The merge history of dbSNP, `merged_{version}.npz`, is built from
+`refsnp-merged.json.bz2` by `build_merged`.
+"""
+
+import bz2
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from smunger.bgzf import READ_SIZE, BgzfReader
+from smunger.extsort import int_column_key, merge_runs, write_run
+from smunger.io import compress, index
+from smunger.parallel import pool_context
+from smunger.profiler import profiled
+from smunger.region import TabixIndex
+
+logger = logging.getLogger('reference')
+
+CONTIGS = [str(i) for i in range(1, 23)] + ['X', 'Y']
+# RefSeq accessions of the chromosomes, NC_000001 to NC_000024 are 1-22, X and Y
+REFSEQ = re.compile(r'NC_0000(\d\d)\.\d+$')
+VCF_COLS = ['CHROM', 'POS', 'ID', 'REF', 'ALT']
+DIGITS = '123456789'
+
+
+def _index_file(vcf: str) -> str:
+    for suffix in ['.tbi', '.csi']:
+        if os.path.exists(vcf + suffix):
+            return vcf + suffix
+    raise FileNotFoundError(f'Index file {vcf}.tbi or {vcf}.csi does not exist.')
+
+
+def contig_names(vcf: str) -> Dict[str, str]:
+    """Map the sequences of an indexed VCF to the chromosomes 1-22, X and Y, other sequences, e.g. chrM, are skipped."""
+    contigs = {}
+    for name in TabixIndex(_index_file(vcf)).names:
+        match = REFSEQ.match(name)
+        if match and 1 <= int(match.group(1)) <= len(CONTIGS):
+            chrom = CONTIGS[int(match.group(1)) - 1]
+        else:
+            chrom = name[3:] if name.startswith('chr') else name
+        if chrom in CONTIGS:
+            contigs[name] = chrom
+    return contigs
+
+
+def read_contig(vcf: str, contig: str, chunksize: int = 1000000) -> Iterator[pd.DataFrame]:
+    """
+    Read the records of a contig of an indexed VCF in chunks, streaming from its first block.
+
+    Parameters
+    ----------
+    vcf : str
+        The bgzipped and indexed VCF, sorted by contig and position.
+    contig : str
+        The contig.
+    chunksize : int, optional
+        Number of records of a chunk, by default 1000000.
+
+    Yields
+    ------
+    pd.DataFrame
+        CHROM, POS, ID, REF and ALT of the records, as strings.
+    """
+    tbx = TabixIndex(_index_file(vcf))
+    chunks = tbx.chunks(contig, 0, 1 << (tbx.min_shift + 3 * tbx.depth))
+    if len(chunks) == 0:
+        return
+    voffset = chunks[0][0]
+    with open(vcf, 'rb') as f:
+        f.seek(voffset >> 16)
+        with io.BufferedReader(BgzfReader(f, threads=1), buffer_size=READ_SIZE) as reader:
+            reader.read(voffset & 0xFFFF)
+            for df in pd.read_csv(
+                reader, sep='\t', header=None, usecols=range(5), names=VCF_COLS, dtype=str, chunksize=chunksize
+            ):
+                # records are sorted by contig, the contig ends at the first record of the next one
+                other = np.flatnonzero(df['CHROM'].to_numpy() != contig)
+                if len(other) > 0:
+                    if other[0] > 0:
+                        yield df.iloc[: other[0]]
+                    return
+                yield df
+
+
+def split_multiallelic(df: pd.DataFrame) -> pd.DataFrame:
+    """Split records with several ALT alleles into one record per allele, as `bcftools norm -m -`."""
+    multi = df['ALT'].str.contains(',', regex=False).to_numpy()
+    if not multi.any():
+        return df
+    return df.assign(ALT=df['ALT'].str.split(',')).explode('ALT', ignore_index=True)
+
+
+def _build_contig(vcf: str, contig: str, chrom: str, workdir: str, chunksize: int) -> Tuple[str, Dict[str, List[str]]]:
+    """Write the pos2snp part and the snp2pos runs of a contig."""
+    part = os.path.join(workdir, f'pos2snp_{chrom}.txt')
+    runs: Dict[str, List[str]] = {digit: [] for digit in DIGITS}
+    n_rows = 0
+    with open(part, 'w') as f:
+        for ith, df in enumerate(read_contig(vcf, contig, chunksize)):
+            df = split_multiallelic(df).assign(CHROM=chrom)
+            df.to_csv(f, sep='\t', index=False, header=False)
+            n_rows += len(df)
+            df = df[df['ID'].str.match(r'rs[1-9]\d*$').to_numpy()]
+            rsid = df['ID'].str.slice(2)
+            snp = pd.DataFrame(
+                {
+                    'digit': rsid.str.slice(0, 1),
+                    'rsid': rsid,
+                    'CHROM': chrom,
+                    'POS': df['POS'],
+                    'REF': df['REF'],
+                    'ALT': df['ALT'],
+                }
+            )
+            snp = snp.iloc[np.argsort(rsid.astype(np.int64).to_numpy(), kind='stable')]
+            for digit, digit_df in snp.groupby('digit', sort=True):
+                run = os.path.join(workdir, f'snp2pos_{chrom}_{ith}_{digit}.txt')
+                runs[str(digit)].append(write_run(digit_df, run))
+    logger.info(f'Processed {n_rows} records of {contig}, chromosome {chrom}.')
+    return part, runs
+
+
+def _merge_digit(runs: List[str], outfile: str) -> str:
+    """Merge the snp2pos runs of the rsids with the same first digit."""
+    with open(outfile, 'w') as f:
+        merge_runs(runs, f, int_column_key(1), tmpdir=os.path.dirname(outfile))
+    return outfile
+
+
+def _concat(parts: List[str], outfile: str) -> None:
+    """Concatenate text files."""
+    with open(outfile, 'wb') as f_out:
+        for part in parts:
+            with open(part, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out, READ_SIZE)
+
+
+@profiled()
+def build_reference(
+    vcf: str,
+    outdir: str = '.',
+    version: str = 'b156',
+    threads: int = 1,
+    chunksize: int = 1000000,
+    tmpdir: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Build the pos2snp and snp2pos references from a dbSNP VCF.
+
+    Parameters
+    ----------
+    vcf : str
+        The bgzipped and indexed dbSNP VCF, e.g. `GCF_000001405.25.gz`.
+    outdir : str, optional
+        Output directory, by default the current directory.
+    version : str, optional
+        dbSNP version, in the names of the outputs, by default 'b156'.
+    threads : int, optional
+        Number of contigs processed in parallel, and of bgzip threads, by default 1.
+    chunksize : int, optional
+        Number of records of a chunk, by default 1000000.
+    tmpdir : Optional[str], optional
+        Directory for the parts and the sorted runs, by default the system temporary directory.
+
+    Returns
+    -------
+    Tuple[str, str]
+        The pos2snp and snp2pos files.
+    """
+    contigs = contig_names(vcf)
+    os.makedirs(outdir, exist_ok=True)
+    pos2snp = os.path.join(outdir, f'pos2snp_{version}.txt')
+    snp2pos = os.path.join(outdir, f'snp2pos_{version}.txt')
+    workdir = tempfile.mkdtemp(prefix='smunger_reference_', dir=tmpdir)
+    n = len(contigs)
+    try:
+        with ProcessPoolExecutor(max_workers=max(threads, 1), mp_context=pool_context()) as executor:
+            args = [vcf] * n, list(contigs), list(contigs.values()), [workdir] * n, [chunksize] * n
+            parts = list(executor.map(_build_contig, *args))
+            _concat([part for part, _ in parts], pos2snp)
+            digit_runs = [[run for _, runs in parts for run in runs[digit]] for digit in DIGITS]
+            logger.info(f'Merging {sum(len(runs) for runs in digit_runs)} runs of snp2pos.')
+            outputs = [os.path.join(workdir, f'snp2pos_{digit}.txt') for digit in DIGITS]
+            merged = list(executor.map(_merge_digit, digit_runs, outputs))
+        _concat(merged, snp2pos)
+    finally:
+        shutil.rmtree(workdir)
+    compress(pos2snp, threads=threads)
+    index(pos2snp + '.gz', start=1, end=2, skip=0)
+    compress(snp2pos, threads=threads)
+    # rsid numbers exceed the 2^29 positions of a tabix index
+    index(snp2pos + '.gz', start=1, end=2, skip=0, csi=True)
+    return pos2snp + '.gz', snp2pos + '.gz'
+
+
+@contextmanager
+def open_bz2(filename: str, threads: int = 1) -> Iterator[IO[bytes]]:
+    """
+    Open a bz2 file, decompressed by lbzip2 or pbzip2 on `threads` threads when installed.
+
+    Both tools decompress the blocks of a file in parallel, bz2 is the fallback. Multi-stream files, e.g.
+    compressed by pbzip2, are read to the end.
+
+    Parameters
+    ----------
+    filename : str
+        The bz2 file.
+    threads : int, optional
+        Number of decompression threads, by default 1.
+
+    Yields
+    ------
+    IO[bytes]
+        The decompressed stream, read by lines.
+    """
+    for tool, option in [('lbzip2', ['-n', str(threads)]), ('pbzip2', [f'-p{threads}'])]:
+        tool_path = shutil.which(tool)
+        if threads > 1 and tool_path:
+            logger.info(f'Decompressing {filename} with {tool} on {threads} threads.')
+            command = [tool_path, '-d', '-c'] + option + [filename]
+            with subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=READ_SIZE) as proc:
+                yield proc.stdout  # type: ignore
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+            return
+    with bz2.open(filename, 'rb') as f:
+        yield f
+
+
+def _parse_merged(lines: List[bytes]) -> np.ndarray:
+    """Parse lines of `refsnp-merged.json` into the retired and current rsid numbers, with orjson when installed."""
+    try:
+        from orjson import loads
+    except ImportError:
+        from json import loads  # type: ignore
+    pairs = []
+    for line in lines:
+        rs_obj = loads(line)
+        refsnp_id = int(rs_obj['refsnp_id'])
+        for merge_into in rs_obj['merged_snapshot_data']['merged_into']:
+            merge_into = int(merge_into)
+            pairs.append((refsnp_id, merge_into))
+            for dbsnp1_merges in rs_obj['dbsnp1_merges']:
+                pairs.append((int(dbsnp1_merges['merged_rsid']), merge_into))
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def _line_batches(f: IO[bytes], batch_size: int) -> Iterator[List[bytes]]:
+    """Read a stream in batches of lines."""
+    batch = []
+    for line in f:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+@profiled()
+def build_merged(
+    merged_json: str, outdir: str = '.', version: str = 'b156', threads: int = 1, batch_size: int = 100000
+) -> str:
+    """
+    Build the merge history of dbSNP from `refsnp-merged.json.bz2`.
+
+    The file is decompressed in parallel, see `open_bz2`, and batches of lines are parsed in parallel processes,
+    at most two batches per process in flight. The rsid pairs are sorted as integers in memory and saved as
+    a binary merge map.
+
+    Parameters
+    ----------
+    merged_json : str
+        The merged rsids of dbSNP, bz2-compressed JSON lines.
+    outdir : str, optional
+        Output directory, by default the current directory.
+    version : str, optional
+        dbSNP version, in the name of the output, by default 'b156'.
+    threads : int, optional
+        Number of decompression threads and of parsing processes, by default 1.
+    batch_size : int, optional
+        Number of lines of a batch, by default 100000.
+
+    Returns
+    -------
+    str
+        The merge history, `merged_{version}.npz`, with the `retired` rsid numbers, sorted, and the `current`
+        rsid numbers they were merged into, see `load_merge_map`.
+    """
+    outfile = os.path.join(outdir, f'merged_{version}.npz')
+    os.makedirs(outdir, exist_ok=True)
+    parsed = []
+    with open_bz2(merged_json, threads) as f_in:
+        if threads <= 1:
+            parsed = [_parse_merged(batch) for batch in _line_batches(f_in, batch_size)]
+        else:
+            with ProcessPoolExecutor(max_workers=threads, mp_context=pool_context()) as executor:
+                pending: Deque[Future] = deque()
+                for batch in _line_batches(f_in, batch_size):
+                    pending.append(executor.submit(_parse_merged, batch))
+                    if len(pending) >= 2 * threads:
+                        parsed.append(pending.popleft().result())
+                parsed.extend(future.result() for future in pending)
+    pairs = np.concatenate(parsed) if len(parsed) > 0 else np.empty((0, 2), dtype=np.int64)
+    order = np.argsort(pairs[:, 0], kind='stable')
+    np.savez(outfile, retired=pairs[order, 0], current=pairs[order, 1])
+    logger.info(f'Saved {len(pairs)} merged rsids to {outfile}.')
+    return outfile
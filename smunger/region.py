@@ -0,0 +1,558 @@
+"""Random-access region reads from bgzipped, tabix or CSI indexed files.
+
+The index is parsed once per reader. A region query collects the index chunks
+overlapping the region, seeks to their BGZF virtual offsets, inflates the
+covering blocks and parses the records with the C parser of `pd.read_csv`
+into typed columns. Inflated blocks and parsed records are kept in a
+size-bounded LRU cache shared by all readers, so that repeated or overlapping
+queries do not decompress or parse the same data again.
+"""
+
+import io
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from smunger.bgzf import inflate_block, read_block
+
+logger = logging.getLogger('region')
+
+TBI_MAGIC = b'TBI\x01'
+CSI_MAGIC = b'CSI\x01'
+TABIX_FORMAT_ZERO_BASED = 0x10000
+
+
+def read_bgzf(filename: str) -> bytes:
+    """Read and decompress a whole BGZF file, e.g. an index."""
+    data = []
+    with open(filename, 'rb') as f:
+        while True:
+            block = read_block(f)
+            if block is None:
+                break
+            data.append(inflate_block(block))
+    return b''.join(data)
+
+
+def reg2bins(beg: int, end: int, min_shift: int = 14, depth: int = 5) -> List[int]:
+    """
+    Get the bins overlapping a region, as in htslib `hts_reg2bins`.
+
+    Parameters
+    ----------
+    beg : int
+        0-based start of the region.
+    end : int
+        0-based, exclusive, end of the region.
+    min_shift : int, optional
+        Size of the smallest bin, in bits, by default 14.
+    depth : int, optional
+        Number of levels of the binning index, by default 5.
+
+    Returns
+    -------
+    List[int]
+        The overlapping bins.
+    """
+    end -= 1
+    bins: List[int] = []
+    shift = min_shift + depth * 3
+    offset = 0
+    for level in range(depth + 1):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+        offset += 1 << (level * 3)
+        shift -= 3
+    return bins
+
+
+class TabixIndex:
+    """A parsed tabix (.tbi) or CSI (.csi) index."""
+
+    def __init__(self, filename: str):
+        """
+        Parse an index file.
+
+        Parameters
+        ----------
+        filename : str
+            The .tbi or .csi file.
+        """
+        data = read_bgzf(filename)
+        self.bins: List[Dict[int, List[Tuple[int, int]]]] = []
+        self.loffsets: List[Dict[int, int]] = []
+        self.linear: List[np.ndarray] = []
+        magic = data[:4]
+        if magic == TBI_MAGIC:
+            self.min_shift, self.depth = 14, 5
+            n_ref = struct.unpack_from('<i', data, 4)[0]
+            pos = self._parse_header(data, 8)
+            self._parse_refs(data, pos, n_ref, csi=False)
+        elif magic == CSI_MAGIC:
+            self.min_shift, self.depth, l_aux = struct.unpack_from('<3i', data, 4)
+            self._parse_header(data, 16)
+            pos = 16 + l_aux
+            n_ref = struct.unpack_from('<i', data, pos)[0]
+            self._parse_refs(data, pos + 4, n_ref, csi=True)
+        else:
+            raise ValueError(f'{filename} is not a tabix or CSI index.')
+
+    def _parse_header(self, data: bytes, pos: int) -> int:
+        """Parse the tabix header, shared by .tbi and the auxiliary data of .csi."""
+        self.format, self.col_seq, self.col_beg, self.col_end, meta, self.skip, l_nm = struct.unpack_from(
+            '<7i', data, pos
+        )
+        self.meta = chr(meta) if meta > 0 else None
+        pos += 28
+        self.names = [n.decode() for n in data[pos : pos + l_nm].split(b'\x00') if n]
+        self.name2id = {name: i for i, name in enumerate(self.names)}
+        return pos + l_nm
+
+    def _parse_refs(self, data: bytes, pos: int, n_ref: int, csi: bool) -> None:
+        """Parse the binning and linear index of each reference sequence."""
+        for _ in range(n_ref):
+            bins: Dict[int, List[Tuple[int, int]]] = {}
+            loffsets: Dict[int, int] = {}
+            n_bin = struct.unpack_from('<i', data, pos)[0]
+            pos += 4
+            for _ in range(n_bin):
+                if csi:
+                    bin_id, loffset, n_chunk = struct.unpack_from('<IQi', data, pos)
+                    loffsets[bin_id] = loffset
+                    pos += 16
+                else:
+                    bin_id, n_chunk = struct.unpack_from('<Ii', data, pos)
+                    pos += 8
+                chunks = np.frombuffer(data, dtype='<u8', count=n_chunk * 2, offset=pos).reshape(-1, 2)
+                bins[bin_id] = [(int(b), int(e)) for b, e in chunks]
+                pos += 16 * n_chunk
+            if csi:
+                self.linear.append(np.zeros(0, dtype=np.uint64))
+            else:
+                n_intv = struct.unpack_from('<i', data, pos)[0]
+                self.linear.append(np.frombuffer(data, dtype='<u8', count=n_intv, offset=pos + 4).copy())
+                pos += 4 + 8 * n_intv
+            self.bins.append(bins)
+            self.loffsets.append(loffsets)
+
+    def chunks(self, seq: str, beg: int, end: int) -> List[Tuple[int, int]]:
+        """
+        Get the chunks of virtual offsets that may contain records in a region.
+
+        Chunks of different bins never overlap, each record is stored in exactly one bin.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence name.
+        beg : int
+            0-based start of the region.
+        end : int
+            0-based, exclusive, end of the region.
+
+        Returns
+        -------
+        List[Tuple[int, int]]
+            Virtual offset ranges, sorted by start.
+        """
+        rid = self.name2id.get(seq)
+        if rid is None or end <= beg:
+            return []
+        bins, linear = self.bins[rid], self.linear[rid]
+        min_off = 0
+        if len(linear) > 0:
+            min_off = int(linear[min(beg >> self.min_shift, len(linear) - 1)])
+        chunks = []
+        for bin_id in reg2bins(beg, end, self.min_shift, self.depth):
+            for cbeg, cend in bins.get(bin_id, []):
+                if cend > min_off:
+                    chunks.append((cbeg, cend))
+        return sorted(chunks)
+
+
+def merge_chunks(chunks: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge sorted chunks of virtual offsets that are adjacent or overlapping."""
+    merged: List[Tuple[int, int]] = []
+    for beg, end in chunks:
+        if merged and beg <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((beg, end))
+    return merged
+
+
+class BlockCache:
+    """
+    Size-bounded LRU cache of decoded reference data.
+
+    Entries are inflated BGZF blocks, keyed by `('block', file, block offset)`, and parsed
+    records of index chunks, keyed by `('records', file, start, end virtual offsets)`.
+    Hits, misses and evictions are counted for tuning the cache size.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        """
+        Create a cache.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Maximum total size of cached entries, by default 256 MB.
+        """
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get a cached entry, None if missing."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes: int) -> None:
+        """Cache an entry of a given size, evicting the least recently used ones."""
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.nbytes > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def resize(self, max_bytes: int) -> None:
+        """Set the maximum size, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Get the cache counters."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_default_cache = BlockCache()
+_readers: Dict[tuple, 'TabixReader'] = {}
+_readers_lock = threading.Lock()
+
+
+def get_cache() -> BlockCache:
+    """Get the cache shared by all readers."""
+    return _default_cache
+
+
+def set_cache_size(max_bytes: int) -> None:
+    """Set the maximum size of the shared cache, in bytes."""
+    _default_cache.resize(max_bytes)
+
+
+def cache_stats() -> Dict[str, float]:
+    """Get the hit, miss and eviction counters of the shared cache."""
+    return _default_cache.stats()
+
+
+def file_stamp(filename: str) -> Tuple[int, int]:
+    """Get the modification time, in ns, and the size of a file, which change when it is rebuilt."""
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def get_reader(filename: str, names: Optional[Sequence[str]] = None, dtype: Optional[dict] = None) -> 'TabixReader':
+    """
+    Get a reader of an indexed file, shared by all callers with the same arguments.
+
+    The index is parsed once per file, and all readers share the same cache. A file or index rebuilt at the
+    same path, i.e. with another modification time or size, gets a new reader, the stale one is closed when
+    its last user drops it, or by `clear_readers`.
+
+    Parameters
+    ----------
+    filename : str
+        The bgzipped file.
+    names : Optional[Sequence[str]], optional
+        Column names, by default integers.
+    dtype : Optional[dict], optional
+        Column types, by default inferred.
+
+    Returns
+    -------
+    TabixReader
+        The reader.
+    """
+    key = (os.path.abspath(filename), tuple(names or ()), tuple(sorted((dtype or {}).items(), key=str)))
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is None or reader._file.closed or reader.is_stale():
+            reader = TabixReader(filename, names=names, dtype=dtype)
+            _readers[key] = reader
+        return reader
+
+
+def clear_readers() -> None:
+    """Close the shared readers of `get_reader` and their files."""
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.close()
+        _readers.clear()
+
+
+class BgzfFile:
+    """Random access to the decompressed bytes of a BGZF file, by virtual offsets."""
+
+    def __init__(self, filename: str, cache: Optional[BlockCache] = None):
+        """
+        Open a BGZF file.
+
+        Parameters
+        ----------
+        filename : str
+            The bgzipped file.
+        cache : Optional[BlockCache], optional
+            Cache of inflated blocks, by default a cache shared by all readers.
+        """
+        self.filename = filename
+        self.cache = cache if cache is not None else _default_cache
+        self._file = open(filename, 'rb')
+        st = os.fstat(self._file.fileno())
+        # cached blocks of a file rebuilt at the same path are not reused
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        """Enter the context, return the reader."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit the context, close the file."""
+        self.close()
+
+    def _block(self, coffset: int) -> Tuple[bytes, int]:
+        """Get an inflated block and the offset of the next block."""
+        key = ('block', self.filename, self.stamp, coffset)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            self._file.seek(coffset)
+            raw = read_block(self._file)
+        if raw is None:
+            raise EOFError(f'No BGZF block at offset {coffset} of {self.filename}.')
+        block = (inflate_block(raw), coffset + len(raw))
+        self.cache.put(key, block, len(block[0]))
+        return block
+
+    def read_chunk(self, vbeg: int, vend: int) -> bytes:
+        """
+        Read the decompressed bytes between two virtual offsets.
+
+        Parameters
+        ----------
+        vbeg : int
+            Start virtual offset.
+        vend : int
+            End virtual offset, exclusive.
+
+        Returns
+        -------
+        bytes
+            The decompressed bytes.
+        """
+        coffset, uoffset = vbeg >> 16, vbeg & 0xFFFF
+        end_coffset, end_uoffset = vend >> 16, vend & 0xFFFF
+        parts = []
+        while coffset < end_coffset or (coffset == end_coffset and end_uoffset > 0):
+            data, next_coffset = self._block(coffset)
+            stop = end_uoffset if coffset == end_coffset else len(data)
+            parts.append(data[uoffset:stop])
+            coffset, uoffset = next_coffset, 0
+        return b''.join(parts)
+
+    def read_line(self, voffset: int) -> bytes:
+        """Read the line starting at a virtual offset, without the newline."""
+        coffset, uoffset = voffset >> 16, voffset & 0xFFFF
+        parts = []
+        while True:
+            try:
+                data, next_coffset = self._block(coffset)
+            except EOFError:
+                break
+            end = data.find(b'\n', uoffset)
+            if end >= 0:
+                parts.append(data[uoffset:end])
+                break
+            parts.append(data[uoffset:])
+            coffset, uoffset = next_coffset, 0
+        return b''.join(parts)
+
+
+class TabixReader(BgzfFile):
+    """Read regions of a bgzipped and tabix or CSI indexed file into DataFrames."""
+
+    def __init__(
+        self,
+        filename: str,
+        names: Optional[Sequence[str]] = None,
+        dtype: Optional[dict] = None,
+        index: Optional[str] = None,
+        cache: Optional[BlockCache] = None,
+    ):
+        """
+        Open an indexed file.
+
+        Parameters
+        ----------
+        filename : str
+            The bgzipped file.
+        names : Optional[Sequence[str]], optional
+            Column names, by default integers.
+        dtype : Optional[dict], optional
+            Column types, passed to `pd.read_csv`, by default inferred.
+        index : Optional[str], optional
+            Index file, by default `filename` + `.tbi` or `.csi`.
+        cache : Optional[BlockCache], optional
+            Cache of inflated blocks and parsed records, by default a cache shared by all readers.
+        """
+        if index is None:
+            for suffix in ['.tbi', '.csi']:
+                if os.path.exists(filename + suffix):
+                    index = filename + suffix
+                    break
+            else:
+                raise FileNotFoundError(f'Index file {filename}.tbi or {filename}.csi does not exist.')
+        self.index_file = index
+        self.index_stamp = file_stamp(index)
+        self.index = TabixIndex(index)
+        self.names = list(names) if names is not None else None
+        self.dtype = dict(dtype) if dtype else {}
+        # parsed records are cached per column layout, readers of the same file may differ
+        self._layout = (tuple(self.names or ()), tuple(sorted(self.dtype.items(), key=str)))
+        super().__init__(filename, cache)
+
+    def is_stale(self) -> bool:
+        """Whether the file or its index was rebuilt since the reader was opened."""
+        try:
+            return file_stamp(self.filename) != self.stamp or file_stamp(self.index_file) != self.index_stamp
+        except FileNotFoundError:
+            return True
+
+    def _parse(self, data: bytes) -> pd.DataFrame:
+        """Parse records into a DataFrame."""
+        seq_col = self.index.col_seq - 1
+        names = self.names
+        dtype: Dict = {}
+        if names is not None:
+            dtype = {k: v for k, v in self.dtype.items() if k != names[seq_col]}
+            dtype[names[seq_col]] = str
+        else:
+            dtype = {seq_col: str}
+        if len(data) == 0:
+            if names is None:
+                return pd.DataFrame()
+            return pd.DataFrame(columns=names)
+        return pd.read_csv(
+            io.BytesIO(data),
+            sep='\t',
+            header=None,
+            names=names,
+            dtype=dtype,
+        )
+
+    def _records(self, vbeg: int, vend: int) -> pd.DataFrame:
+        """Get the parsed records between two virtual offsets."""
+        key = ('records', self.filename, self.stamp, self._layout, vbeg, vend)
+        df = self.cache.get(key)
+        if df is None:
+            df = self._parse(self.read_chunk(vbeg, vend))
+            self.cache.put(key, df, int(df.memory_usage(deep=True).sum()))
+        return df
+
+    def query(self, seq, start: int, end: int) -> pd.DataFrame:
+        """
+        Read the records overlapping a region.
+
+        Coordinates follow pytabix `query`, i.e. 0-based and half-open,
+        records at 1-based positions `start + 1` to `end` are returned.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence name, as in the indexed file.
+        start : int
+            0-based start.
+        end : int
+            0-based, exclusive, end.
+
+        Returns
+        -------
+        pd.DataFrame
+            The records.
+        """
+        seq = str(seq)
+        start, end = max(int(start), 0), int(end)
+        frames = [self._records(vbeg, vend) for vbeg, vend in merge_chunks(self.index.chunks(seq, start, end))]
+        frames = [frame for frame in frames if len(frame) > 0]
+        if len(frames) == 0:
+            df = self._parse(b'')
+        else:
+            df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        if len(df) == 0:
+            return df.reset_index(drop=True)
+        cols = df.columns
+        seq_col, beg_col, end_col = self.index.col_seq - 1, self.index.col_beg - 1, self.index.col_end - 1
+        rec_beg = pd.to_numeric(df[cols[beg_col]], errors='coerce').to_numpy()
+        if not self.index.format & TABIX_FORMAT_ZERO_BASED:
+            rec_beg = rec_beg - 1
+        if end_col >= 0 and end_col != beg_col:
+            rec_end = pd.to_numeric(df[cols[end_col]], errors='coerce').to_numpy()
+        else:
+            rec_end = rec_beg + 1
+        keep = (df[cols[seq_col]].to_numpy() == seq) & (rec_beg < end) & (rec_end > start)
+        df = df[keep].reset_index(drop=True)
+        seq_name = cols[seq_col]
+        if seq_name in self.dtype:
+            df[seq_name] = df[seq_name].astype(self.dtype[seq_name])
+        return df
+
+    def query_regions(self, regions: Sequence[Tuple[str, int, int]]) -> List[pd.DataFrame]:
+        """Read several regions, sharing the cache."""
+        return [self.query(seq, start, end) for seq, start, end in regions]
@@ -0,0 +1,297 @@
+"""Serve rsid annotation and liftover from a long-running process.
+
+The reference data is loaded once: the dbSNP index is parsed when the server
+starts and the decoded blocks stay in the shared region cache, liftover chain
+files are loaded on first use and kept. Requests arriving within a few
+milliseconds of each other, for the same operation, are coalesced into one
+vectorized call, and the results are split back per request.
+
+Requests are POSTed as TSV with a header line, or as an Arrow IPC stream when
+pyarrow is installed. Results use the format of the `Accept` header, TSV by
+default. For example::
+
+    smunger serve -d pos2snp.txt.gz -s /tmp/smunger.sock
+    curl --unix-socket /tmp/smunger.sock --data-binary @in.tsv http://localhost/annotate/rsid
+    curl --data-binary @in.tsv 'http://127.0.0.1:8765/liftover?inbuild=hg19&outbuild=hg38'
+
+Endpoints:
+
+- `POST /annotate/rsid`, optional parameter `chunksize`.
+- `POST /liftover`, parameters `inbuild` and `outbuild`.
+- `GET /health` and `GET /stats`, as json.
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from smunger.annotate import annotate_rsid_frame
+from smunger.batch import Batcher
+from smunger.constant import ColName
+from smunger.liftover import liftover, load_lifter
+from smunger.region import cache_stats, get_reader
+
+logger = logging.getLogger('server')
+
+TSV_MIME = 'text/tab-separated-values'
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+
+
+class AnnotationService:
+    """Annotation and liftover on warm reference data, with batching of concurrent requests."""
+
+    def __init__(self, database: Optional[str] = None, builds: Sequence[str] = (), max_wait: float = 0.005):
+        """
+        Load the reference data.
+
+        Parameters
+        ----------
+        database : Optional[str], optional
+            dbSNP database for rsid annotation, in the pos2snp format, by default None.
+        builds : Sequence[str], optional
+            Liftover chain files to load at start, as `inbuild:outbuild`, by default none.
+        max_wait : float, optional
+            Seconds to wait for batching concurrent requests, by default 0.005.
+        """
+        self.database = database
+        self.max_wait = max_wait
+        self._batchers: Dict[tuple, Batcher] = {}
+        self._lock = threading.Lock()
+        if database is not None:
+            # parse the index now, annotate_rsid shares this reader
+            get_reader(
+                database,
+                names=[ColName.CHR, ColName.BP, "rsid", "ref", "alt"],
+                dtype={"rsid": str, "ref": str, "alt": str},
+            )
+            logger.info(f'Loaded index of {database}.')
+        for build in builds:
+            inbuild, outbuild = build.split(':')
+            load_lifter(inbuild, outbuild)
+            logger.info(f'Loaded liftover from {inbuild} to {outbuild}.')
+
+    def batcher(self, key: tuple, func: Callable[[pd.DataFrame], pd.DataFrame]) -> Batcher:
+        """Get the batcher of an operation and its parameters."""
+        with self._lock:
+            if key not in self._batchers:
+                self._batchers[key] = Batcher(func, max_wait=self.max_wait)
+            return self._batchers[key]
+
+    def annotate_rsid(self, df: pd.DataFrame, chunksize: int = 2000000) -> pd.DataFrame:
+        """Annotate variants with rsids."""
+        if self.database is None:
+            raise ValueError('No dbSNP database, start the server with --database.')
+        database = self.database
+
+        def func(batch):
+            return annotate_rsid_frame(batch, database, chunksize)
+
+        return self.batcher(('annotate_rsid', chunksize), func).submit(df).result()
+
+    def liftover(self, df: pd.DataFrame, inbuild: str, outbuild: str) -> pd.DataFrame:
+        """Liftover variants."""
+
+        def func(batch):
+            return liftover(batch, inbuild, outbuild)
+
+        return self.batcher(('liftover', inbuild, outbuild), func).submit(df).result()
+
+    def stats(self) -> dict:
+        """Get the counters of the cache and of the batchers."""
+        with self._lock:
+            batchers = {
+                ':'.join(map(str, key)): {'requests': b.n_requests, 'batches': b.n_batches}
+                for key, b in self._batchers.items()
+            }
+        return {'cache': cache_stats(), 'batchers': batchers}
+
+    def close(self) -> None:
+        """Stop the batchers."""
+        with self._lock:
+            for b in self._batchers.values():
+                b.close()
+            self._batchers.clear()
+
+
+def read_frame(body: bytes, content_type: str) -> pd.DataFrame:
+    """Parse a request body, TSV or Arrow IPC stream."""
+    if content_type.startswith(ARROW_MIME):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError('Arrow requests require pyarrow.')
+        return pa.ipc.open_stream(body).read_pandas()
+    return pd.read_csv(io.BytesIO(body), sep='\t')
+
+
+def write_frame(df: pd.DataFrame, accept: str) -> Tuple[bytes, str]:
+    """Serialize a result, as Arrow IPC stream if accepted and pyarrow is installed, TSV otherwise."""
+    if ARROW_MIME in accept:
+        try:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes(), ARROW_MIME
+        except ImportError:
+            pass
+    return df.to_csv(sep='\t', index=False).encode(), TSV_MIME
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handle annotation and liftover requests."""
+
+    server_version = 'smunger'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> AnnotationService:
+        """The service of the server."""
+        return self.server.service  # type: ignore
+
+    def address_string(self) -> str:
+        """Client address, Unix sockets have none."""
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args) -> None:
+        """Log requests at debug level."""
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, obj) -> None:
+        self._send(status, json.dumps(obj).encode(), 'application/json')
+
+    def do_GET(self) -> None:
+        """Report health and counters."""
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif path == '/stats':
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {'error': f'Unknown path {path}.'})
+
+    def do_POST(self) -> None:
+        """Annotate or liftover the posted variants."""
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        start = time.perf_counter()
+        try:
+            df = read_frame(body, self.headers.get('Content-Type', TSV_MIME))
+            if url.path == '/annotate/rsid':
+                result = self.service.annotate_rsid(df, int(params.get('chunksize', 2000000)))
+            elif url.path == '/liftover':
+                result = self.service.liftover(df, params['inbuild'], params['outbuild'])
+            else:
+                self._send_json(404, {'error': f'Unknown path {url.path}.'})
+                return
+        except KeyError as e:
+            self._send_json(400, {'error': f'Missing parameter or column {e}.'})
+            return
+        except Exception as e:
+            logger.exception(f'Failed to process {url.path}.')
+            self._send_json(400, {'error': str(e)})
+            return
+        out, content_type = write_frame(result, self.headers.get('Accept', TSV_MIME))
+        self._send(200, out, content_type)
+        logger.debug(f'{url.path}: {len(df)} rows in {time.perf_counter() - start:.4f}s')
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server on a Unix socket, handling each connection in a thread."""
+
+    daemon_threads = True
+
+
+def make_server(
+    service: AnnotationService,
+    host: str = '127.0.0.1',
+    port: int = 8765,
+    socket_path: Optional[str] = None,
+) -> Union[ThreadingHTTPServer, ThreadingUnixHTTPServer]:
+    """
+    Create a server of a service, on HTTP or on a Unix socket.
+
+    Parameters
+    ----------
+    service : AnnotationService
+        The service.
+    host : str, optional
+        Host, by default 127.0.0.1.
+    port : int, optional
+        Port, by default 8765, 0 for any free port.
+    socket_path : Optional[str], optional
+        Serve on this Unix socket instead of HTTP, by default None.
+
+    Returns
+    -------
+    Union[ThreadingHTTPServer, ThreadingUnixHTTPServer]
+        The server, not yet serving.
+    """
+    server: Union[ThreadingHTTPServer, ThreadingUnixHTTPServer]
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service  # type: ignore
+    return server
+
+
+def serve(
+    database: Optional[str] = None,
+    builds: Sequence[str] = (),
+    host: str = '127.0.0.1',
+    port: int = 8765,
+    socket_path: Optional[str] = None,
+    max_wait: float = 0.005,
+) -> None:
+    """
+    Serve annotation and liftover until interrupted.
+
+    Parameters
+    ----------
+    database : Optional[str], optional
+        dbSNP database for rsid annotation, in the pos2snp format, by default None.
+    builds : Sequence[str], optional
+        Liftover chain files to load at start, as `inbuild:outbuild`, by default none.
+    host : str, optional
+        Host, by default 127.0.0.1.
+    port : int, optional
+        Port, by default 8765.
+    socket_path : Optional[str], optional
+        Serve on this Unix socket instead of HTTP, by default None.
+    max_wait : float, optional
+        Seconds to wait for batching concurrent requests, by default 0.005.
+    """
+    service = AnnotationService(database, builds, max_wait)
+    server = make_server(service, host, port, socket_path)
+    logger.info(f'Serving on {socket_path or f"http://{host}:{port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,231 @@
+"""Sharded layout of munged summary statistics.
+
+A sharded layout is a directory with a `manifest.json` and one bgzipped,
+tabix-indexed shard per chromosome, or per span of a chromosome. The manifest
+lists the shards in CHR/BP order with their row counts, their first and last
+positions and the checksums of their files, so that shards can be processed on
+separate nodes, checked, and stitched back into one file without sorting.
+
+`load_sumstats`, `export_sumstats` and the file functions of annotation and
+liftover read a sharded directory like a file.
+"""
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from smunger.cache import file_digest
+from smunger.constant import ColName
+from smunger.io import compress, index, load_sumstats, save_sumstats
+from smunger.pindex import build_pindex
+from smunger.region import TabixReader
+from smunger.smunger import sort_sumstats
+
+logger = logging.getLogger('shards')
+
+SHARDS_FORMAT = 'smunger-shards'
+SHARDS_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def shard_name(chrom: int, start: Optional[int] = None) -> str:
+    """Get the file name of a shard, `chr{chrom}.txt.gz`, or `chr{chrom}_{start}.txt.gz` for a span."""
+    return f'chr{chrom}.txt.gz' if start is None else f'chr{chrom}_{start}.txt.gz'
+
+
+def write_shards(
+    sumstats: pd.DataFrame,
+    path: str,
+    span: Optional[int] = None,
+    build_index: bool = True,
+    p_index: bool = True,
+) -> None:
+    """
+    Write munged summary statistics as shards.
+
+    Parameters
+    ----------
+    sumstats : pd.DataFrame
+        The munged summary statistics.
+    path : str
+        The shard directory, replaced if it exists.
+    span : Optional[int], optional
+        Split chromosomes into shards of this span, in bp, by default one shard per chromosome.
+    build_index : bool, optional
+        Index the shards with tabix, by default True.
+    p_index : bool, optional
+        Save the P-sorted index of the shards, by default True.
+    """
+    df = sort_sumstats(sumstats)
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp_path = tempfile.mkdtemp(prefix='.smunger_shards_', dir=parent)
+    shards: List[Dict] = []
+    try:
+        # a span shard holds the 1-based positions start..start + span - 1
+        groups = [df[ColName.CHR]] if span is None else [df[ColName.CHR], (df[ColName.BP] - 1) // span]
+        for key, shard_df in df.groupby(groups, sort=True):
+            chrom = int(key[0])  # type: ignore
+            start = None if span is None else int(key[1]) * span + 1  # type: ignore
+            name = shard_name(chrom, start)
+            save_sumstats(shard_df, os.path.join(tmp_path, name), build_index=build_index, p_index=p_index)
+            shards.append(
+                {
+                    'file': name,
+                    'chrom': chrom,
+                    'rows': len(shard_df),
+                    'bp_min': int(shard_df[ColName.BP].iloc[0]),
+                    'bp_max': int(shard_df[ColName.BP].iloc[-1]),
+                    'checksum': file_digest(os.path.join(tmp_path, name)),
+                }
+            )
+        manifest = {
+            'format': SHARDS_FORMAT,
+            'version': SHARDS_VERSION,
+            'columns': list(df.columns),
+            'span': span,
+            'rows': len(df),
+            'shards': shards,
+        }
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4)
+        if os.path.exists(path):
+            logger.warning(f'Shards {path} already exist. Overwriting.')
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+    logger.info(f'Saved {len(df)} rows in {len(shards)} shards to {path}')
+
+
+def is_sharded(path: str) -> bool:
+    """Whether a path is a shard directory."""
+    manifest = os.path.join(path, MANIFEST)
+    if not os.path.isfile(manifest):
+        return False
+    with open(manifest) as f:
+        return json.load(f).get('format') == SHARDS_FORMAT
+
+
+def read_manifest(path: str) -> Dict:
+    """Read the manifest of a shard directory."""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SHARDS_FORMAT:
+        raise ValueError(f'{path} is not a smunger shard directory.')
+    return manifest
+
+
+def select_shards(
+    path: str, chrom: Optional[int] = None, start: Optional[int] = None, end: Optional[int] = None
+) -> List[Dict]:
+    """Get the manifest entries of the shards overlapping a region, all shards by default."""
+    shards = read_manifest(path)['shards']
+    if chrom is not None:
+        shards = [shard for shard in shards if shard['chrom'] == int(chrom)]
+    if start is not None:
+        shards = [shard for shard in shards if shard['bp_max'] >= start]
+    if end is not None:
+        shards = [shard for shard in shards if shard['bp_min'] <= end]
+    return shards
+
+
+def verify_shards(path: str) -> List[str]:
+    """Get the shards whose files do not match the checksums of the manifest."""
+    return [
+        shard['file']
+        for shard in read_manifest(path)['shards']
+        if not os.path.exists(os.path.join(path, shard['file']))
+        or file_digest(os.path.join(path, shard['file'])) != shard['checksum']
+    ]
+
+
+def load_shards(
+    path: str,
+    chrom: Optional[int] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    nrows: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Load the summary statistics of a shard directory, or of a region.
+
+    Parameters
+    ----------
+    path : str
+        The shard directory.
+    chrom : Optional[int], optional
+        Chromosome, by default all.
+    start : Optional[int], optional
+        1-based start, by default the start of the chromosome.
+    end : Optional[int], optional
+        1-based end, by default the end of the chromosome.
+    nrows : Optional[int], optional
+        Number of rows to read, the shards after them are not read, by default all.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics, sorted by chromosome and position.
+    """
+    manifest = read_manifest(path)
+    frames: List[pd.DataFrame] = []
+    n = 0
+    for shard in select_shards(path, chrom, start, end):
+        if nrows is not None and n >= nrows:
+            break
+        filename = os.path.join(path, shard['file'])
+        left = None if nrows is None else nrows - n
+        if start is None and end is None:
+            frames.append(load_sumstats(filename, nrows=left))
+        else:
+            with TabixReader(filename, names=manifest['columns']) as reader:
+                frames.append(reader.query(shard['chrom'], (start or 1) - 1, end or shard['bp_max']).iloc[:left])
+        n += len(frames[-1])
+    if len(frames) == 0:
+        return pd.DataFrame(columns=manifest['columns'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def stitch_shards(path: str, outfile: str, build_index: bool = True, p_index: bool = True) -> None:
+    """
+    Stitch the shards of a directory into one bgzipped file, without sorting.
+
+    Parameters
+    ----------
+    path : str
+        The shard directory.
+    outfile : str
+        Output file.
+    build_index : bool, optional
+        Index the output with tabix, by default True.
+    p_index : bool, optional
+        Save the P-sorted index of the output, by default True.
+    """
+    manifest = read_manifest(path)
+    bad = verify_shards(path)
+    if len(bad) > 0:
+        raise ValueError(f'Shards {", ".join(bad)} of {path} do not match their checksums.')
+    out_path = Path(outfile)
+    if out_path.suffix == '.gz':
+        out_path = out_path.with_suffix('')
+    with open(out_path, 'wb') as f_out:
+        f_out.write(('\t'.join(manifest['columns']) + '\n').encode())
+        for shard in manifest['shards']:
+            with gzip.open(os.path.join(path, shard['file']), 'rb') as f_in:
+                # the shards are in CHR/BP order, only their header lines are skipped
+                f_in.readline()
+                shutil.copyfileobj(f_in, f_out)
+    compress(str(out_path))
+    if build_index:
+        index(str(out_path) + '.gz')
+    if p_index and ColName.P in manifest['columns']:
+        build_pindex(str(out_path) + '.gz')
+    logger.info(f'Stitched {len(manifest["shards"])} shards of {path} into {out_path}.gz')
@@ -1,23 +1,43 @@
 """Main module."""
 
+import functools
 import json
 import logging
-from typing import Union
+from typing import Optional, Union
 
 import numpy as np
 import pandas as pd
 
-from smunger.constant import ColName, ColRange, ColType
+from smunger.allele import AlleleMatch, encode_alleles, lookup, match_alleles, palindromic, valid_alleles
+from smunger.cache import StageCache
+from smunger.constant import ColName, ColRange, ColType, CompactColType
+from smunger.frames import arrow_io
+from smunger.parallel import default_workers, map_row_blocks, row_blocks
+from smunger.profiler import profiled, stage
+from smunger.variants import VariantCatalog, add_variant_ids
 
 logger = logging.getLogger('munger')
 
+# bump the version of a stage when its logic changes, cached outputs of older versions are not reused
+STAGE_VERSION = {'extract': 1, 'validate': 1, 'finalize': 2}
 
+# column and direction of the duplicate kept by each policy, None drops all copies
+DEDUP_POLICIES = {
+    'min_p': (ColName.P, 'min'),
+    'max_n': (ColName.N, 'max'),
+    'max_info': (ColName.INFO, 'max'),
+    'drop': None,
+}
+
+
+@profiled()
 def make_SNPID_unique(
     sumstat: pd.DataFrame,
     chrom_col: str = ColName.CHR,
     pos_col: str = ColName.BP,
     ea_col: str = ColName.EA,
     nea_col: str = ColName.NEA,
+    backend: str = 'pandas',
 ) -> pd.DataFrame:
     """
     Make the SNPID unique.
@@ -28,21 +48,35 @@ def make_SNPID_unique(
     ----------
     sumstat : pd.DataFrame
         The input summary statistics.
+    backend : str, optional
+        'pandas', or 'polars' to build the SNPIDs with Polars, see `make_SNPID_unique_polars`, by default 'pandas'.
 
     Returns
     -------
     pd.DataFrame
         The summary statistics with unique SNPID.
     """
+    if backend == 'polars':
+        from smunger.polars_backend import make_SNPID_unique_polars
+
+        return make_SNPID_unique_polars(sumstat, chrom_col, pos_col, ea_col, nea_col)
+    elif backend != 'pandas':
+        raise ValueError(f'Unknown backend {backend}, must be pandas or polars.')
     df = sumstat.copy()
-    allele_df = df[[ea_col, nea_col]].copy()
-    b = allele_df.values
-    b.sort(axis=1)
-    allele_df[[ea_col, nea_col]] = b
+    (ea, nea), vocab = encode_alleles(df[ea_col], df[nea_col], upper=False, sort=True)
+    # codes follow the order of the sorted vocabulary, so min/max sorts each pair
+    allele_df = pd.DataFrame(
+        {
+            ea_col: lookup(vocab, np.minimum(ea, nea), np.nan),
+            nea_col: lookup(vocab, np.maximum(ea, nea), np.nan),
+        },
+        index=df.index,
+    )
+    # object columns, so missing alleles give missing SNPIDs also with the pyarrow string dtype
     allele_df[ColName.SNPID] = (
-        df[chrom_col].astype(str)
+        df[chrom_col].astype(str).astype(object)
         + "-"
-        + df[pos_col].astype(str)
+        + df[pos_col].astype(str).astype(object)
         + "-"
         + allele_df[ea_col]
         + "-"
@@ -54,13 +88,20 @@ def make_SNPID_unique(
     return df
 
 
-def extract_cols(df: pd.DataFrame, colname_map: Union[dict, str]) -> pd.DataFrame:
-    """Map column names."""
+@profiled()
+def extract_cols(df: pd.DataFrame, colname_map: Union[dict, str], backend: str = 'pandas') -> pd.DataFrame:
+    """Map column names, with pandas or, for backend 'polars', with Polars."""
     # map column names
     if isinstance(colname_map, str):
         with open(colname_map, 'r') as f:
             colname_map = json.load(f)
     colname_map = dict(colname_map)  # type: ignore
+    if backend == 'polars':
+        from smunger.polars_backend import extract_cols_polars
+
+        return extract_cols_polars(df, colname_map)
+    elif backend != 'pandas':
+        raise ValueError(f'Unknown backend {backend}, must be pandas or polars.')
     colname_map = {k: v for k, v in colname_map.items() if k in df.columns}
     outdf = df.rename(columns=colname_map).copy()
     mapped_cols = list(colname_map.values())
@@ -69,13 +110,100 @@ def extract_cols(df: pd.DataFrame, colname_map: Union[dict, str]) -> pd.DataFram
     return outdf
 
 
-def check_colnames(df: pd.DataFrame) -> pd.DataFrame:
+@profiled()
+def check_colnames(df: pd.DataFrame, compact: bool = False, float32: bool = False) -> pd.DataFrame:
     """Check column names, fill None if not presents."""
     outdf = df.copy()
     for col in ColName.OUTCOLS:
         if col not in outdf.columns:
             outdf[col] = None
-    return outdf[ColName.OUTCOLS]
+    outdf = outdf[ColName.OUTCOLS]
+    if compact:
+        outdf = compact_dtypes(outdf, float32=float32)
+    elif float32:
+        outdf = float32_dtypes(outdf)
+    return outdf
+
+
+def fits_float32(values: np.ndarray) -> bool:
+    """
+    Check if float values can be stored as float32 and still be written identically.
+
+    Values are written with `%g`, i.e. six significant digits. Any decimal with at most
+    six significant digits survives a round trip through float32, so a column can be
+    stored as float32 if all its values have at most six significant digits and are
+    within the normal range of float32.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The float values.
+
+    Returns
+    -------
+    bool
+        Whether the values can be stored as float32.
+    """
+    values = values[np.isfinite(values) & (values != 0)]
+    if len(values) == 0:
+        return True
+    absval = np.abs(values)
+    finfo = np.finfo(np.float32)
+    if absval.min() < finfo.tiny or absval.max() > finfo.max:
+        return False
+    scale = 10.0 ** (np.floor(np.log10(absval)) - 5)
+    return bool(np.allclose(np.round(values / scale) * scale, values, rtol=1e-12, atol=0))
+
+
+@profiled()
+def compact_dtypes(df: pd.DataFrame, float32: bool = False) -> pd.DataFrame:
+    """
+    Convert munged summary statistics to memory-compact column types.
+
+    CHR and BP are stored as small integers, alleles and rsID as categoricals.
+    The text written by `save_sumstats` is unchanged.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The munged summary statistics.
+    float32 : bool, optional
+        Store float columns as float32 where precision allows, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics with compact column types.
+    """
+    outdf = df.copy()
+    for col, dtype in [
+        (ColName.CHR, CompactColType.CHR),
+        (ColName.BP, CompactColType.BP),
+        (ColName.EA, CompactColType.EA),
+        (ColName.NEA, CompactColType.NEA),
+        (ColName.RSID, CompactColType.RSID),
+    ]:
+        if col in outdf.columns and outdf[col].dtype != dtype:
+            outdf[col] = outdf[col].astype(dtype)
+    for col in [ColName.EAF, ColName.MAF, ColName.BETA, ColName.SE, ColName.P]:
+        # columns filled by check_colnames are all None
+        if col in outdf.columns and outdf[col].dtype == object:
+            outdf[col] = pd.to_numeric(outdf[col], errors="coerce").astype(np.float64)
+    return float32_dtypes(outdf) if float32 else outdf
+
+
+def float32_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the float columns of munged summary statistics as float32 where precision allows, see `fits_float32`."""
+    outdf = df.copy()
+    for col in CompactColType.FLOAT32:
+        if col not in outdf.columns:
+            continue
+        values = pd.to_numeric(outdf[col], errors="coerce").to_numpy(dtype=np.float64)
+        if fits_float32(values):
+            outdf[col] = values.astype(np.float32)
+        else:
+            logger.debug(f"Keep {col} as float64, its values need more than float32 precision.")
+    return outdf
 
 
 def rm_col_allna(df: pd.DataFrame) -> pd.DataFrame:
@@ -90,48 +218,234 @@ def rm_col_allna(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def get_sigdf(df: pd.DataFrame, pval: float = 5e-8) -> pd.DataFrame:
-    """Get significant SNPs."""
-    outdf = df.copy()
-    if ColName.P in outdf.columns:
-        outdf = outdf[outdf[ColName.P] < pval]
-    else:
+    """
+    Get significant SNPs.
+
+    Saved summary statistics can be queried without loading them, see `smunger.pindex.read_sigsnps`.
+    """
+    if ColName.P not in df.columns:
         raise ValueError("Missing P column.")
+    # boolean indexing already returns a new frame
+    return df[df[ColName.P] < pval]
+
+
+@profiled()
+def validate_sumstats(df: pd.DataFrame, remove_palindromic: bool = False) -> pd.DataFrame:
+    """
+    Validate the variants and P values of the summary statistics.
+
+    This is the row-wise part of `munge`, the output for a set of rows only depends on these rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics, without all-NA columns.
+    remove_palindromic : bool, optional
+        Remove palindromic variants, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The valid variants, with SNPID.
+    """
+    outdf = munge_chr(df)
+    outdf = munge_bp(outdf)
+    outdf = munge_allele(outdf, remove_palindromic=remove_palindromic)
+    outdf = make_SNPID_unique(outdf)
+    if ColName.P in outdf.columns:
+        outdf = munge_pvalue(outdf)
+    elif ColName.NEGLOGP in outdf.columns:
+        outdf = munge_neglogp(outdf)
+        outdf[ColName.P] = outdf[ColName.NEGLOGP].apply(lambda x: 10 ** (-x))
+    # TODO: use zscore to calculate pvalue, if pvalue is missing and zscore is present
     return outdf
 
 
-def munge(df: pd.DataFrame) -> pd.DataFrame:
-    """Munge the summary statistics."""
-    outdf = df.copy()
-    outdf = rm_col_allna(outdf)
-    if all(
-        [
-            ColName.CHR in outdf.columns,
-            ColName.BP in outdf.columns,
-            ColName.EA in outdf.columns,
-            ColName.NEA in outdf.columns,
-        ]
-    ):
-        outdf = munge_chr(outdf)
-        outdf = munge_bp(outdf)
-        outdf = munge_allele(outdf)
-        outdf = make_SNPID_unique(outdf)
-        if ColName.P in outdf.columns:
-            outdf = munge_pvalue(outdf)
-            outdf = outdf.sort_values(by=ColName.P)
-        elif ColName.NEGLOGP in outdf.columns:
-            outdf = munge_neglogp(outdf)
-            outdf[ColName.P] = outdf[ColName.NEGLOGP].apply(lambda x: 10 ** (-x))
-            outdf = outdf.sort_values(by=ColName.P)
-        # TODO: use zscore to calculate pvalue, if pvalue is missing and zscore is present
-        else:
-            pass
-        pre_n = outdf.shape[0]
-        outdf = outdf.drop_duplicates(subset=ColName.SNPID, keep="first")
-        outdf = outdf.sort_values(by=[ColName.CHR, ColName.BP])
-        after_n = outdf.shape[0]
-        logger.debug(f"Remove {pre_n - after_n} duplicated SNPs.")
+def _integer_positions(df: pd.DataFrame) -> bool:
+    """Check CHR and BP are integers without missing values, which `position_key` packs."""
+    return all(
+        pd.api.types.is_integer_dtype(df[col]) and not df[col].hasnans for col in [ColName.CHR, ColName.BP]
+    )
+
+
+def position_key(df: pd.DataFrame) -> np.ndarray:
+    """Pack the CHR and BP of validated summary statistics into int64 keys, ordered as (CHR, BP)."""
+    chrom = df[ColName.CHR].to_numpy(dtype=np.int64)
+    bp = df[ColName.BP].to_numpy(dtype=np.int64)
+    return (chrom << 32) | bp
+
+
+@profiled()
+def sort_sumstats(df: pd.DataFrame, by_p: bool = False) -> pd.DataFrame:
+    """
+    Sort validated summary statistics by CHR and BP.
+
+    The sort is stable, a single argsort of the packed positions, and a sorted input is returned as is.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics.
+    by_p : bool, optional
+        Sort variants at the same position by P, most significant first, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The sorted summary statistics.
+    """
+    by_p = by_p and ColName.P in df.columns
+    if not _integer_positions(df):
+        # e.g. missing or non-numeric positions, sorted as they are
+        by = [ColName.CHR, ColName.BP] + ([ColName.P] if by_p else [])
+        return df.sort_values(by, kind='mergesort')
+    key = position_key(df)
+    if not by_p and bool(np.all(key[1:] >= key[:-1])):
+        return df
+    order = np.argsort(key, kind='stable')
+    if by_p:
+        # variants sharing a position are few, only they are sorted by P
+        shared = np.flatnonzero(pd.Series(key[order]).duplicated(keep=False).to_numpy())
+        rows = order[shared]
+        pval = pd.to_numeric(df[ColName.P], errors='coerce').to_numpy()[rows]
+        order[shared] = rows[np.lexsort((pval, key[rows]))]
+    return df.take(order)
+
+
+def _resolve_duplicates(df: pd.DataFrame, policy: str = 'min_p'):
+    """Get the rows kept by a dedup policy, and the rows and SNPID codes of the duplicates."""
+    if policy not in DEDUP_POLICIES:
+        raise ValueError(f'Unknown dedup policy {policy}, must be one of {", ".join(DEDUP_POLICIES)}.')
+    rule = DEDUP_POLICIES[policy]
+    if rule is not None and rule[0] not in df.columns and policy != 'min_p':
+        raise ValueError(f"Missing {rule[0]} column.")
+    # duplicates share a position, only the SNPIDs of shared positions are hashed, the frame is not sorted
+    if _integer_positions(df):
+        shared = np.flatnonzero(pd.Series(position_key(df)).duplicated(keep=False).to_numpy())
     else:
-        raise ValueError("Missing CHR, BP, EA or NEA column.")
+        shared = np.flatnonzero(df.duplicated([ColName.CHR, ColName.BP], keep=False).to_numpy())
+    codes, _ = pd.factorize(df[ColName.SNPID].to_numpy()[shared])
+    is_dup = pd.Series(codes).duplicated(keep=False).to_numpy()
+    dup_rows, codes = shared[is_dup], codes[is_dup]
+    keep = np.ones(len(df), dtype=bool)
+    keep[dup_rows] = False
+    if rule is None or len(dup_rows) == 0:
+        return keep, dup_rows, codes
+    col, how = rule
+    if col in df.columns:
+        values = pd.Series(pd.to_numeric(df[col], errors='coerce').to_numpy()[dup_rows])
+    else:
+        values = pd.Series(np.zeros(len(dup_rows)))
+    best = values.groupby(codes).transform(how)
+    # the first copy with the best value is kept, or the first copy if none has a value
+    candidate = ((values == best) | best.isna()).to_numpy()
+    rows, row_codes = dup_rows[candidate], codes[candidate]
+    keep[rows[~pd.Series(row_codes).duplicated().to_numpy()]] = True
+    return keep, dup_rows, codes
+
+
+@profiled()
+def dedup_sumstats(df: pd.DataFrame, policy: str = 'min_p') -> pd.DataFrame:
+    """
+    Remove duplicated variants, i.e. rows with the same SNPID.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics, with SNPID.
+    policy : str, optional
+        The copy to keep, 'min_p' for the smallest P, 'max_n' for the largest N, 'max_info' for the largest INFO,
+        or 'drop' to remove all copies, by default 'min_p'.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics without duplicates, in the input order.
+    """
+    keep, _, _ = _resolve_duplicates(df, policy)
+    return df[keep]
+
+
+def duplicate_clusters(df: pd.DataFrame, policy: str = 'min_p') -> pd.DataFrame:
+    """
+    Report the clusters of duplicated variants.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics, with SNPID.
+    policy : str, optional
+        The dedup policy, see `dedup_sumstats`, by default 'min_p'.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per duplicated SNPID, with the number of copies, the index labels of the copies and of the kept copy.
+    """
+    keep, dup_rows, codes = _resolve_duplicates(df, policy)
+    clusters = pd.DataFrame(
+        {
+            ColName.SNPID: df[ColName.SNPID].to_numpy()[dup_rows],
+            'code': codes,
+            'row': df.index.to_numpy()[dup_rows],
+            'kept': keep[dup_rows],
+        }
+    )
+    kept = clusters[clusters['kept']].set_index('code')['row']
+    grouped = clusters.groupby('code', sort=False)
+    report = pd.DataFrame(
+        {
+            ColName.SNPID: grouped[ColName.SNPID].first(),
+            'COPIES': grouped.size(),
+            'ROWS': grouped['row'].agg(lambda rows: ','.join(map(str, rows))),
+        }
+    )
+    report['KEPT'] = kept.reindex(report.index).astype(object)
+    return report.reset_index(drop=True)
+
+
+@profiled()
+def finalize_sumstats(
+    df: pd.DataFrame,
+    compact: bool = False,
+    float32: bool = False,
+    dedup: str = 'min_p',
+    dup_report: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Deduplicate, sort and check the effect sizes of validated summary statistics.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The output of `validate_sumstats`.
+    compact : bool, optional
+        Use memory-compact column types, see `compact_dtypes`, by default False. CHR is then int8, BP int32,
+        and EA, NEA and rsID are categoricals.
+    float32 : bool, optional
+        Store float columns as float32 where precision allows, by default False.
+    dedup : str, optional
+        The duplicate kept, see `dedup_sumstats`, by default 'min_p'.
+    dup_report : Optional[str], optional
+        Save the clusters of duplicated variants to this file, see `duplicate_clusters`, by default None.
+
+    Returns
+    -------
+    pd.DataFrame
+        The munged summary statistics.
+    """
+    outdf = df
+    pre_n = outdf.shape[0]
+    if dup_report:
+        duplicate_clusters(outdf, dedup).to_csv(dup_report, sep='\t', index=False)
+    with stage('dedup', rows_in=pre_n, policy=dedup) as record:
+        outdf = dedup_sumstats(outdf, dedup)
+        record['rows_out'] = outdf.shape[0]
+    with stage('sort', rows_in=outdf.shape[0]):
+        # multi-allelic variants are sorted by P, as the duplicates were before
+        outdf = sort_sumstats(outdf, by_p=True)
+    after_n = outdf.shape[0]
+    logger.debug(f"Remove {pre_n - after_n} duplicated SNPs.")
 
     # outdf = munge_rsid(outdf)
     if ColName.BETA in outdf.columns and ColName.SE in outdf.columns:
@@ -157,10 +471,100 @@ def munge(df: pd.DataFrame) -> pd.DataFrame:
         outdf[ColName.MAF] = outdf[ColName.EAF]
     if ColName.MAF in outdf.columns:
         outdf = munge_maf(outdf)
-    outdf = check_colnames(outdf)
+    outdf = check_colnames(outdf, compact=compact, float32=float32)
     return outdf
 
 
+@arrow_io
+@profiled()
+def munge(
+    df: pd.DataFrame,
+    remove_palindromic: bool = False,
+    compact: bool = False,
+    float32: bool = False,
+    cache: Optional[StageCache] = None,
+    chunksize: int = 1000000,
+    dedup: str = 'min_p',
+    dup_report: Optional[str] = None,
+    workers: int = 1,
+    backend: str = 'pandas',
+    catalog: Optional[Union[VariantCatalog, str]] = None,
+) -> pd.DataFrame:
+    """
+    Munge the summary statistics.
+
+    Validation is row-wise, it runs on blocks of rows on `workers` processes, only the dedup and the sort
+    see all rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The summary statistics with mapped column names.
+    remove_palindromic : bool, optional
+        Remove palindromic variants, by default False.
+    compact : bool, optional
+        Use memory-compact column types, see `compact_dtypes`, by default False. CHR is then int8, BP int32,
+        and EA, NEA and rsID are categoricals.
+    float32 : bool, optional
+        Store float columns as float32 where precision allows, by default False.
+    cache : Optional[StageCache], optional
+        Cache of the validated chunks, unchanged chunks are not validated again, by default None.
+    chunksize : int, optional
+        Number of rows of a cached or validated block, by default 1000000. With several workers, blocks are
+        smaller if needed to give each worker one.
+    dedup : str, optional
+        The duplicate kept, 'min_p', 'max_n', 'max_info' or 'drop', see `dedup_sumstats`, by default 'min_p'.
+    dup_report : Optional[str], optional
+        Save the clusters of duplicated variants to this file, by default None.
+    workers : int, optional
+        Number of processes validating blocks of rows, 0 for all CPUs, by default 1.
+    backend : str, optional
+        'pandas', or 'polars' to run the pipeline as one multithreaded Polars query, see `munge_polars`,
+        by default 'pandas'. The polars backend does not use the cache, the dup report or the workers.
+    catalog : Optional[Union[VariantCatalog, str]], optional
+        Add the VARID of each variant in this catalog, or catalog directory, adding the new variants to it,
+        see `smunger.variants`, by default None.
+
+    Returns
+    -------
+    pd.DataFrame
+        The munged summary statistics.
+    """
+    if backend == 'polars':
+        if cache is not None or dup_report:
+            raise ValueError('The cache and the dup report require the pandas backend.')
+        from smunger.polars_backend import munge_polars
+
+        outdf = munge_polars(df, remove_palindromic=remove_palindromic, compact=compact, float32=float32, dedup=dedup)
+        return add_variant_ids(outdf, catalog) if catalog is not None else outdf
+    elif backend != 'pandas':
+        raise ValueError(f'Unknown backend {backend}, must be pandas or polars.')
+    outdf = df.copy()
+    outdf = rm_col_allna(outdf)
+    if not all(col in outdf.columns for col in [ColName.CHR, ColName.BP, ColName.EA, ColName.NEA]):
+        raise ValueError("Missing CHR, BP, EA or NEA column.")
+    workers = workers or default_workers()
+    validate = functools.partial(validate_sumstats, remove_palindromic=remove_palindromic)
+    if cache is None and workers <= 1:
+        outdf = validate(outdf)
+    elif cache is None:
+        blocksize = min(chunksize, -(-len(outdf) // workers))
+        parts = map_row_blocks(outdf, validate, row_blocks(len(outdf), max(blocksize, 1)), workers)
+        outdf = pd.concat(parts) if len(parts) > 1 else parts[0]
+    else:
+        outdf = cache.map_chunks(
+            'validate',
+            STAGE_VERSION['validate'],
+            {'remove_palindromic': remove_palindromic},
+            outdf,
+            validate,
+            chunksize=chunksize,
+            workers=workers,
+        )
+    outdf = finalize_sumstats(outdf, compact=compact, float32=float32, dedup=dedup, dup_report=dup_report)
+    return add_variant_ids(outdf, catalog) if catalog is not None else outdf
+
+
 def munge_rsid(df: pd.DataFrame) -> pd.DataFrame:
     """Munge rsID column."""
     outdf = df.copy()
@@ -168,6 +572,7 @@ def munge_rsid(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_chr(df: pd.DataFrame) -> pd.DataFrame:
     """Munge chromosome column."""
     pre_n = df.shape[0]
@@ -187,6 +592,7 @@ def munge_chr(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_bp(df: pd.DataFrame) -> pd.DataFrame:
     """Munge position column."""
     pre_n = df.shape[0]
@@ -200,22 +606,48 @@ def munge_bp(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
-def munge_allele(df: pd.DataFrame) -> pd.DataFrame:
-    """Munge allele column."""
-    outdf = df.copy()
-    for col in [ColName.EA, ColName.NEA]:
-        pre_n = outdf.shape[0]
-        outdf = outdf[outdf[col].notnull()]
-        outdf[col] = outdf[col].astype(str)
-        outdf[col] = outdf[col].str.upper()
-        # make sure all alleles only contain one or more ACGT characters
-        outdf = outdf[outdf[col].str.match(r"^[ACGT]+$")]
-        after_n = outdf.shape[0]
-        logger.debug(f"Remove {pre_n - after_n} rows because of invalid {col}.")
-    outdf = outdf[outdf[ColName.EA] != outdf[ColName.NEA]]
+@profiled()
+def munge_allele(df: pd.DataFrame, remove_palindromic: bool = False) -> pd.DataFrame:
+    """
+    Munge allele columns.
+
+    Alleles are converted to upper case and must only contain one or more ACGT characters.
+    EA and NEA must differ.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The input summary statistics.
+    remove_palindromic : bool, optional
+        Remove palindromic (A/T, C/G) variants, which are strand ambiguous, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics with valid alleles.
+    """
+    pre_n = df.shape[0]
+    (ea, nea), vocab = encode_alleles(df[ColName.EA], df[ColName.NEA])
+    valid = valid_alleles(vocab)
+    keep = np.ones(pre_n, dtype=bool)
+    for col, codes in [(ColName.EA, ea), (ColName.NEA, nea)]:
+        col_valid = lookup(valid, codes, False)
+        logger.debug(f"Remove {(keep & ~col_valid).sum()} rows because of invalid {col}.")
+        keep &= col_valid
+    keep &= ea != nea
+    if remove_palindromic:
+        is_palindromic = palindromic(ea, nea, vocab)
+        logger.debug(f"Remove {(keep & is_palindromic).sum()} palindromic variants.")
+        keep &= ~is_palindromic
+    outdf = df[keep].copy()
+    outdf[ColName.EA] = vocab[ea[keep]]
+    outdf[ColName.NEA] = vocab[nea[keep]]
+    after_n = outdf.shape[0]
+    logger.debug(f"Remove {pre_n - after_n} rows because of invalid alleles.")
     return outdf
 
 
+@profiled()
 def munge_pvalue(df: pd.DataFrame) -> pd.DataFrame:
     """Munge pvalue column."""
     outdf = df.copy()
@@ -229,6 +661,7 @@ def munge_pvalue(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_neglogp(df: pd.DataFrame) -> pd.DataFrame:
     """Munge neglogp column."""
     outdf = df.copy()
@@ -242,6 +675,7 @@ def munge_neglogp(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_beta(df: pd.DataFrame) -> pd.DataFrame:
     """Munge beta column."""
     pre_n = df.shape[0]
@@ -254,6 +688,7 @@ def munge_beta(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_se(df: pd.DataFrame) -> pd.DataFrame:
     """Munge se column."""
     pre_n = df.shape[0]
@@ -267,6 +702,7 @@ def munge_se(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_or(df: pd.DataFrame) -> pd.DataFrame:
     """Munge or column."""
     pre_n = df.shape[0]
@@ -279,6 +715,7 @@ def munge_or(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_orse(df: pd.DataFrame) -> pd.DataFrame:
     """Munge orse column."""
     pre_n = df.shape[0]
@@ -292,6 +729,7 @@ def munge_orse(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_z(df: pd.DataFrame) -> pd.DataFrame:
     """Munge z column."""
     pre_n = df.shape[0]
@@ -304,6 +742,7 @@ def munge_z(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_eaf(df: pd.DataFrame) -> pd.DataFrame:
     """Munge eaf column."""
     pre_n = df.shape[0]
@@ -317,6 +756,7 @@ def munge_eaf(df: pd.DataFrame) -> pd.DataFrame:
     return outdf
 
 
+@profiled()
 def munge_maf(df: pd.DataFrame) -> pd.DataFrame:
     """Munge maf column."""
     pre_n = df.shape[0]
@@ -340,18 +780,67 @@ def calculate_lambda(df: pd.DataFrame) -> float:
     return lambda_gc  # type: ignore
 
 
-def harmonize(sumstat1, sumstat2) -> pd.DataFrame:
-    """Harmonize two sumstats."""
-    sumstat1 = make_SNPID_unique(sumstat1)
-    sumstat2 = make_SNPID_unique(sumstat2)
-    merged = pd.merge(sumstat1, sumstat2, on=ColName.SNPID, how="inner", suffixes=("_1", "_2"))
-    merged[f'{ColName.BETA}_2'] = merged[f'{ColName.BETA}_2'].where(
-        merged[f'{ColName.EA}_1'] == merged[f'{ColName.EA}_2'], -merged[f'{ColName.BETA}_2']
-    )
+@arrow_io
+@profiled()
+def harmonize(
+    sumstat1: pd.DataFrame, sumstat2: pd.DataFrame, strand_flip: bool = False, backend: str = 'pandas'
+) -> pd.DataFrame:
+    """
+    Harmonize two sumstats.
+
+    BETA of the second sumstat is aligned to the effect allele of the first one.
+
+    Parameters
+    ----------
+    sumstat1 : pd.DataFrame
+        The first summary statistics.
+    sumstat2 : pd.DataFrame
+        The second summary statistics.
+    strand_flip : bool, optional
+        Match variants by position and allow alleles on the opposite strand, by default False.
+        Palindromic variants are removed, as their strand is ambiguous.
+    backend : str, optional
+        'pandas', or 'polars' to join with Polars, by default 'pandas'. Strand flips are matched with pandas.
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged summary statistics, with suffixes `_1` and `_2`. Sumstats that both have the VARID of a catalog,
+        see `smunger.variants`, are joined on VARID, without SNPID.
+    """
+    by_varid = ColName.VARID in sumstat1.columns and ColName.VARID in sumstat2.columns
+    if backend == 'polars' and not strand_flip and not by_varid:
+        from smunger.polars_backend import harmonize_polars
+
+        return harmonize_polars(sumstat1, sumstat2)
+    if not by_varid or strand_flip:
+        sumstat1 = make_SNPID_unique(sumstat1)
+        sumstat2 = make_SNPID_unique(sumstat2)
+    if strand_flip:
+        merged = pd.merge(sumstat1, sumstat2, on=[ColName.CHR, ColName.BP], how="inner", suffixes=("_1", "_2"))
+        status = match_alleles(
+            merged[f'{ColName.EA}_1'], merged[f'{ColName.NEA}_1'], merged[f'{ColName.EA}_2'], merged[f'{ColName.NEA}_2']
+        )
+        (ea, nea), vocab = encode_alleles(merged[f'{ColName.EA}_1'], merged[f'{ColName.NEA}_1'])
+        keep = (status != AlleleMatch.MISMATCH) & ~palindromic(ea, nea, vocab)
+        logger.debug(f"Remove {(~keep).sum()} mismatched or palindromic variants.")
+        merged = merged[keep].copy()
+        flipped = np.isin(status[keep], [AlleleMatch.SWAP, AlleleMatch.FLIP_SWAP])
+        merged.insert(loc=0, column=ColName.SNPID, value=merged.pop(f'{ColName.SNPID}_1'))
+        del merged[f'{ColName.SNPID}_2']
+    else:
+        key = ColName.VARID if by_varid else ColName.SNPID
+        if by_varid:
+            # variants missing from the catalog have VARID -1
+            sumstat1 = sumstat1[sumstat1[ColName.VARID].to_numpy() >= 0]
+        merged = pd.merge(sumstat1, sumstat2, on=key, how="inner", suffixes=("_1", "_2"))
+        (ea1, ea2), _ = encode_alleles(merged[f'{ColName.EA}_1'], merged[f'{ColName.EA}_2'])
+        flipped = ea1 != ea2
+        del merged[f'{ColName.CHR}_2']
+        del merged[f'{ColName.BP}_2']
+    merged[f'{ColName.BETA}_2'] = merged[f'{ColName.BETA}_2'].where(~flipped, -merged[f'{ColName.BETA}_2'])
     del merged[f'{ColName.EA}_2']
     del merged[f'{ColName.NEA}_2']
-    del merged[f'{ColName.CHR}_2']
-    del merged[f'{ColName.BP}_2']
     merged = merged.rename(
         columns={
             f'{ColName.EA}_1': ColName.EA,
@@ -0,0 +1,254 @@
+"""Memory-mapped store of munged summary statistics.
+
+A store is a directory with a `manifest.json` and a sub-directory per
+chromosome, holding each column as a `.npy` array sorted by position. String
+columns are stored as integer codes and a fixed-width vocabulary. Arrays are
+memory-mapped, so queries only read the pages they touch and the pages are
+shared by all processes reading the same store:
+
+- `region` and `lookup` binary search the positions of a chromosome,
+- `top_hits` binary searches a P-sorted copy of the P values.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.smunger import compact_dtypes
+
+logger = logging.getLogger('store')
+
+STORE_FORMAT = 'smunger-store'
+STORE_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def _chrom_dir(path: str, chrom: int) -> str:
+    return os.path.join(path, f'chr{chrom}')
+
+
+def write_store(sumstats: pd.DataFrame, path: str) -> None:
+    """
+    Write munged summary statistics as a memory-mapped store.
+
+    Parameters
+    ----------
+    sumstats : pd.DataFrame
+        The munged summary statistics.
+    path : str
+        The store directory, replaced if it exists.
+    """
+    df = sumstats.sort_values(by=[ColName.CHR, ColName.BP], kind='mergesort')
+    columns = [col for col in df.columns if col != ColName.CHR]
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp_path = tempfile.mkdtemp(prefix='.smunger_store_', dir=parent)
+    chroms: Dict[str, int] = {}
+    kinds: Dict[str, str] = {}
+    try:
+        for chrom, chr_df in df.groupby(ColName.CHR, sort=True):
+            chrom_path = _chrom_dir(tmp_path, int(chrom))  # type: ignore
+            os.makedirs(chrom_path)
+            chroms[str(int(chrom))] = len(chr_df)  # type: ignore
+            for col in columns:
+                values = chr_df[col]
+                if pd.api.types.is_numeric_dtype(values.dtype) and not isinstance(values.dtype, pd.CategoricalDtype):
+                    kinds[col] = 'numeric'
+                    np.save(os.path.join(chrom_path, f'{col}.npy'), values.to_numpy())
+                else:
+                    kinds[col] = 'string'
+                    codes, vocab = pd.factorize(values.astype(object), sort=True)
+                    np.save(os.path.join(chrom_path, f'{col}.codes.npy'), codes.astype(np.int32))
+                    np.save(os.path.join(chrom_path, f'{col}.vocab.npy'), np.array(vocab, dtype=bytes))
+            if ColName.P in columns and kinds[ColName.P] == 'numeric':
+                pval = chr_df[ColName.P].to_numpy(dtype=np.float64)
+                order = np.argsort(pval, kind='stable')
+                np.save(os.path.join(chrom_path, 'P.order.npy'), order.astype(np.int64))
+                np.save(os.path.join(chrom_path, 'P.sorted.npy'), pval[order])
+        manifest = {
+            'format': STORE_FORMAT,
+            'version': STORE_VERSION,
+            'columns': list(df.columns),
+            'dtypes': {col: str(df[col].dtype) for col in columns},
+            'kinds': kinds,
+            'chromosomes': chroms,
+        }
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4)
+        if os.path.exists(path):
+            logger.warning(f'Store {path} already exists. Overwriting.')
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+    logger.info(f'Saved {len(df)} rows of {len(chroms)} chromosomes to {path}')
+
+
+def is_store(path: str) -> bool:
+    """Whether a path is a store directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+class SumstatStore:
+    """Read a memory-mapped store of munged summary statistics, see `write_store`."""
+
+    def __init__(self, path: str):
+        """
+        Open a store.
+
+        Parameters
+        ----------
+        path : str
+            The store directory.
+        """
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != STORE_FORMAT:
+            raise ValueError(f'{path} is not a smunger store.')
+        self.path = path
+        self.columns: List[str] = manifest['columns']
+        self.dtypes: Dict[str, str] = manifest['dtypes']
+        self.kinds: Dict[str, str] = manifest['kinds']
+        self.chromosomes: Dict[int, int] = {int(k): v for k, v in manifest['chromosomes'].items()}
+        self._arrays: Dict[tuple, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        """Total number of rows."""
+        return sum(self.chromosomes.values())
+
+    def _array(self, chrom: int, name: str) -> np.ndarray:
+        key = (chrom, name)
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(_chrom_dir(self.path, chrom), f'{name}.npy'), mmap_mode='r')
+        return self._arrays[key]
+
+    def _column(self, chrom: int, col: str, idx: np.ndarray):
+        if col == ColName.CHR:
+            return np.full(len(idx), chrom, dtype=self.dtypes.get(col, 'int64'))
+        if self.kinds[col] == 'numeric':
+            return self._array(chrom, col)[idx]
+        codes = self._array(chrom, f'{col}.codes')[idx]
+        values = np.full(len(idx), None, dtype=object)
+        found = codes >= 0
+        # only the used entries of the vocabulary are read and decoded
+        values[found] = self._array(chrom, f'{col}.vocab')[codes[found]].astype(str)
+        return values
+
+    def _frame(self, chrom: int, idx: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({col: self._column(chrom, col, idx) for col in self.columns})
+
+    def _concat(self, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        frames = [frame for frame in frames if len(frame) > 0]
+        if len(frames) == 0 and len(self.chromosomes) == 0:
+            return pd.DataFrame(columns=self.columns)
+        if len(frames) == 0:
+            df = self._frame(next(iter(self.chromosomes)), np.array([], dtype=np.int64))
+        else:
+            df = pd.concat(frames, ignore_index=True)
+        return compact_dtypes(df)
+
+    def region(self, chrom: int, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """
+        Read the variants in a region.
+
+        Parameters
+        ----------
+        chrom : int
+            Chromosome.
+        start : Optional[int], optional
+            1-based start, inclusive, by default the start of the chromosome.
+        end : Optional[int], optional
+            1-based end, inclusive, by default the end of the chromosome.
+
+        Returns
+        -------
+        pd.DataFrame
+            The variants, sorted by position.
+        """
+        chrom = int(chrom)
+        if chrom not in self.chromosomes:
+            return self._concat([])
+        bp = self._array(chrom, ColName.BP)
+        lo = 0 if start is None else int(np.searchsorted(bp, start, side='left'))
+        hi = len(bp) if end is None else int(np.searchsorted(bp, end, side='right'))
+        return self._concat([self._frame(chrom, np.arange(lo, hi))])
+
+    def lookup(self, snpids: Sequence[str]) -> pd.DataFrame:
+        """
+        Read variants by unique SNPID, i.e. chr-bp-sorted(EA,NEA).
+
+        Parameters
+        ----------
+        snpids : Sequence[str]
+            The SNPIDs.
+
+        Returns
+        -------
+        pd.DataFrame
+            The found variants, in the order of the query, with a SNPID column.
+        """
+        snpid = pd.Series(snpids, dtype=object).astype(str)
+        parts = snpid.str.split('-', n=3, expand=True).reindex(columns=range(4))
+        query_chrom = pd.to_numeric(parts[0], errors='coerce').to_numpy()
+        query_bp = pd.to_numeric(parts[1], errors='coerce').to_numpy()
+        query_a1, query_a2 = parts[2].to_numpy(dtype=str), parts[3].to_numpy(dtype=str)
+        valid = np.isin(query_chrom, list(self.chromosomes)) & ~np.isnan(query_bp)
+        frames, orders = [], []
+        for chrom in np.unique(query_chrom[valid]).astype(int):
+            sel = np.flatnonzero(valid & (query_chrom == chrom))
+            bp = self._array(chrom, ColName.BP)
+            lo = np.searchsorted(bp, query_bp[sel], side='left')
+            hi = np.searchsorted(bp, query_bp[sel], side='right')
+            # variants at the same position are few, compare their alleles
+            n = hi - lo
+            qi = np.repeat(np.arange(len(sel)), n)
+            idx = np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            ea = self._column(chrom, ColName.EA, idx).astype(str)
+            nea = self._column(chrom, ColName.NEA, idx).astype(str)
+            a1, a2 = np.where(ea < nea, ea, nea), np.where(ea < nea, nea, ea)
+            match = (a1 == query_a1[sel][qi]) & (a2 == query_a2[sel][qi])
+            found = sel[qi[match]]
+            frame = self._frame(chrom, idx[match])
+            frame.insert(0, ColName.SNPID, snpid.to_numpy()[found])
+            frames.append(frame)
+            orders.append(found)
+        df = self._concat(frames)
+        if len(orders) > 0:
+            df = df.iloc[np.argsort(np.concatenate(orders), kind='stable')].reset_index(drop=True)
+        elif ColName.SNPID not in df.columns:
+            df.insert(0, ColName.SNPID, pd.Series(dtype=object))
+        return df
+
+    def top_hits(self, pval: float = 5e-8) -> pd.DataFrame:
+        """
+        Read the variants with P below a threshold.
+
+        Parameters
+        ----------
+        pval : float, optional
+            P value threshold, by default 5e-8.
+
+        Returns
+        -------
+        pd.DataFrame
+            The variants, sorted by chromosome and position.
+        """
+        if self.kinds.get(ColName.P) != 'numeric':
+            raise ValueError("Missing P column.")
+        frames = []
+        for chrom in sorted(self.chromosomes):
+            n = int(np.searchsorted(self._array(chrom, 'P.sorted'), pval, side='left'))
+            idx = np.sort(self._array(chrom, 'P.order')[:n])
+            frames.append(self._frame(chrom, idx))
+        return self._concat(frames)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Read the whole store."""
+        return self._concat([self._frame(chrom, np.arange(n)) for chrom, n in sorted(self.chromosomes.items())])
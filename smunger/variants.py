@@ -0,0 +1,338 @@
+"""Catalog of variants shared by studies.
+
+A catalog interns each variant, i.e. CHR, BP and the sorted allele pair as in
+`make_SNPID_unique`, into a stable integer ID, VARID, so variants of different
+studies are joined on integers instead of SNPID strings. A variant is packed
+into a uint64 key, CHR in the top 5 bits, BP in the next 29 bits and the code
+of its allele pair in the low 30 bits, so keys sort by position.
+
+A catalog is a directory of runs and a `manifest.json` listing them, oldest
+first. A run holds the variants added at once, or merged runs, as `.npy` arrays:
+
+- `keys.npy`, its keys, sorted, and `ids.npy`, their IDs, binary searched by `lookup`,
+- `by_id.npy`, the key of each of its IDs, read by `variants`,
+- `pairs.npy`, the allele pairs it added, e.g. `A-G`, in the order of their codes.
+
+Arrays are memory-mapped. IDs are assigned in the order variants are added and
+never change, the IDs and pair codes of a run follow those of the older runs.
+A catalog grows as studies add new variants, see `add`, which processes sharing
+a catalog take turns at through a lock file. An add writes only a run of its new
+variants, merged with the last runs while they are not larger, so a catalog has
+O(log N) runs and a variant is rewritten O(log N) times, see also `compact`.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from smunger.allele import encode_alleles, lookup
+from smunger.constant import ColName
+
+logger = logging.getLogger('variants')
+
+CATALOG_FORMAT = 'smunger-variants'
+CATALOG_VERSION = 2
+MANIFEST = 'manifest.json'
+LOCK = '.lock'
+RUN_ARRAYS = ('keys', 'ids', 'by_id', 'pairs')
+LOAD_ATTEMPTS = 3
+CHR_BITS, BP_BITS, PAIR_BITS = 5, 29, 30
+
+
+def _merge_runs(older: Dict[str, np.ndarray], newer: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Merge a run into the run before it."""
+    pos = np.searchsorted(older['keys'], newer['keys'])
+    return {
+        'keys': np.insert(np.asarray(older['keys']), pos, newer['keys']),
+        'ids': np.insert(np.asarray(older['ids']), pos, newer['ids']),
+        'by_id': np.concatenate([older['by_id'], newer['by_id']]),
+        'pairs': np.concatenate([older['pairs'], newer['pairs']]),
+    }
+
+
+class VariantCatalog:
+    """Intern variants into stable integer IDs, see the module docstring."""
+
+    def __init__(self, path: str):
+        """
+        Open a catalog, an empty one if the directory does not exist.
+
+        Parameters
+        ----------
+        path : str
+            The catalog directory.
+        """
+        self.path = path
+        self._load()
+
+    def _load(self) -> None:
+        """Read the manifest of the catalog and map the arrays of its runs."""
+        manifest_file = os.path.join(self.path, MANIFEST)
+        for attempt in range(LOAD_ATTEMPTS):
+            if os.path.exists(manifest_file):
+                with open(manifest_file) as f:
+                    manifest = json.load(f)
+                if manifest.get('format') != CATALOG_FORMAT:
+                    raise ValueError(f'{self.path} is not a smunger variant catalog.')
+                if manifest.get('version') != CATALOG_VERSION:
+                    raise ValueError(f'{self.path} is a version {manifest.get("version")} variant catalog.')
+            else:
+                manifest = {'format': CATALOG_FORMAT, 'version': CATALOG_VERSION, 'next_run': 0, 'runs': []}
+            try:
+                runs = [self._map_run(run['name']) for run in manifest['runs']]
+                break
+            except FileNotFoundError:
+                # a writer merged the runs after the manifest was read
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+        self.manifest = manifest
+        self.runs: List[Dict[str, np.ndarray]] = runs
+        self.starts = np.cumsum([0] + [len(run['by_id']) for run in runs])
+        pairs = np.concatenate([np.empty(0, dtype=bytes)] + [run['pairs'] for run in runs]).astype(str)
+        self.pairs: Dict[str, int] = {pair: code for code, pair in enumerate(pairs.tolist())}
+        self.n_pairs = len(self.pairs)
+
+    def _map_run(self, name: str) -> Dict[str, np.ndarray]:
+        """Map the arrays of a run."""
+        return {array: np.load(os.path.join(self.path, name, f'{array}.npy'), mmap_mode='r') for array in RUN_ARRAYS}
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the lock of the catalog, shared by the processes adding variants, and reload the catalog."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.path + LOCK, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._load()
+                # a writer that died before updating the manifest left its run behind
+                listed = {MANIFEST} | {run['name'] for run in self.manifest['runs']}
+                for name in set(os.listdir(self.path)) - listed:
+                    orphan = os.path.join(self.path, name)
+                    if os.path.isdir(orphan):
+                        shutil.rmtree(orphan)
+                    else:
+                        os.remove(orphan)
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        """Get the number of variants."""
+        return int(self.starts[-1])
+
+    def _keys(self, df: pd.DataFrame, intern: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """Pack the variants of a frame into keys, new allele pairs are interned if `intern`."""
+        chrom = pd.to_numeric(df[ColName.CHR], errors='coerce').to_numpy(dtype=np.float64)
+        pos = pd.to_numeric(df[ColName.BP], errors='coerce').to_numpy(dtype=np.float64)
+        (ea, nea), vocab = encode_alleles(df[ColName.EA], df[ColName.NEA], upper=False, sort=True)
+        valid = (
+            (chrom >= 1) & (chrom < 1 << CHR_BITS) & (pos >= 0) & (pos < 1 << BP_BITS) & (ea >= 0) & (nea >= 0)
+        )
+        # codes follow the order of the sorted vocabulary, so min/max sorts each pair, as make_SNPID_unique
+        local = np.where(valid, np.minimum(ea, nea) * len(vocab) + np.maximum(ea, nea), -1)
+        uniques, inverse = np.unique(local[valid], return_inverse=True)
+        codes = np.empty(len(uniques), dtype=np.int64)
+        # pairs are looked up once per unique pair of the frame
+        for ith, pair in enumerate(uniques.tolist()):
+            name = f'{vocab[pair // len(vocab)]}-{vocab[pair % len(vocab)]}'
+            if name not in self.pairs and intern:
+                if len(self.pairs) == 1 << PAIR_BITS:
+                    raise ValueError(f'{self.path} has more than 2^{PAIR_BITS} allele pairs.')
+                self.pairs[name] = len(self.pairs)
+            codes[ith] = self.pairs.get(name, -1)
+        pair_codes = np.full(len(df), -1, dtype=np.int64)
+        pair_codes[valid] = codes[inverse]
+        valid &= pair_codes >= 0
+        keys = np.zeros(len(df), dtype=np.uint64)
+        keys[valid] = (
+            (chrom[valid].astype(np.uint64) << np.uint64(BP_BITS + PAIR_BITS))
+            | (pos[valid].astype(np.uint64) << np.uint64(PAIR_BITS))
+            | pair_codes[valid].astype(np.uint64)
+        )
+        return valid, keys
+
+    def _search(self, keys: np.ndarray) -> np.ndarray:
+        """Get the IDs of keys, -1 for keys not in the catalog."""
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        # a variant is in a single run, the runs are searched in turn
+        for run in self.runs:
+            if len(run['keys']) == 0 or len(keys) == 0:
+                continue
+            idx = np.minimum(np.searchsorted(run['keys'], keys), len(run['keys']) - 1)
+            found = run['keys'][idx] == keys
+            ids[found] = run['ids'][idx[found]]
+        return ids
+
+    def lookup(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Get the IDs of variants.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Variants, with CHR, BP, EA and NEA.
+
+        Returns
+        -------
+        np.ndarray
+            The IDs, as int64, -1 for variants not in the catalog or with a missing or out of range column.
+        """
+        valid, keys = self._keys(df, intern=False)
+        return np.where(valid, self._search(keys), -1)
+
+    def add(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Get the IDs of variants, adding the new variants to the catalog.
+
+        New variants get the next IDs, in the order of their first row. Processes adding variants hold the lock
+        file `{path}.lock`. The new variants are written as a run, merged with the last runs while they are not
+        larger, which then replaces them in the manifest.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Variants, with CHR, BP, EA and NEA.
+
+        Returns
+        -------
+        np.ndarray
+            The IDs, as int64, -1 for variants with a missing or out of range column.
+        """
+        with self._locked():
+            valid, keys = self._keys(df, intern=True)
+            ids = np.where(valid, self._search(keys), -1)
+            new = valid & (ids < 0)
+            new_keys, first = np.unique(keys[new], return_index=True)
+            if len(new_keys) > 0:
+                # IDs follow the order of the first row of each new variant
+                order = np.argsort(first, kind='stable')
+                new_ids = np.empty(len(new_keys), dtype=np.int64)
+                new_ids[order] = np.arange(len(self), len(self) + len(new_keys))
+                run = {
+                    'keys': new_keys,
+                    'ids': new_ids,
+                    'by_id': new_keys[order],
+                    'pairs': np.array(list(self.pairs)[self.n_pairs :], dtype=bytes),
+                }
+                n_runs = len(self.runs)
+                while n_runs > 0 and len(self.runs[n_runs - 1]['keys']) <= len(run['keys']):
+                    n_runs -= 1
+                    run = _merge_runs(self.runs[n_runs], run)
+                self._write(run, n_runs)
+                ids[new] = new_ids[np.searchsorted(new_keys, keys[new])]
+                logger.info(f'Added {len(new_keys)} variants to {self.path}, {len(self)} in total.')
+        return ids
+
+    def compact(self) -> None:
+        """Merge the runs of the catalog into one, for the fewest binary searches per lookup."""
+        with self._locked():
+            if len(self.runs) > 1:
+                run = self.runs[0]
+                for newer in self.runs[1:]:
+                    run = _merge_runs(run, newer)
+                self._write(run, 0)
+                logger.info(f'Compacted {self.path} into one run of {len(self)} variants.')
+
+    def _write(self, run: Dict[str, np.ndarray], n_runs: int) -> None:
+        """Write a run replacing the runs after the first `n_runs` and map the catalog."""
+        name = f'run-{self.manifest["next_run"]:06d}'
+        tmp_path = tempfile.mkdtemp(prefix='.run_', dir=self.path)
+        try:
+            for array in RUN_ARRAYS:
+                np.save(os.path.join(tmp_path, f'{array}.npy'), run[array])
+            os.replace(tmp_path, os.path.join(self.path, name))
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+        runs = self.manifest['runs'][:n_runs] + [{'name': name, 'variants': len(run['by_id'])}]
+        manifest = {
+            'format': CATALOG_FORMAT,
+            'version': CATALOG_VERSION,
+            'variants': sum(r['variants'] for r in runs),
+            'next_run': self.manifest['next_run'] + 1,
+            'runs': runs,
+        }
+        # the manifest is replaced at once, readers see the runs before or after the write
+        fd, tmp_manifest = tempfile.mkstemp(prefix='.manifest_', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_manifest, os.path.join(self.path, MANIFEST))
+        for replaced in self.manifest['runs'][n_runs:]:
+            # the open maps keep the files of the merged runs until they are closed
+            shutil.rmtree(os.path.join(self.path, replaced['name']))
+        self._load()
+
+    def variants(self, ids: np.ndarray) -> pd.DataFrame:
+        """
+        Get the variants of IDs.
+
+        Parameters
+        ----------
+        ids : np.ndarray
+            IDs of the catalog, without -1.
+
+        Returns
+        -------
+        pd.DataFrame
+            CHR, BP, EA and NEA of the variants, EA and NEA are the sorted alleles, as in `make_SNPID_unique`.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        keys = np.zeros(len(ids), dtype=np.uint64)
+        # the IDs of a run follow those of the older runs
+        for start, run in zip(self.starts, self.runs):
+            in_run = (ids >= start) & (ids < start + len(run['by_id']))
+            keys[in_run] = run['by_id'][ids[in_run] - start]
+        pairs = np.array(list(self.pairs), dtype=object)
+        alleles = pd.Series(lookup(pairs, (keys & np.uint64((1 << PAIR_BITS) - 1)).astype(np.int64), None))
+        alleles = alleles.str.split('-', n=1, expand=True)
+        return pd.DataFrame(
+            {
+                ColName.CHR: (keys >> np.uint64(BP_BITS + PAIR_BITS)).astype(np.int64),
+                ColName.BP: ((keys >> np.uint64(PAIR_BITS)) & np.uint64((1 << BP_BITS) - 1)).astype(np.int64),
+                ColName.EA: alleles[0].to_numpy(),
+                ColName.NEA: alleles[1].to_numpy(),
+            }
+        )
+
+
+def add_variant_ids(sumstats: pd.DataFrame, catalog: Union[VariantCatalog, str], grow: bool = True) -> pd.DataFrame:
+    """
+    Add the VARID column of a catalog to summary statistics.
+
+    Parameters
+    ----------
+    sumstats : pd.DataFrame
+        The munged summary statistics.
+    catalog : Union[VariantCatalog, str]
+        The catalog, or its directory.
+    grow : bool, optional
+        Add the new variants to the catalog, by default True. Otherwise they get VARID -1.
+
+    Returns
+    -------
+    pd.DataFrame
+        The summary statistics, with VARID as the last column.
+    """
+    if isinstance(catalog, str):
+        catalog = VariantCatalog(catalog)
+    df = sumstats.copy()
+    df[ColName.VARID] = catalog.add(df) if grow else catalog.lookup(df)
+    return df
+
+
+def shared_variant_ids(*frames: pd.DataFrame) -> np.ndarray:
+    """Get the VARIDs present in all frames, sorted, with integer set operations."""
+    shared: Optional[np.ndarray] = None
+    for df in frames:
+        ids = df[ColName.VARID].to_numpy(dtype=np.int64)
+        ids = np.unique(ids[ids >= 0])
+        shared = ids if shared is None else np.intersect1d(shared, ids, assume_unique=True)
+    return shared if shared is not None else np.empty(0, dtype=np.int64)
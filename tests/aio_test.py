@@ -0,0 +1,85 @@
+"""Tests for the asyncio API."""
+
+import asyncio
+
+import pandas as pd
+import pytest
+
+import smunger.aio
+from smunger.aio import annotate_rsid_async, close_batchers, harmonize_async
+from smunger.annotate import annotate_rsid_frame
+from smunger.batch import Batcher
+from smunger.smunger import harmonize
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_annotate_rsid_async(database):
+    """Test concurrent calls give the same results as the synchronous API."""
+    df = pd.read_csv(CATALOG, sep="\t").drop(columns="rsID").sample(200, random_state=1)
+    loci = [df.iloc[i : i + 20] for i in range(0, len(df), 20)]
+
+    async def run():
+        return await asyncio.gather(*[annotate_rsid_async(locus, database) for locus in loci])
+
+    for locus, result in zip(loci, asyncio.run(run())):
+        expected = annotate_rsid_frame(locus, database)
+        assert list(result.columns) == list(expected.columns)
+        assert list(result["rsID"].fillna("")) == list(expected["rsID"].fillna(""))
+
+
+def test_harmonize_async():
+    """Test harmonizing in the executor."""
+    df = pd.read_csv(CATALOG, sep="\t")
+    sumstat1, sumstat2 = df.iloc[:500], df.iloc[250:750]
+    result = asyncio.run(harmonize_async(sumstat1, sumstat2))
+    pd.testing.assert_frame_equal(result, harmonize(sumstat1, sumstat2))
+
+
+def test_batcher_bad_request():
+    """Test a bad request fails alone, the other requests of its batch get their results."""
+
+    def double(df):
+        if (df["x"] < 0).any():
+            raise ValueError("negative")
+        return df.assign(y=df["x"] * 2)
+
+    batcher = Batcher(double, max_wait=0.5)
+    futures = [batcher.submit(pd.DataFrame({"x": [i, i + 1]})) for i in [1, -5, 3]]
+    assert futures[0].result()["y"].tolist() == [2, 4]
+    assert futures[2].result()["y"].tolist() == [6, 8]
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert batcher.n_batches == 1
+    batcher.close()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_batcher_base_exception():
+    """Test a BaseException in a batch resolves its futures and stops the batcher."""
+
+    def stop(df):
+        raise SystemExit("stop")
+
+    batcher = Batcher(stop, max_wait=0.5)
+    futures = [batcher.submit(pd.DataFrame({"x": [i]})) for i in range(3)]
+    for future in futures:
+        with pytest.raises(SystemExit):
+            future.result(timeout=5)
+    batcher._thread.join(timeout=5)
+    assert not batcher.alive
+    with pytest.raises(RuntimeError):
+        batcher.submit(pd.DataFrame({"x": [0]}))
+    batcher.close()
+
+
+def test_close_batchers(database):
+    """Test the batchers of async calls are closed and recreated on the next call."""
+    df = pd.read_csv(CATALOG, sep="\t").drop(columns="rsID").iloc[:20]
+    close_batchers()
+    asyncio.run(annotate_rsid_async(df, database))
+    assert len(smunger.aio._batchers) == 1
+    close_batchers()
+    assert len(smunger.aio._batchers) == 0
+    assert len(asyncio.run(annotate_rsid_async(df, database))) == len(df)
+    close_batchers()
@@ -0,0 +1,57 @@
+"""Tests for the allele engine."""
+
+import numpy as np
+import pandas as pd
+
+from smunger.allele import AlleleMatch, encode_alleles, match_alleles, palindromic
+from smunger.smunger import harmonize, munge_allele
+
+
+def test_encode_alleles():
+    """Test encoding alleles against a shared vocabulary."""
+    (ea, nea), vocab = encode_alleles(["a", "C", None], ["A", "g", "C"])
+    assert list(vocab[ea[:2]]) == ["A", "C"]
+    assert ea[2] == -1
+    assert list(vocab[nea]) == ["A", "G", "C"]
+
+
+def test_munge_allele():
+    """Test munging allele columns."""
+    df = pd.DataFrame({"EA": ["a", "C", "N", None, "AT", "A"], "NEA": ["t", "C", "A", "G", "G", "G"]})
+    out = munge_allele(df)
+    assert list(out["EA"]) == ["A", "AT", "A"]
+    assert list(out["NEA"]) == ["T", "G", "G"]
+    out = munge_allele(df, remove_palindromic=True)
+    assert list(out["EA"]) == ["AT", "A"]
+
+
+def test_palindromic():
+    """Test palindromic variants."""
+    (ea, nea), vocab = encode_alleles(["A", "C", "A", "AC"], ["T", "G", "G", "GT"])
+    assert list(palindromic(ea, nea, vocab)) == [True, True, False, True]
+
+
+def test_match_alleles():
+    """Test matching alleles with swaps and strand flips."""
+    status = match_alleles(
+        ["A", "A", "A", "A", "A"], ["G", "G", "G", "G", "G"], ["A", "G", "T", "C", "T"], ["G", "A", "C", "T", "G"]
+    )
+    assert list(status) == [
+        AlleleMatch.MATCH,
+        AlleleMatch.SWAP,
+        AlleleMatch.FLIP,
+        AlleleMatch.FLIP_SWAP,
+        AlleleMatch.MISMATCH,
+    ]
+
+
+def test_harmonize_strand_flip():
+    """Test harmonizing with strand flips."""
+    pos = {"CHR": [1, 1, 1], "BP": [10, 20, 30], "BETA": [0.1, 0.2, 0.3]}
+    df1 = pd.DataFrame({**pos, "EA": ["A", "A", "A"], "NEA": ["G", "T", "G"]})
+    df2 = pd.DataFrame({**pos, "EA": ["C", "A", "T"], "NEA": ["T", "T", "C"]})
+    merged = harmonize(df1, df2)
+    assert merged.shape[0] == 1
+    merged = harmonize(df1, df2, strand_flip=True)
+    assert list(merged["BP"]) == [10, 30]
+    assert np.allclose(merged["BETA_2"], [-0.1, 0.3])
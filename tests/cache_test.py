@@ -0,0 +1,52 @@
+"""Tests for the stage cache."""
+
+import os
+
+import pandas as pd
+
+from smunger.cache import StageCache, frame_digest
+from smunger.smunger import munge
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_stage_cache(tmp_path):
+    """Test outputs are keyed by content and evicted by size."""
+    cache = StageCache(str(tmp_path), max_bytes=10**9)
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    key = cache.key("stage", 1, {"x": 1}, frame_digest(df))
+    assert key != cache.key("stage", 2, {"x": 1}, frame_digest(df))
+    assert key != cache.key("stage", 1, {"x": 1}, frame_digest(df.iloc[:2]))
+    assert cache.get(key) is None
+    cache.put(key, df)
+    pd.testing.assert_frame_equal(cache.get(key), df)
+    cache.max_bytes = os.path.getsize(tmp_path / f"{key}.pkl")
+    os.utime(tmp_path / f"{key}.pkl", (0, 0))
+    cache.put("other", df)
+    assert cache.get(key) is None and cache.get("other") is not None
+
+
+def test_munge_cached(tmp_path):
+    """Test munging with cached chunks gives the same results and reuses unchanged chunks."""
+    df = pd.read_csv(CATALOG, sep="\t")
+    expected = munge(df)
+    cache = StageCache(str(tmp_path))
+    pd.testing.assert_frame_equal(munge(df, cache=cache, chunksize=3000), expected)
+    n_chunks = cache.misses
+    changed = df.copy()
+    changed.loc[len(df) - 1, "P"] = 0.5
+    munge(changed, cache=cache, chunksize=3000)
+    assert cache.hits == n_chunks - 1
+
+
+def test_stage_cache_unreadable(tmp_path):
+    """Test a truncated entry is removed and recomputed."""
+    cache = StageCache(str(tmp_path))
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    cache.put("stage", df)
+    path = tmp_path / "stage.pkl"
+    path.write_bytes(path.read_bytes()[:20])
+    assert cache.get("stage") is None and cache.misses == 1
+    assert not path.exists()
+    cache.put("stage", df)
+    pd.testing.assert_frame_equal(cache.get("stage"), df)
@@ -0,0 +1,58 @@
+"""Tests for checkpointed jobs."""
+
+import pytest
+
+import smunger.annotate
+from smunger.annotate import annotate_rsid_file
+from smunger.checkpoint import JOURNAL_SUFFIX, Journal
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_journal_resume(tmp_path):
+    """Test a journal keeps its committed chunks, drops a torn line and checks the parameters."""
+    path = str(tmp_path / "out.txt.journal")
+    journal = Journal(path, {"chunksize": 10})
+    journal.commit(chunk=0, offset=100)
+    journal.commit(chunk=1, offset=200)
+    with open(path, "a") as f:
+        f.write('{"chunk": 2, "off')
+    assert Journal(path, {"chunksize": 10}, resume=True).entries == [
+        {"chunk": 0, "offset": 100},
+        {"chunk": 1, "offset": 200},
+    ]
+    with pytest.raises(ValueError):
+        Journal(path, {"chunksize": 20}, resume=True)
+    assert Journal(path, {"chunksize": 20}).committed == 0
+
+
+def test_annotate_rsid_resume(database, tmp_path, monkeypatch):
+    """Test an annotation job with checkpoints that died is resumed to the same output."""
+    expected = str(tmp_path / "expected.txt")
+    annotate_rsid_file(CATALOG, expected, database, chunksize=20000000)
+    outfile = str(tmp_path / "out.txt")
+    annotate = smunger.annotate.annotate_rsid
+    calls = []
+
+    def dying(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 4:
+            raise RuntimeError("preempted")
+        return annotate(*args, **kwargs)
+
+    monkeypatch.setattr(smunger.annotate, "annotate_rsid", dying)
+    with pytest.raises(RuntimeError):
+        annotate_rsid_file(CATALOG, outfile, database, chunksize=20000000)
+    assert not (tmp_path / ("out.txt" + JOURNAL_SUFFIX)).exists()
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        annotate_rsid_file(CATALOG, outfile, database, chunksize=20000000, checkpoint=True)
+    with open(outfile + JOURNAL_SUFFIX) as f:
+        assert len(f.read().splitlines()) == 4
+    with open(outfile, "a") as f:
+        f.write("half-written\tchunk")
+    monkeypatch.setattr(smunger.annotate, "annotate_rsid", annotate)
+    annotate_rsid_file(CATALOG, outfile, database, chunksize=20000000, resume=True)
+    with open(outfile) as f, open(expected) as g:
+        assert f.read() == g.read()
+    assert not (tmp_path / ("out.txt" + JOURNAL_SUFFIX)).exists()
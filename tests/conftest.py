@@ -0,0 +1,25 @@
+"""Shared fixtures."""
+
+import shutil
+
+import pandas as pd
+import pytest
+
+from smunger.io import compress, index
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+@pytest.fixture(scope="session")
+def database(tmp_path_factory):
+    """Build a small dbSNP from the example catalog."""
+    if shutil.which("bgzip") is None or shutil.which("tabix") is None:
+        pytest.skip("bgzip and tabix are required.")
+    df = pd.read_csv(CATALOG, sep="\t").iloc[::2]
+    rsid = [f"rs{i}" for i in range(len(df))]
+    pos2snp = pd.DataFrame({"chr": df["CHR"], "bp": df["BP"], "rsid": rsid, "ref": df["NEA"], "alt": df["EA"]})
+    filename = str(tmp_path_factory.mktemp("dbsnp") / "pos2snp.txt")
+    pos2snp.to_csv(filename, sep="\t", index=False, header=False)
+    compress(filename)
+    index(filename + ".gz", skip=0)
+    return filename + ".gz"
@@ -0,0 +1,28 @@
+"""Tests for the external merge sort."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from smunger.extsort import int_column_key, merge_runs, write_run
+
+
+def test_merge_runs(tmp_path):
+    """Test runs are merged by an integer column, in one pass and in several passes of a few open runs."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"name": [f"v{i}" for i in range(1000)], "BP": rng.integers(1, 10**9, 1000)})
+    runs = []
+    for ith, start in enumerate(range(0, len(df), 120)):
+        run_df = df.iloc[start : start + 120].sort_values("BP", kind="mergesort")
+        runs.append(write_run(run_df, str(tmp_path / f"run{ith}.txt"), sync=ith == 0))
+    expected = df.sort_values("BP", kind="mergesort").to_csv(sep="\t", index=False, header=False)
+    for max_open in [256, 2]:
+        tmpdir = tmp_path / f"merge{max_open}"
+        tmpdir.mkdir()
+        with open(tmp_path / "out.txt", "w") as f:
+            merge_runs(runs, f, int_column_key(1), max_open=max_open, tmpdir=str(tmpdir))
+        assert (tmp_path / "out.txt").read_text() == expected
+        # intermediate runs are removed, the input runs are kept
+        assert os.listdir(tmpdir) == []
+        assert all(os.path.exists(run) for run in runs)
@@ -0,0 +1,82 @@
+"""Tests for Arrow and Polars frames in the public functions."""
+
+import pandas as pd
+import pytest
+
+from smunger.allele import encode_alleles
+from smunger.frames import arrow_to_pandas, frame_kind, from_pandas_frame
+from smunger.smunger import harmonize, munge
+
+
+def make_sumstats() -> pd.DataFrame:
+    """Make a small summary statistics."""
+    return pd.DataFrame(
+        {
+            "CHR": ["chr1", "1", "X", "2"],
+            "BP": [100, 200, 300, 400],
+            "EA": ["A", "c", "G", "T"],
+            "NEA": ["G", "T", "A", "C"],
+            "P": [1e-300, 0.5, 0.01, 0.2],
+            "BETA": [0.1234, -0.5, 0.25, 0.1],
+            "SE": [0.01, 0.1, 0.2, 0.1],
+        }
+    )
+
+
+def test_encode_string_alleles():
+    """Test string columns are encoded like object columns."""
+    ea = pd.Series(["A", "c", None, "G"], dtype="string")
+    nea = pd.Series(["G", "T", "A", None], dtype=object)
+    (ea_codes, nea_codes), vocab = encode_alleles(ea, nea, sort=True)
+    (ea_obj, nea_obj), vocab_obj = encode_alleles(ea.astype(object), nea, sort=True)
+    assert list(vocab) == list(vocab_obj) == ["A", "C", "G", "T"]
+    assert list(ea_codes) == list(ea_obj) == [0, 1, -1, 2]
+    assert list(nea_codes) == list(nea_obj)
+
+
+def test_munge_arrow():
+    """Test munge takes and returns a pyarrow Table."""
+    pa = pytest.importorskip("pyarrow")
+    table = pa.Table.from_pandas(make_sumstats(), preserve_index=False)
+    result = munge(table, compact=True)
+    assert frame_kind(result) == "arrow"
+    assert result.schema.field("CHR").type == pa.int8()
+    expected = munge(make_sumstats(), compact=True)
+    pd.testing.assert_frame_equal(
+        result.to_pandas().astype(str), expected.reset_index(drop=True).astype(str), check_dtype=False
+    )
+
+
+def test_arrow_to_pandas():
+    """Test Arrow strings become Arrow-backed pandas strings and dictionaries categoricals, and convert back."""
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table(
+        {
+            "EA": pa.array(["A", None, "G"]),
+            "NEA": pa.array(["C", "T", "A"]).dictionary_encode(),
+            "BP": pa.array([1, 2, 3], pa.int64()),
+        }
+    )
+    df = arrow_to_pandas(table)
+    assert isinstance(df["EA"].dtype, pd.StringDtype)
+    assert isinstance(df["NEA"].dtype, pd.CategoricalDtype)
+    assert all(dtype != object for dtype in df.dtypes)
+    back = from_pandas_frame(df, "arrow")
+    assert back.column("EA").to_pylist() == ["A", None, "G"]
+    assert pa.types.is_dictionary(back.column("NEA").type)
+
+
+def test_munge_polars_frame():
+    """Test munge and harmonize take and return Polars frames."""
+    pl = pytest.importorskip("polars")
+    pytest.importorskip("pyarrow")
+    frame = pl.from_pandas(make_sumstats())
+    result = munge(frame)
+    assert frame_kind(result) == "polars"
+    expected = munge(make_sumstats())
+    pd.testing.assert_frame_equal(
+        result.to_pandas().astype(str), expected.reset_index(drop=True).astype(str), check_dtype=False
+    )
+    merged = harmonize(result, result)
+    assert frame_kind(merged) == "polars"
+    assert merged.height == len(expected)
@@ -0,0 +1,82 @@
+"""Tests for reading and writing files."""
+
+import gzip
+import io
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+import smunger.bgzf
+from smunger.bgzf import GzipReader, is_bgzf
+from smunger.io import load_sumstats, save_sumstats
+from smunger.smunger import extract_cols, munge
+
+BGZF_FILE = "tests/exampledata/test.munged.txt.gz"
+GZIP_FILE = "tests/exampledata/test.txt.gz"
+HEADER = "tests/exampledata/test.header.json"
+
+
+def test_load_sumstats_bgzf():
+    """Test loading a bgzipped file with parallel decompression."""
+    with open(BGZF_FILE, "rb") as f:
+        assert is_bgzf(f.read(18))
+    expected = pd.read_csv(BGZF_FILE, sep="\t")
+    pd.testing.assert_frame_equal(load_sumstats(BGZF_FILE, threads=2), expected)
+    assert load_sumstats(BGZF_FILE, nrows=5).shape == (5, expected.shape[1])
+
+
+def test_load_sumstats_gzip():
+    """Test loading a gzipped file with pipelined decompression."""
+    with open(GZIP_FILE, "rb") as f:
+        assert not is_bgzf(f.read(18))
+    with gzip.open(GZIP_FILE, "rt") as f:
+        expected = pd.read_csv(f, sep="\t")
+    pd.testing.assert_frame_equal(load_sumstats(GZIP_FILE), expected)
+
+
+def test_load_sumstats_gzip_members(tmp_path, monkeypatch):
+    """Test a gzip member ending one byte before a read keeps the magic of the next member."""
+    first = gzip.compress(b"A\tB\n1\t2\n", mtime=0)
+    filename = tmp_path / "members.txt.gz"
+    filename.write_bytes(first + gzip.compress(b"3\t4\n", mtime=0) + b"\0" * 3)
+    monkeypatch.setattr(smunger.bgzf, "READ_SIZE", len(first) + 1)
+    assert load_sumstats(str(filename), sep="\t").values.tolist() == [[1, 2], [3, 4]]
+
+
+def test_gzip_reader_garbage(monkeypatch):
+    """Test a gzip reader stops at trailing garbage instead of buffering it."""
+    monkeypatch.setattr(smunger.bgzf, "READ_SIZE", 16)
+    fileobj = io.BytesIO(gzip.compress(b"A\tB\n1\t2\n", mtime=0) + b"\0" * 20 + b"garbage" * 1000)
+    with GzipReader(fileobj) as reader:
+        assert reader.read() == b"A\tB\n1\t2\n"
+        assert fileobj.tell() < 100
+
+
+def test_munge_pipe(tmp_path):
+    """Test munging from stdin to stdout gives the saved file, with logs on stderr."""
+    command = [sys.executable, "-c", "from smunger.cli import app; app()", "munge", "-", "-", HEADER]
+    with open(GZIP_FILE, "rb") as f:
+        result = subprocess.run(command, stdin=f, capture_output=True, check=True)
+    save_sumstats(munge(extract_cols(load_sumstats(GZIP_FILE), HEADER)), str(tmp_path / "munged.txt"), bgzipped=False)
+    with open(tmp_path / "munged.txt", "rb") as f:
+        assert result.stdout == f.read()
+    assert b"smunger" in result.stderr
+
+
+def test_load_sumstats_pipe_header():
+    """Test the separator is detected from a header written to a pipe in small pieces."""
+    code = (
+        "from smunger.io import load_sumstats; print('ready', flush=True); "
+        "df = load_sumstats('-'); print(','.join(df.columns), len(df))"
+    )
+    with subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
+        assert proc.stdout.readline() == b"ready\n"
+        header = b"CHR\tBP\tEA\tNEA\tP\n"
+        for i in range(0, len(header), 3):
+            proc.stdin.write(header[i: i + 3])
+            proc.stdin.flush()
+            time.sleep(0.05)
+        stdout, _ = proc.communicate(b"1\t100\tA\tG\t0.5\n1\t200\tC\tT\t0.1\n")
+    assert stdout.split() == [b"CHR,BP,EA,NEA,P", b"2"]
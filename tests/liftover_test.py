@@ -0,0 +1,87 @@
+"""Tests for liftover."""
+
+import os
+from importlib import import_module
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from smunger.checkpoint import JOURNAL_SUFFIX
+from smunger.liftover import liftover_file
+
+# the package exports the liftover function under the name of its module
+liftover_module = import_module("smunger.liftover")
+
+
+class FakeLifter:
+    """Shuffle positions within chromosomes, positions divisible by 7 fail liftover."""
+
+    def query(self, chrom, pos):
+        """Lift a position."""
+        return [] if pos % 7 == 0 else [(chrom, pos * 7919 % 50000000 + 1, "+")]
+
+
+@pytest.fixture()
+def lifted(tmp_path, monkeypatch):
+    """Write variants and their expected liftover, sorted by chromosome and position."""
+    monkeypatch.setattr(liftover_module, "load_lifter", lambda inbuild, outbuild: FakeLifter())
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "CHR": rng.integers(1, 4, 3000),
+            "BP": rng.integers(1000000, 50000000, 3000),
+            "EA": "A",
+            "NEA": "G",
+            "P": rng.random(3000).round(6),
+        }
+    )
+    infile = str(tmp_path / "in.txt")
+    df.to_csv(infile, sep="\t", index=False)
+    expected = df[df["BP"] % 7 != 0].assign(BP=lambda x: x["BP"] * 7919 % 50000000 + 1)
+    expected = expected.sort_values(["CHR", "BP"], kind="mergesort")
+    return infile, expected.to_csv(sep="\t", index=False)
+
+
+def test_liftover_file(lifted, tmp_path):
+    """Test the lifted output is sorted by chromosome and position, at the path given without bgzip."""
+    infile, expected = lifted
+    outfile = tmp_path / "out.txt.gz"
+    liftover_file(infile, str(outfile), "hg19", "hg38", chunksize=500)
+    assert outfile.read_text() == expected
+    assert not (tmp_path / "out.txt").exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["in.txt", "out.txt.gz"]
+
+
+def test_liftover_file_resume(lifted, tmp_path, monkeypatch):
+    """Test a liftover with checkpoints that died is resumed from its committed runs, others leave nothing."""
+    infile, expected = lifted
+    outfile = str(tmp_path / "out.txt")
+    liftover = liftover_module.liftover
+    calls = []
+
+    def dying(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 4:
+            raise RuntimeError("preempted")
+        return liftover(*args, **kwargs)
+
+    monkeypatch.setattr(liftover_module, "liftover", dying)
+    with pytest.raises(RuntimeError):
+        liftover_file(infile, outfile, "hg19", "hg38", chunksize=500)
+    assert os.listdir(tmp_path) == ["in.txt"]
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        liftover_file(infile, outfile, "hg19", "hg38", chunksize=500, checkpoint=True)
+    with open(outfile + JOURNAL_SUFFIX) as f:
+        assert len(f.read().splitlines()) == 4
+    assert len(os.listdir(outfile + ".runs")) > 0
+
+    resumed = []
+    monkeypatch.setattr(liftover_module, "liftover", lambda *args: resumed.append(1) or liftover(*args))
+    liftover_file(infile, outfile, "hg19", "hg38", chunksize=500, resume=True)
+    assert len(resumed) == 3
+    with open(outfile) as f:
+        assert f.read() == expected
+    assert not os.path.exists(outfile + JOURNAL_SUFFIX)
+    assert not os.path.exists(outfile + ".runs")
@@ -0,0 +1,51 @@
+"""Tests for the definition of loci."""
+
+import os
+
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.io import save_sumstats
+from smunger.loci import define_loci, loci_file
+from smunger.smunger import get_sigdf, munge
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_define_loci():
+    """Test overlapping windows are merged and the lead SNP has the smallest P."""
+    sigdf = pd.DataFrame(
+        {
+            ColName.CHR: [1, 1, 1, 2, 1],
+            ColName.BP: [100, 1500, 5000, 100, 900],
+            ColName.EA: ["A", "C", "G", "T", "A"],
+            ColName.NEA: ["G", "T", "A", "C", "C"],
+            ColName.P: [1e-8, 1e-10, 1e-9, 1e-9, 1e-10],
+        }
+    )
+    loci = define_loci(sigdf, window=1000, threads=2)
+    assert loci[[ColName.CHR, "START", "END", "NSIG"]].values.tolist() == [
+        [1, 1, 2500, 3],
+        [1, 4000, 6000, 1],
+        [2, 1, 1100, 1],
+    ]
+    assert loci["LEAD_BP"].tolist() == [900, 5000, 100]
+
+
+def test_loci_file(tmp_path):
+    """Test extracts from tabix queries match extracts from the loaded sumstats."""
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    filename = str(tmp_path / "sumstats.txt.gz")
+    save_sumstats(df, filename)
+    loci = loci_file(filename, str(tmp_path / "indexed"), pval=1e-3, threads=2)
+    os.remove(filename + ".tbi")
+    os.remove(filename + ".pidx")
+    pd.testing.assert_frame_equal(loci_file(filename, str(tmp_path / "loaded"), pval=1e-3), loci)
+    assert len(loci) > 0
+    assert loci["NSIG"].sum() == len(get_sigdf(df, pval=1e-3))
+    bed = pd.read_csv(tmp_path / "indexed.bed", sep="\t")
+    assert (bed["START"] == loci["START"] - 1).all()
+    for name in bed["NAME"]:
+        indexed = pd.read_csv(tmp_path / "indexed" / f"{name}.txt.gz", sep="\t")
+        loaded = pd.read_csv(tmp_path / "loaded" / f"{name}.txt.gz", sep="\t")
+        pd.testing.assert_frame_equal(indexed, loaded)
@@ -0,0 +1,92 @@
+"""Tests for munging summary statistics."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from smunger.smunger import (
+    compact_dtypes,
+    dedup_sumstats,
+    duplicate_clusters,
+    fits_float32,
+    munge,
+    sort_sumstats,
+    validate_sumstats,
+)
+
+
+def make_sumstats() -> pd.DataFrame:
+    """Make a small summary statistics."""
+    return pd.DataFrame(
+        {
+            "CHR": ["chr1", "1", "X", "2"],
+            "BP": [100, 200, 300, 400],
+            "EA": ["A", "c", "G", "T"],
+            "NEA": ["G", "T", "A", "C"],
+            "P": [1e-300, 0.5, 0.01, 0.2],
+            "BETA": [0.1234, -0.5, 0.25, 0.1],
+            "SE": [0.01, 0.1, 0.2, 0.1],
+        }
+    )
+
+
+def test_munge_compact_dtypes():
+    """Test munged summary statistics keep the default column types, and use compact ones on request."""
+    assert munge(make_sumstats())["CHR"].dtype == np.int64
+    df = munge(make_sumstats(), compact=True)
+    assert df["CHR"].dtype == np.int8
+    assert df["BP"].dtype == np.int32
+    assert isinstance(df["EA"].dtype, pd.CategoricalDtype)
+    assert df["P"].dtype == np.float64
+    assert list(df["CHR"]) == [1, 1, 2, 23]
+
+
+def test_fits_float32():
+    """Test float32 is only used when values are written identically."""
+    assert fits_float32(np.array([0.1234, -6.263e-02, np.nan, 0]))
+    assert not fits_float32(np.array([0.123456789]))
+    assert not fits_float32(np.array([1e-300]))
+    df = compact_dtypes(munge(make_sumstats()), float32=True)
+    assert df["BETA"].dtype == np.float32
+    assert df["P"].dtype == np.float64
+
+
+def test_dedup_policies():
+    """Test each dedup policy keeps the expected copy and reports the clusters."""
+    df = pd.DataFrame(
+        {
+            "CHR": [1, 1, 1, 1, 2],
+            "BP": [100, 100, 100, 200, 100],
+            "EA": ["A", "G", "A", "C", "A"],
+            "NEA": ["G", "A", "C", "T", "G"],
+            "P": [0.01, 0.001, 0.5, 0.2, 0.3],
+            "N": [500, 100, 300, 400, 200],
+        }
+    )
+    validated = validate_sumstats(df)
+    assert dedup_sumstats(validated, "min_p").index.tolist() == [1, 2, 3, 4]
+    assert dedup_sumstats(validated, "max_n").index.tolist() == [0, 2, 3, 4]
+    assert dedup_sumstats(validated, "drop").index.tolist() == [2, 3, 4]
+    with pytest.raises(ValueError):
+        dedup_sumstats(validated, "max_info")
+    report = duplicate_clusters(validated, "min_p")
+    assert report.values.tolist() == [["1-100-A-G", 2, "0,1", 1]]
+    munged = munge(df, dedup="max_n")
+    assert munged["P"].tolist() == [0.01, 0.5, 0.2, 0.3]
+
+
+def test_munge_workers():
+    """Test munging blocks of rows on several processes gives the same results."""
+    df = pd.read_csv("tests/exampledata/catalog.munged.txt.gz", sep="\t")
+    pd.testing.assert_frame_equal(munge(df, workers=3, chunksize=2000), munge(df))
+
+
+def test_sort_sumstats():
+    """Test positions are sorted stably, and sorted as they are when missing or non-numeric."""
+    df = pd.DataFrame({"CHR": [2, 1, 1, 1], "BP": [5, 9, 3, 3], "P": [0.1, 0.2, 0.3, 0.01]})
+    assert sort_sumstats(df).index.tolist() == [2, 3, 1, 0]
+    assert sort_sumstats(df, by_p=True).index.tolist() == [3, 2, 1, 0]
+    missing = df.assign(BP=[5, np.nan, 3, 3])
+    assert sort_sumstats(missing).index.tolist() == [2, 3, 1, 0]
+    text = df.assign(CHR=["2", "1", "1", "X"])
+    assert sort_sumstats(text).index.tolist() == [2, 1, 0, 3]
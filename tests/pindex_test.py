@@ -0,0 +1,47 @@
+"""Tests for the P-sorted index."""
+
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.io import save_sumstats
+from smunger.pindex import line_offsets, read_sigsnps
+from smunger.region import BgzfFile
+from smunger.smunger import munge
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_line_offsets():
+    """Test virtual offsets point to the starts of lines."""
+    offsets = line_offsets(CATALOG)
+    with BgzfFile(CATALOG) as f:
+        lines = [f.read_line(int(voffset)) for voffset in offsets]
+    expected = pd.read_csv(CATALOG, sep="\t", dtype=str, keep_default_na=False)
+    assert len(lines) == len(expected) + 1
+    assert lines[-1].decode().split("\t") == expected.iloc[-1].tolist()
+
+
+def test_read_sigsnps(tmp_path):
+    """Test hits under a threshold and top hits are read from the index."""
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    filename = str(tmp_path / "sumstats.txt.gz")
+    save_sumstats(df, filename, build_index=False)
+    saved = pd.read_csv(filename, sep="\t")
+    expected = saved[saved[ColName.P] < 1e-3].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_sigsnps(filename, pval=1e-3), expected)
+    top = read_sigsnps(filename, pval=None, top_k=10)
+    assert len(top) == 10
+    assert top[ColName.P].max() <= saved[ColName.P].nsmallest(10).max()
+
+
+def test_read_sigsnps_as_written(tmp_path):
+    """Test the index holds P values as written, so thresholds agree with the file."""
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    df[ColName.P] = 1e-2
+    df.loc[df.index[:3], ColName.P] = 4.9999996e-8
+    filename = str(tmp_path / "sumstats.txt.gz")
+    save_sumstats(df, filename, build_index=False)
+    saved = pd.read_csv(filename, sep="\t")
+    assert (saved[ColName.P] < 5e-8).sum() == 0
+    assert len(read_sigsnps(filename, pval=5e-8)) == 0
+    assert len(read_sigsnps(filename, pval=5.0000001e-8)) == 3
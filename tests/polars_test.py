@@ -0,0 +1,51 @@
+"""Tests for the polars backend."""
+
+import pandas as pd
+import pytest
+
+from smunger.smunger import extract_cols, harmonize, make_SNPID_unique, munge
+
+pytest.importorskip("polars")
+
+
+def as_text(df: pd.DataFrame) -> str:
+    """Format summary statistics as saved."""
+    return df.to_csv(sep="\t", index=False, float_format="%g")
+
+
+@pytest.mark.parametrize("dedup", ["min_p", "drop"])
+def test_munge_polars(dedup):
+    """Test the polars backend munges like the pandas backend."""
+    df = pd.read_csv("tests/exampledata/catalog.txt.gz", sep="\t")
+    df = extract_cols(df, "tests/exampledata/catalog.header.json")
+    df = pd.concat([df, df.iloc[::7]], ignore_index=True)
+    expected = munge(df, dedup=dedup)
+    result = munge(df, dedup=dedup, backend="polars")
+    assert as_text(result) == as_text(expected)
+
+
+def test_harmonize_polars():
+    """Test the polars backend harmonizes like the pandas backend."""
+    df = pd.read_csv("tests/exampledata/catalog.munged.txt.gz", sep="\t")
+    swapped = df.rename(columns={"EA": "NEA", "NEA": "EA"}).iloc[::2]
+    expected = harmonize(df, swapped)
+    result = harmonize(df, swapped, backend="polars")
+    assert as_text(result) == as_text(expected)
+
+
+def test_extract_cols_polars():
+    """Test the polars backend maps column names like the pandas backend."""
+    df = pd.read_csv("tests/exampledata/catalog.txt.gz", sep="\t")
+    expected = extract_cols(df, "tests/exampledata/catalog.header.json")
+    result = extract_cols(df, "tests/exampledata/catalog.header.json", backend="polars")
+    assert as_text(result) == as_text(expected)
+
+
+def test_make_SNPID_unique_polars():
+    """Test the polars backend makes the SNPIDs of the pandas backend."""
+    df = pd.read_csv("tests/exampledata/catalog.munged.txt.gz", sep="\t")
+    df = df.rename(columns={"EA": "NEA", "NEA": "EA"}).iloc[::3]
+    expected = make_SNPID_unique(df)
+    result = make_SNPID_unique(df, backend="polars")
+    assert result.index.equals(expected.index)
+    assert as_text(result) == as_text(expected)
@@ -0,0 +1,73 @@
+"""Tests for the per-stage profiler."""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from smunger.parallel import map_row_blocks, row_blocks
+from smunger.profiler import disable_profiling, enable_profiling, get_events, profiled, stage, write_trace
+
+
+@pytest.fixture()
+def profiling():
+    """Enable profiling during a test."""
+    enable_profiling()
+    yield
+    disable_profiling()
+
+
+@profiled("halve")
+def halve(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the first half of the rows."""
+    with stage("inner", rows_in=len(df)) as record:
+        record["rows_out"] = len(df) // 2
+    return df.iloc[: len(df) // 2]
+
+
+def test_stage_disabled():
+    """Test stages are not recorded without profiling."""
+    disable_profiling()
+    n_events = len(get_events())
+    halve(pd.DataFrame({"x": range(10)}))
+    with stage("outer", rows_in=1) as record:
+        record["rows_out"] = 1
+    assert record == {"rows_in": 1, "rows_out": 1}
+    assert len(get_events()) == n_events
+
+
+def test_stage_nesting(profiling):
+    """Test nested stages and decorated calls record their rows, inner stages end first within outer ones."""
+    with stage("outer", rows_in=10, chrom=1):
+        halve(pd.DataFrame({"x": range(10)}))
+    inner, decorated, outer = get_events()
+    assert [event["name"] for event in (inner, decorated, outer)] == ["inner", "halve", "outer"]
+    assert (inner["args"]["rows_in"], inner["args"]["rows_out"]) == (10, 5)
+    assert (decorated["args"]["rows_in"], decorated["args"]["rows_out"]) == (10, 5)
+    assert outer["args"]["chrom"] == 1 and outer["args"]["rows_out"] is None
+    for child, parent in [(inner, decorated), (decorated, outer)]:
+        assert parent["ts"] <= child["ts"] and child["ts"] + child["dur"] <= parent["ts"] + parent["dur"] + 1
+
+
+def test_write_trace(profiling, tmp_path):
+    """Test the trace is Chrome trace JSON with complete events."""
+    halve(pd.DataFrame({"x": range(4)}))
+    filename = tmp_path / "trace.json"
+    write_trace(str(filename))
+    trace = json.loads(filename.read_text())
+    assert trace["displayTimeUnit"] == "ms"
+    assert len(trace["traceEvents"]) == 2
+    for event in trace["traceEvents"]:
+        assert event["ph"] == "X" and event["cat"] == "smunger"
+        assert {"name", "ts", "dur", "pid", "tid", "args"} <= set(event)
+        assert event["dur"] >= 0 and event["args"]["wall_s"] >= 0 and event["args"]["peak_rss_mb"] > 0
+
+
+def test_worker_stages(profiling):
+    """Test the stages profiled in workers are merged into the profile, with the pids of the workers."""
+    parts = map_row_blocks(pd.DataFrame({"x": range(10)}), halve, row_blocks(10, 5), workers=2)
+    assert [len(part) for part in parts] == [2, 2]
+    events = [event for event in get_events() if event["name"] == "halve"]
+    assert len(events) == 2
+    assert all(event["pid"] != os.getpid() for event in events)
@@ -0,0 +1,76 @@
+"""Tests for building the dbSNP references."""
+
+import bz2
+import json
+import shutil
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from smunger.annotate import load_merge_map
+from smunger.reference import build_merged, build_reference
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+@pytest.fixture(scope="module")
+def dbsnp_vcf(tmp_path_factory):
+    """Make a small dbSNP VCF, with RefSeq contigs, a mitochondrion and multi-allelic records."""
+    if shutil.which("bgzip") is None or shutil.which("tabix") is None:
+        pytest.skip("bgzip and tabix are required.")
+    df = pd.read_csv(CATALOG, sep="\t")
+    chrom = np.where(np.arange(len(df)) < len(df) // 2, "NC_000001.11", "NC_000023.11")
+    alt = df["EA"].astype(str).to_numpy().astype(object)
+    alt[::10] = alt[::10] + ",T"
+    rsid = np.random.default_rng(0).integers(1, 10**9, len(df))
+    records = pd.DataFrame(
+        {"#CHROM": chrom, "POS": df["BP"], "ID": [f"rs{i}" for i in rsid], "REF": df["NEA"], "ALT": alt}
+    )
+    records = records.sort_values(["#CHROM", "POS"], kind="mergesort")
+    chr_m = pd.DataFrame({"#CHROM": ["NC_012920.1"], "POS": [100], "ID": ["rs5"], "REF": ["A"], "ALT": ["G"]})
+    records = pd.concat([records, chr_m]).assign(QUAL=".", FILTER=".", INFO=".")
+    filename = str(tmp_path_factory.mktemp("dbsnp") / "dbsnp.vcf")
+    with open(filename, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        records.to_csv(f, sep="\t", index=False)
+    subprocess.run(["bgzip", "-f", filename], check=True)
+    subprocess.run(["tabix", "-f", "-p", "vcf", filename + ".gz"], check=True)
+    return filename + ".gz", records
+
+
+def test_build_reference(dbsnp_vcf, tmp_path):
+    """Test the references are the split records, sorted by position and by rsid."""
+    vcf, records = dbsnp_vcf
+    pos2snp, snp2pos = build_reference(vcf, str(tmp_path), threads=2, chunksize=700)
+    expected = records[records["#CHROM"] != "NC_012920.1"].iloc[:, :5].copy()
+    expected["#CHROM"] = expected["#CHROM"].map({"NC_000001.11": "1", "NC_000023.11": "X"})
+    expected = expected.assign(ALT=expected["ALT"].str.split(",")).explode("ALT", ignore_index=True)
+    result = pd.read_csv(pos2snp, sep="\t", header=None, dtype=str)
+    assert result.values.tolist() == expected.astype(str).values.tolist()
+
+    number = expected["ID"].str.slice(2)
+    expected = expected.assign(digit=number.str.slice(0, 1), number=number.astype(np.int64))
+    expected = expected.sort_values(["digit", "number"], kind="mergesort")
+    result = pd.read_csv(snp2pos, sep="\t", header=None, dtype=str)
+    assert result[1].tolist() == expected["ID"].str.slice(2).tolist()
+    assert result[2].tolist() == expected["#CHROM"].tolist()
+
+
+def test_build_merged(tmp_path):
+    """Test the merge map of a multi-stream bz2 file, parsed in parallel batches."""
+    records = [
+        {"refsnp_id": "1", "merged_snapshot_data": {"merged_into": ["2"]}, "dbsnp1_merges": []},
+        {"refsnp_id": "2", "merged_snapshot_data": {"merged_into": ["3"]}, "dbsnp1_merges": [{"merged_rsid": "10"}]},
+        {"refsnp_id": "5", "merged_snapshot_data": {"merged_into": ["6"]}, "dbsnp1_merges": []},
+    ]
+    lines = [(json.dumps(record) + "\n").encode() for record in records]
+    merged_json = tmp_path / "refsnp-merged.json.bz2"
+    merged_json.write_bytes(bz2.compress(b"".join(lines[:2])) + bz2.compress(lines[2]))
+    for threads in [1, 2]:
+        database = build_merged(str(merged_json), str(tmp_path / str(threads)), threads=threads, batch_size=2)
+        assert database.endswith("merged_b156.npz")
+        load_merge_map.cache_clear()
+        retired, current = load_merge_map(database)
+        assert dict(zip(retired.tolist(), current.tolist())) == {1: 3, 2: 3, 5: 6, 10: 3}
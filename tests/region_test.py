@@ -0,0 +1,77 @@
+"""Tests for random-access region reads."""
+
+import shutil
+
+import pandas as pd
+import pytest
+
+from smunger.constant import ColName
+from smunger.io import export_sumstats, save_sumstats
+from smunger.region import BlockCache, TabixReader, clear_readers, get_reader, reg2bins
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_reg2bins():
+    """Test bins overlapping a region."""
+    assert reg2bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+    assert reg2bins(0, 1 << 14 + 1)[-2:] == [4681, 4682]
+
+
+def test_query():
+    """Test region queries return the same records as filtering the whole file."""
+    full = pd.read_csv(CATALOG, sep="\t")
+    with TabixReader(CATALOG, names=ColName.OUTCOLS) as reader:
+        for chrom, start, end in [(1, 1000000, 5000000), (6, 0, 300000000), (2, 5, 6), (99, 0, 100)]:
+            expected = full[(full[ColName.CHR] == chrom) & (full[ColName.BP] > start) & (full[ColName.BP] <= end)]
+            df = reader.query(chrom, start, end)
+            assert len(df) == len(expected)
+            assert list(df[ColName.BP]) == list(expected[ColName.BP])
+
+
+def test_export_sumstats():
+    """Test exporting a region."""
+    df = export_sumstats(CATALOG, chrom=1, start=1000000, end=5000000)
+    assert df[ColName.BP].between(1000001, 5000000).all()
+    assert list(df.columns) == ColName.OUTCOLS
+
+
+def test_block_cache():
+    """Test the cache is bounded by size and counts hits and misses."""
+    cache = BlockCache(max_bytes=10)
+    cache.put("a", 1, 6)
+    cache.put("b", 2, 4)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 4)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["nbytes"]) == (3, 1, 1, 10)
+
+
+def test_cached_query():
+    """Test repeated queries are served from the cache."""
+    cache = BlockCache()
+    with TabixReader(CATALOG, names=ColName.OUTCOLS, cache=cache) as reader:
+        first = reader.query(1, 1000000, 5000000)
+        misses = cache.stats()["misses"]
+        second = reader.query(1, 1000000, 5000000)
+    assert cache.stats()["misses"] == misses
+    assert cache.stats()["hits"] > 0
+    pd.testing.assert_frame_equal(first, second)
+    assert get_reader(CATALOG) is get_reader(CATALOG)
+
+
+def test_get_reader_rebuilt(tmp_path):
+    """Test a file rebuilt at the same path gets a new reader, and the readers are closed by clear_readers."""
+    if shutil.which("bgzip") is None or shutil.which("tabix") is None:
+        pytest.skip("bgzip and tabix are required.")
+    full = pd.read_csv(CATALOG, sep="\t")
+    filename = str(tmp_path / "sumstats.txt")
+    for df in [full, full.iloc[::2]]:
+        save_sumstats(df, filename, p_index=False)
+        reader = get_reader(filename + ".gz", names=ColName.OUTCOLS)
+        assert len(reader.query(1, 0, 300000000)) == (df[ColName.CHR] == 1).sum()
+    clear_readers()
+    assert reader._file.closed
+    assert get_reader(filename + ".gz", names=ColName.OUTCOLS) is not reader
@@ -0,0 +1,42 @@
+"""Tests for the annotation server."""
+
+import io
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from smunger.annotate import annotate_rsid_frame
+from smunger.server import AnnotationService, make_server
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_annotate_rsid_server(database):
+    """Test concurrent annotation requests give the same results as the library."""
+    df = pd.read_csv(CATALOG, sep="\t").drop(columns="rsID").sample(200, random_state=0)
+    requests = [df.iloc[i : i + 25] for i in range(0, len(df), 25)]
+    service = AnnotationService(database, max_wait=0.05)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/annotate/rsid"
+
+    def post(request):
+        body = request.to_csv(sep="\t", index=False).encode()
+        with urllib.request.urlopen(urllib.request.Request(url, data=body)) as resp:
+            return pd.read_csv(io.BytesIO(resp.read()), sep="\t")
+
+    try:
+        with ThreadPoolExecutor(len(requests)) as executor:
+            results = list(executor.map(post, requests))
+        stats = service.stats()["batchers"]["annotate_rsid:2000000"]
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+    for request, result in zip(requests, results):
+        expected = annotate_rsid_frame(request, database)
+        assert list(result["rsID"].fillna("")) == list(expected["rsID"].fillna(""))
+    assert sum(result["rsID"].notnull().sum() for result in results) > 0
+    assert stats["requests"] == len(requests) and stats["batches"] <= len(requests)
@@ -0,0 +1,63 @@
+"""Tests for the sharded layout."""
+
+import pandas as pd
+import pytest
+
+import smunger.shards
+from smunger.constant import ColName
+from smunger.io import export_sumstats, load_sumstats, read_chunks, save_sumstats
+from smunger.shards import read_manifest, stitch_shards, verify_shards
+from smunger.smunger import munge
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_shards(tmp_path):
+    """Test shards are read like a file and stitched back into the same file."""
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    save_sumstats(df, str(tmp_path / "sumstats.txt.gz"))
+    expected = load_sumstats(str(tmp_path / "sumstats.txt.gz"))
+    shards = str(tmp_path / "shards")
+    save_sumstats(df, shards, layout="shards", shard_span=50000000)
+    manifest = read_manifest(shards)
+    assert sum(shard["rows"] for shard in manifest["shards"]) == len(df)
+    assert len(manifest["shards"]) > df[ColName.CHR].nunique()
+    pd.testing.assert_frame_equal(load_sumstats(shards), expected)
+    pd.testing.assert_frame_equal(pd.concat(read_chunks(shards, 1000), ignore_index=True), expected)
+
+    region = export_sumstats(shards, chrom=1, start=90000000, end=101000000)
+    in_region = expected[(expected[ColName.CHR] == 1) & expected[ColName.BP].between(90000001, 101000000)]
+    assert len(region) == len(in_region) > 0
+
+    stitch_shards(shards, str(tmp_path / "stitched.txt.gz"))
+    with open(tmp_path / "stitched.txt.gz", "rb") as f1, open(tmp_path / "sumstats.txt.gz", "rb") as f2:
+        assert f1.read() == f2.read()
+
+    with open(tmp_path / "shards" / manifest["shards"][0]["file"], "ab") as f:
+        f.write(b"\0")
+    assert verify_shards(shards) == [manifest["shards"][0]["file"]]
+    with pytest.raises(ValueError):
+        stitch_shards(shards, str(tmp_path / "stitched.txt.gz"))
+
+
+def test_shard_spans(tmp_path, monkeypatch):
+    """Test span shards hold the 1-based positions of their names, and only the shards of nrows are read."""
+    df = munge(pd.read_csv(CATALOG, sep="\t").iloc[:4]).assign(CHR=1, BP=[1, 100, 101, 250])
+    shards = str(tmp_path / "shards")
+    save_sumstats(df, shards, layout="shards", shard_span=100, build_index=False, p_index=False)
+    manifest = read_manifest(shards)
+    assert [(shard["file"], shard["rows"]) for shard in manifest["shards"]] == [
+        ("chr1_1.txt.gz", 2),
+        ("chr1_101.txt.gz", 1),
+        ("chr1_201.txt.gz", 1),
+    ]
+    read = []
+    load = smunger.shards.load_sumstats
+
+    def counted(filename, **kwargs):
+        read.append(filename)
+        return load(filename, **kwargs)
+
+    monkeypatch.setattr(smunger.shards, "load_sumstats", counted)
+    assert load_sumstats(shards, nrows=2)[ColName.BP].tolist() == [1, 100]
+    assert len(read) == 1
@@ -0,0 +1,32 @@
+"""Tests for the memory-mapped store."""
+
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.io import save_sumstats
+from smunger.smunger import get_sigdf, make_SNPID_unique, munge
+from smunger.store import SumstatStore
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_store(tmp_path):
+    """Test region, lookup and top hits match filtering the loaded sumstats."""
+    df = munge(pd.read_csv(CATALOG, sep="\t"), compact=True).reset_index(drop=True)
+    save_sumstats(df, str(tmp_path / "store"), layout="store")
+    store = SumstatStore(str(tmp_path / "store"))
+    assert len(store) == len(df)
+    pd.testing.assert_frame_equal(store.to_frame(), df, check_categorical=False)
+
+    region = store.region(1, 1000000, 5000000)
+    expected = df[(df[ColName.CHR] == 1) & df[ColName.BP].between(1000000, 5000000)]
+    pd.testing.assert_frame_equal(region, expected.reset_index(drop=True), check_categorical=False)
+    assert len(store.region(99, 1, 100)) == 0
+
+    snpids = make_SNPID_unique(df.sample(50, random_state=0))[ColName.SNPID].tolist() + ["1-1-A-C"]
+    found = store.lookup(snpids)
+    assert found[ColName.SNPID].tolist() == snpids[:-1]
+    assert make_SNPID_unique(found.drop(columns=ColName.SNPID))[ColName.SNPID].tolist() == snpids[:-1]
+
+    expected = get_sigdf(df, pval=1e-5).reset_index(drop=True)
+    pd.testing.assert_frame_equal(store.top_hits(1e-5), expected, check_categorical=False)
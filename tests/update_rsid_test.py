@@ -0,0 +1,52 @@
+"""Tests for updating retired rsids."""
+
+import numpy as np
+import pandas as pd
+
+from smunger.annotate import load_merge_map, parse_rsids, update_rsid, update_rsid_file
+
+
+def write_merge_map(tmp_path) -> str:
+    """Write a merge history with a chain 1 -> 2 -> 3 -> 4 and a cycle 7 -> 8 -> 7."""
+    merged = pd.DataFrame({"first": [1, 2, 3, 5, 7, 8], "retired": [1, 2, 3, 5, 7, 8], "current": [2, 3, 4, 6, 8, 7]})
+    filename = str(tmp_path / "merged.txt")
+    merged.to_csv(filename, sep="\t", index=False, header=False)
+    return filename
+
+
+def test_load_merge_map(tmp_path):
+    """Test chains of merges are resolved."""
+    retired, current = load_merge_map(write_merge_map(tmp_path))
+    assert dict(zip(retired.tolist(), current.tolist())) == {1: 4, 2: 4, 3: 4, 5: 6}
+
+
+def test_update_rsid(tmp_path):
+    """Test retired rsids are updated and counted, in memory and per chunk of a file."""
+    database = write_merge_map(tmp_path)
+    df = pd.DataFrame({"rsID": ["rs1", "rs4", None, "1:100", "rs5", "rs3"], "P": [0.1] * 6})
+    updated = update_rsid(df, database)
+    assert updated["rsID"].fillna("NA").tolist() == ["rs4", "rs4", "NA", "1:100", "rs6", "rs4"]
+    assert updated.attrs["n_updated"] == 3
+    infile = str(tmp_path / "in.txt")
+    df.to_csv(infile, sep="\t", index=False)
+    assert update_rsid_file(infile, str(tmp_path / "out.txt"), database, chunksize=4) == 3
+    out = pd.read_csv(tmp_path / "out.txt", sep="\t")
+    assert out["rsID"].fillna("NA").tolist() == ["rs4", "rs4", "NA", "1:100", "rs6", "rs4"]
+
+
+def test_load_merge_map_cycle(tmp_path):
+    """Test rsids merged through a cycle of three, or into one, are not updated."""
+    database = str(tmp_path / "merged.npz")
+    np.savez(database, retired=np.array([1, 2, 3, 4, 5]), current=np.array([2, 3, 1, 1, 6]))
+    retired, current = load_merge_map(database)
+    assert dict(zip(retired.tolist(), current.tolist())) == {5: 6}
+    df = pd.DataFrame({"rsID": ["rs1", "rs2", "rs3", "rs4", "rs5"]})
+    assert update_rsid(df, database)["rsID"].tolist() == ["rs1", "rs2", "rs3", "rs4", "rs6"]
+
+
+def test_parse_rsids_width():
+    """Test over-long values are not rsids and do not widen the parsed array."""
+    rsids = pd.Series(["rs1", "rs" + "9" * 18, "rs" + "1" * 19, "rs12" + "x" * 100000, None, "rs2x"])
+    is_rs, numbers = parse_rsids(rsids)
+    assert is_rs.tolist() == [True, True, False, False, False, False]
+    assert numbers.tolist() == [1, int("9" * 18), 0, 0, 0, 0]
@@ -0,0 +1,105 @@
+"""Tests for the variant catalog."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from smunger.constant import ColName
+from smunger.io import check_header, export_sumstats, save_sumstats
+from smunger.smunger import harmonize, make_SNPID_unique, munge
+from smunger.variants import VariantCatalog, shared_variant_ids
+
+CATALOG = "tests/exampledata/catalog.munged.txt.gz"
+
+
+def test_catalog(tmp_path):
+    """Test IDs are stable as the catalog grows, and decode to the SNPIDs."""
+    path = str(tmp_path / "variants")
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    first, second = df.iloc[: len(df) // 2], df.iloc[len(df) // 4:]
+    ids = VariantCatalog(path).add(first)
+    assert sorted(ids.tolist()) == list(range(len(first)))
+    catalog = VariantCatalog(path)
+    ids2 = catalog.add(second)
+    assert len(catalog) == len(df)
+    assert ids2[: len(first) - len(df) // 4].tolist() == ids[len(df) // 4:].tolist()
+    assert (VariantCatalog(path).lookup(df) == catalog.lookup(df)).all()
+    decoded = make_SNPID_unique(catalog.variants(ids2))[ColName.SNPID].tolist()
+    assert decoded == make_SNPID_unique(second)[ColName.SNPID].tolist()
+    missing = pd.DataFrame({"CHR": [1, None], "BP": [1, 2], "EA": ["A", "C"], "NEA": ["C", "G"]})
+    assert catalog.lookup(missing).tolist() == [-1, -1]
+
+
+def test_harmonize_varid(tmp_path):
+    """Test sumstats with VARIDs are saved, checked and harmonized as with SNPIDs."""
+    path = str(tmp_path / "variants")
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    other = df.sample(frac=0.5, random_state=0).rename(columns={"EA": "NEA", "NEA": "EA"})
+    df1, df2 = munge(df, catalog=path), munge(other, catalog=path)
+    assert len(VariantCatalog(path)) == len(df)
+    save_sumstats(df1, str(tmp_path / "out.txt"), build_index=False, p_index=False)
+    assert check_header(str(tmp_path / "out.txt.gz"))
+
+    expected = harmonize(df, other).drop(columns=ColName.SNPID)
+    merged = harmonize(df1, df2).drop(columns=ColName.VARID)
+    pd.testing.assert_frame_equal(
+        merged.sort_values(["CHR", "BP", "BETA_1"]).reset_index(drop=True)[expected.columns],
+        expected.sort_values(["CHR", "BP", "BETA_1"]).reset_index(drop=True),
+        check_categorical=False,
+        check_dtype=False,
+    )
+    assert len(shared_variant_ids(df1, df2)) == len(merged)
+
+
+def test_export_varid(tmp_path):
+    """Test a region of a file saved with VARIDs is exported with them."""
+    path = str(tmp_path / "variants")
+    df = munge(pd.read_csv(CATALOG, sep="\t"), catalog=path)
+    save_sumstats(df, str(tmp_path / "out.txt"), p_index=False)
+    region = export_sumstats(str(tmp_path / "out.txt.gz"), chrom=1, start=1000000, end=5000000)
+    assert list(region.columns) == ColName.OUTCOLS + [ColName.VARID]
+    assert region[ColName.BP].between(1000001, 5000000).all()
+    assert (region[ColName.VARID].to_numpy() == VariantCatalog(path).lookup(region)).all()
+
+
+def _add(args):
+    path, start, end = args
+    df = munge(pd.read_csv(CATALOG, sep="\t")).iloc[start:end]
+    return VariantCatalog(path).add(df).tolist()
+
+
+def test_catalog_writers(tmp_path):
+    """Test processes adding to a catalog get distinct IDs, and a run left by a dead writer is removed."""
+    path = str(tmp_path / "variants")
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    bounds = [(path, ith * len(df) // 4, (ith + 2) * len(df) // 4) for ith in range(3)]
+    with ProcessPoolExecutor(max_workers=3) as executor:
+        list(executor.map(_add, bounds))
+    catalog = VariantCatalog(path)
+    ids = catalog.lookup(df)
+    assert sorted(ids.tolist()) == list(range(len(df)))
+
+    os.makedirs(os.path.join(path, ".run_dead"))
+    assert (VariantCatalog(path).lookup(df) == ids).all()
+    assert (VariantCatalog(path).add(df) == ids).all()
+    assert not os.path.exists(os.path.join(path, ".run_dead"))
+
+
+def test_catalog_runs(tmp_path):
+    """Test adds write runs of new variants, merged while the last runs are not larger, and compaction."""
+    path = str(tmp_path / "variants")
+    df = munge(pd.read_csv(CATALOG, sep="\t"))
+    catalog = VariantCatalog(path)
+    ids = catalog.add(df.iloc[:64])
+    for start in range(64, 88, 8):
+        ids = np.concatenate([ids, catalog.add(df.iloc[start: start + 8])])
+    # runs of 64, 16 and 8 variants
+    assert [run["variants"] for run in catalog.manifest["runs"]] == [64, 16, 8]
+    assert len(os.listdir(path)) == 4
+    assert (catalog.lookup(df.iloc[:88]) == ids).all()
+    assert (catalog.variants(ids)[ColName.BP] == df[ColName.BP].iloc[:88].to_numpy()).all()
+    catalog.compact()
+    assert [run["variants"] for run in catalog.manifest["runs"]] == [88]
+    assert (VariantCatalog(path).lookup(df.iloc[:88]) == ids).all()